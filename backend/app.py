@@ -1,14 +1,29 @@
 from flask import Flask
+from flask.cli import with_appcontext
+import click
 import os
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
-from flask_migrate import Migrate
+from flask_migrate import Migrate, stamp
+from sqlalchemy import inspect
 from config import config
 from models import db, User, File, Question, PasswordReset
 from auth import auth_bp
 from files import files_bp
 from questions import questions_bp
 from teacher import teacher_bp
+from search import init_search_index
+import extraction
+import user_cache
+import events
+import ratings
+import response_cache
+import engine_profiles
+import schema_check
+import sql_stats
+import metrics
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
 
 def create_app(config_name=None):
     print("Attempting to create Flask app...")
@@ -22,25 +37,41 @@ def create_app(config_name=None):
     
     # 初始化扩展
     db.init_app(app)
-    Migrate(app, db)
+    engine_profiles.init_app(app)
+    sql_stats.init_app(app)
+    metrics.init_app(app)
+    Migrate(app, db, directory=MIGRATIONS_DIR)
     CORS(app, resources={r"/api/*": {"origins": "*"}})
-    JWTManager(app)
+    jwt = JWTManager(app)
+    
+    user_cache.init_app(app, jwt)
+    extraction.init_app(app)
+    events.init_app(app, jwt)
+    ratings.init_app(app)
+    response_cache.init_app(app)
+    schema_check.init_app(app)
     
     # 注册蓝图
     app.register_blueprint(auth_bp)
     app.register_blueprint(files_bp)
     app.register_blueprint(questions_bp)
     app.register_blueprint(teacher_bp)
+    app.register_blueprint(events.events_bp)
+    app.register_blueprint(sql_stats.debug_bp)
+    app.register_blueprint(metrics.metrics_bp)
     
     # 健康检查端点
     @app.route('/api/health', methods=['GET'])
     def health():
         return {'code': 200, 'message': 'OK', 'status': 'healthy'}, 200
     
-    # 创建数据库表和默认管理员
-    with app.app_context():
-        db.create_all()
-        create_default_admin()
+    app.cli.add_command(init_db_command)
+    
+    # 开发和测试环境启动时自动建表和创建默认管理员；
+    # 生产环境多个 worker 同时启动会竞争，改为部署时执行一次 flask init-db
+    if app.config.get('AUTO_INIT_DB', True):
+        with app.app_context():
+            init_db()
     
     # 错误处理
     @app.errorhandler(404)
@@ -54,6 +85,43 @@ def create_app(config_name=None):
     
     return app
 
+def init_db():
+    """
+    创建数据库表、默认管理员和全文索引（可重复执行）
+
+    - 空数据库：create_all 建表后标记为最新迁移版本，之后的结构变更由 flask db upgrade 执行
+    - 已由迁移管理的数据库（有 alembic_version 表）：不执行 create_all，
+      否则新表会先于迁移创建，flask db upgrade 会因表已存在而失败
+    - 早于迁移的旧数据库：只补建缺失的表，不标记版本
+    """
+    tables = set(inspect(db.engine).get_table_names())
+    if not tables:
+        db.create_all()
+        stamp(directory=MIGRATIONS_DIR)
+    elif 'alembic_version' not in tables:
+        db.create_all()
+        print('! 数据库没有迁移版本记录，确认结构后执行 flask db stamp <版本> 再使用 flask db upgrade')
+    create_default_admin()
+    init_search_index()
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """部署时初始化数据库（建表、默认管理员、全文索引），已有数据库的结构变更使用 flask db upgrade"""
+    init_db()
+    click.echo('数据库初始化完成')
+
+
+def dispose_engine_after_fork(app):
+    """
+    在 fork 出的 worker 中丢弃从父进程继承的连接池（只丢弃引用，不关闭父进程的连接），
+    之后每个 worker 按需建立自己的连接
+    """
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
 def create_default_admin():
     """创建默认管理员账户"""
     admin = User.query.filter_by(username='admin').first()
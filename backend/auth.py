@@ -1,5 +1,5 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity, get_current_user
 from functools import wraps
 from models import db, User, PasswordReset
 from datetime import datetime, timedelta
@@ -262,7 +262,7 @@ def get_profile():
     """获取当前用户信息"""
     try:
         user_id = int(get_jwt_identity())  # JWT identity是字符串，转换为整数
-        user = User.query.get(user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
@@ -282,7 +282,7 @@ def update_profile():
     """更新当前用户信息"""
     try:
         user_id = int(get_jwt_identity())  # JWT identity是字符串，转换为整数
-        user = User.query.get(user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
@@ -328,7 +328,7 @@ def change_password():
     """修改密码"""
     try:
         user_id = int(get_jwt_identity())
-        user = User.query.get(user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
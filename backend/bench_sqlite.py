@@ -0,0 +1,182 @@
+"""
+SQLite 并发基准：比较各 SQLITE_PROFILE 下的读写吞吐和读请求延迟
+
+每个 profile 使用一个临时数据库文件和与应用相同的连接池参数：
+- 一个线程反复执行长写事务（模拟一次投递给全部学生的消息：INSERT ... SELECT 写入大量接收记录）
+- 若干线程执行短写事务（标记已读、更新未读数）
+- 若干线程执行读请求（按主键读未读数 + 收件箱第一页）
+
+回滚日志模式下读请求会在长写事务提交时被阻塞或报 database is locked，
+WAL 模式下读请求的延迟不受写事务影响。
+
+用法：python bench_sqlite.py [--seconds 10] [--readers 8] [--writers 2] [--fanout 20000] [--profiles default,wal,tuned]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from engine_profiles import PROFILES, resolve_pragmas, apply_pragmas
+from config import Config
+
+USERS = 20000
+
+SCHEMA = [
+    'CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT NOT NULL)',
+    'CREATE TABLE inbox_states (user_id INTEGER PRIMARY KEY, unread_count INTEGER NOT NULL DEFAULT 0)',
+    'CREATE TABLE message_recipients (id INTEGER PRIMARY KEY, message_id INTEGER NOT NULL, '
+    'recipient_id INTEGER NOT NULL, is_read BOOLEAN NOT NULL DEFAULT 0, created_at TIMESTAMP)',
+    'CREATE INDEX ix_message_recipients_recipient_id ON message_recipients (recipient_id)',
+]
+
+
+def make_engine(path, profile):
+    engine = create_engine(f'sqlite:///{path}', **Config.SQLALCHEMY_ENGINE_OPTIONS)
+    apply_pragmas(engine, resolve_pragmas(profile))
+    return engine
+
+
+def seed(engine):
+    with engine.begin() as conn:
+        for statement in SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text('INSERT INTO users (id, username) VALUES (:id, :name)'),
+                     [{'id': i, 'name': f'user{i}'} for i in range(1, USERS + 1)])
+        conn.execute(text('INSERT INTO inbox_states (user_id, unread_count) SELECT id, 0 FROM users'))
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+        self.broadcasts = 0
+        self.errors = 0
+        self.read_latencies = []
+
+    def add(self, field, latency=None):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+            if latency is not None:
+                self.read_latencies.append(latency)
+
+
+def broadcaster(engine, stats, stop, fanout):
+    message_id = 0
+    while not stop.is_set():
+        message_id += 1
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    'INSERT INTO message_recipients (message_id, recipient_id, is_read, created_at) '
+                    'SELECT :message_id, id, 0, CURRENT_TIMESTAMP FROM users WHERE id <= :fanout'
+                ), {'message_id': message_id, 'fanout': fanout})
+                conn.execute(text(
+                    'UPDATE inbox_states SET unread_count = unread_count + 1 WHERE user_id <= :fanout'
+                ), {'fanout': fanout})
+            stats.add('broadcasts')
+        except OperationalError:
+            stats.add('errors')
+
+
+def writer(engine, stats, stop):
+    while not stop.is_set():
+        user_id = random.randint(1, USERS)
+        try:
+            with engine.begin() as conn:
+                updated = conn.execute(text(
+                    'UPDATE message_recipients SET is_read = 1 '
+                    'WHERE recipient_id = :user_id AND is_read = 0'
+                ), {'user_id': user_id}).rowcount
+                conn.execute(text(
+                    'UPDATE inbox_states SET unread_count = max(unread_count - :n, 0) WHERE user_id = :user_id'
+                ), {'n': updated, 'user_id': user_id})
+            stats.add('writes')
+        except OperationalError:
+            stats.add('errors')
+
+
+def reader(engine, stats, stop):
+    while not stop.is_set():
+        user_id = random.randint(1, USERS)
+        started = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(text('SELECT unread_count FROM inbox_states WHERE user_id = :user_id'),
+                             {'user_id': user_id}).scalar()
+                conn.execute(text(
+                    'SELECT id, message_id, is_read FROM message_recipients '
+                    'WHERE recipient_id = :user_id ORDER BY id DESC LIMIT 20'
+                ), {'user_id': user_id}).all()
+            stats.add('reads', time.perf_counter() - started)
+        except OperationalError:
+            stats.add('errors')
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(profile, args):
+    directory = tempfile.mkdtemp(prefix='bench-sqlite-')
+    path = os.path.join(directory, 'bench.db')
+    engine = make_engine(path, profile)
+    try:
+        seed(engine)
+        stats = Stats()
+        stop = threading.Event()
+        threads = [threading.Thread(target=broadcaster, args=(engine, stats, stop, args.fanout))]
+        threads += [threading.Thread(target=writer, args=(engine, stats, stop)) for _ in range(args.writers)]
+        threads += [threading.Thread(target=reader, args=(engine, stats, stop)) for _ in range(args.readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        engine.dispose()
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+    latencies = stats.read_latencies
+    return {
+        'profile': profile,
+        'reads/s': stats.reads / args.seconds,
+        'writes/s': stats.writes / args.seconds,
+        'broadcasts': stats.broadcasts,
+        'errors': stats.errors,
+        'read p50 ms': percentile(latencies, 0.50) * 1000,
+        'read p99 ms': percentile(latencies, 0.99) * 1000,
+        'read max ms': max(latencies, default=0) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite 并发基准')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--fanout', type=int, default=USERS, help='每次长写事务写入的接收记录数')
+    parser.add_argument('--profiles', default=','.join(PROFILES))
+    args = parser.parse_args()
+
+    results = [run(profile, args) for profile in args.profiles.split(',')]
+    columns = list(results[0])
+    print('  '.join(f'{column:>12}' for column in columns))
+    for result in results:
+        print('  '.join(
+            f'{value:>12.1f}' if isinstance(value, float) else f'{value:>12}'
+            for value in result.values()
+        ))
+
+
+if __name__ == '__main__':
+    main()
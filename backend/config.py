@@ -10,21 +10,98 @@ class Config:
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt-secret-key-change-in-production'
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
+    # EventSource 无法设置请求头，/api/events 从 ?token= 读取事件流令牌（不接受访问令牌）
+    JWT_QUERY_STRING_NAME = 'token'
+    
+    # 下载卸载：'x-accel-redirect'（nginx）、'x-sendfile'（Apache/lighttpd），留空则由 Flask 直接发送
+    DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD', '')
+    # nginx 中映射到上传目录的 internal location
+    DOWNLOAD_ACCEL_PREFIX = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/protected-uploads/')
+    
+    # 当前用户缓存：容量和过期时间（秒），容量为 0 时关闭
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    
+    # 列表接口每页条数上限
+    MAX_PER_PAGE = int(os.environ.get('MAX_PER_PAGE', 100))
+    
+    # 启动时自动建表和创建默认管理员（生产环境关闭，部署时执行 flask init-db）
+    AUTO_INIT_DB = True
+    
+    # 数据库连接池：每个 worker 进程一个池，threaded 模式下不小于 GUNICORN_THREADS，
+    # 超出 pool_size + max_overflow 的请求最多等待 pool_timeout 秒
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 8)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 4)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': 3600,
+    }
+    # SQLite 连接参数：'tuned' / 'wal' / 'default'，见 engine_profiles.py
+    SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'tuned')
+    # 覆盖所选 profile 中的单项，如 {'busy_timeout': 10000}
+    SQLITE_PRAGMAS = {}
+    
+    # SQL 统计：每个请求的查询数、耗时和 N+1 检测（同一语句执行次数达到阈值），
+    # 调试模式或 SQL_STATS_HEADERS 为真时附加 X-SQL-* 响应头，管理员可查看 /api/debug/sql-stats
+    SQL_STATS_ENABLED = os.environ.get('SQL_STATS_ENABLED', '1') == '1'
+    SQL_STATS_N_PLUS_ONE = int(os.environ.get('SQL_STATS_N_PLUS_ONE', 5))
+    SQL_STATS_HEADERS = os.environ.get('SQL_STATS_HEADERS', '0') == '1'
+    
+    # 运行指标 /metrics：多 worker 部署时设置 METRICS_DIR（各 worker 写入指标文件，抓取时合并），
+    # METRICS_TOKEN 非空时抓取须携带 Authorization: Bearer <METRICS_TOKEN>；
+    # METRICS_REQUIRE_TOKEN 为真且未设置 METRICS_TOKEN 时 /metrics 返回 404
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_DIR = os.environ.get('METRICS_DIR', '')
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    METRICS_REQUIRE_TOKEN = os.environ.get('METRICS_REQUIRE_TOKEN', '0') == '1'
+    
+    # 后台文本提取的进程数，0 表示关闭
+    TEXT_EXTRACTION_WORKERS = int(os.environ.get('TEXT_EXTRACTION_WORKERS', 2))
+    
+    # 响应缓存：'memory' 为进程内 LRU；多 worker 部署设为 'redis'（需安装 redis 包），容量为 0 时关闭
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+    RESPONSE_CACHE_REDIS_URL = os.environ.get('RESPONSE_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 2048))
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+    # 进程数（gunicorn.conf.py 中设置）：大于 1 时 'memory' 后端的响应缓存自动关闭
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+    
+    # 事件推送：'local' 仅在本进程内分发；多 worker 部署设为 'redis'（需安装 redis 包），
+    # 否则 /api/events 关闭，前端改为轮询未读数
+    EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'local')
+    EVENTS_REDIS_URL = os.environ.get('EVENTS_REDIS_URL', 'redis://localhost:6379/0')
+    # 心跳间隔和单个连接的最长时间（秒），到期后客户端自动重连
+    EVENTS_HEARTBEAT = int(os.environ.get('EVENTS_HEARTBEAT', 15))
+    EVENTS_STREAM_TIMEOUT = int(os.environ.get('EVENTS_STREAM_TIMEOUT', 300))
+    # 事件流令牌（POST /api/events/token 签发）的有效期，只需覆盖从签发到建立连接的时间
+    EVENTS_TOKEN_EXPIRES = timedelta(seconds=int(os.environ.get('EVENTS_TOKEN_EXPIRES', 60)))
+    # 每个进程同时保持的事件流上限，0 不限；gunicorn threaded 模式默认为线程数的一半，超出时返回 503
+    EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', 0))
 
 class DevelopmentConfig(Config):
     """开发配置"""
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///c:/Users/bearx/Desktop/svc/backend/instance/guidance.db'
+    # 相对路径位于 instance 目录（backend/instance/guidance.db）
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///guidance.db'
     DEBUG = True
 
 class ProductionConfig(Config):
     """生产配置"""
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///guidance.db'
     DEBUG = False
+    # 由部署脚本执行一次 flask init-db，worker 启动时不再建表
+    AUTO_INIT_DB = os.environ.get('AUTO_INIT_DB', '0') == '1'
+    # 指标包含各接口的访问量和耗时，未设置 METRICS_TOKEN 时不对外提供
+    METRICS_REQUIRE_TOKEN = os.environ.get('METRICS_REQUIRE_TOKEN', '1') == '1'
 
 class TestingConfig(Config):
     """测试配置"""
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    # 内存数据库使用单连接的 StaticPool，不接受连接池参数
+    SQLALCHEMY_ENGINE_OPTIONS = {}
     TESTING = True
+    TEXT_EXTRACTION_WORKERS = 0
+    SQL_STATS_HEADERS = True
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=5)
 
 config = {
@@ -0,0 +1,281 @@
+"""
+服务器推送事件（SSE）- /api/events
+
+客户端用 EventSource 建立长连接，服务端推送以下事件，代替各页面反复请求：
+- unread            当前用户的未读数变化，data: {unread}
+- message           收件箱有新消息，data: {message_id, unread}
+- broadcast         新的全体公告，data: {message_id, audience}（客户端随后刷新未读数，由其完成投递）
+- question_message  参与的问答对话有新消息，data: {question_id, message}
+
+发布方在事务提交后调用 publish()，由 broker 分发给本进程中对应用户的连接。
+EVENTS_BACKEND 为 'redis' 时经 Redis Pub/Sub（EVENTS_REDIS_URL，需安装 redis 包）转发，
+多个 worker 进程中的连接都能收到；默认 'local' 只在当前进程内分发，
+多 worker 部署（WEB_CONCURRENCY 大于 1）时 'local' 会漏发事件，/api/events 关闭并返回 503，客户端改为轮询未读数。
+EventSource 不能设置请求头，令牌只能放在 URL 中（?token=），而 URL 会写入访问日志和代理日志，
+因此不使用访问令牌：客户端先用访问令牌请求 POST /api/events/token，取得短时有效
+（EVENTS_TOKEN_EXPIRES）且只能用于 /api/events 的事件流令牌，/api/events 也只接受事件流令牌。
+每个连接在其存续期间占用一个线程（gthread），EVENTS_MAX_STREAMS 限制每个进程同时保持的连接数，
+超出时返回 503，为普通请求保留线程；客户端改为轮询未读数，稍后重试。
+"""
+from flask import Blueprint, Response, current_app, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_current_user, create_access_token
+from datetime import timedelta
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from models import db, MessageRecipient, InboxState
+from inbox import sync_broadcasts, unread_count_for
+
+logger = logging.getLogger(__name__)
+
+events_bp = Blueprint('events', __name__, url_prefix='/api')
+
+QUEUE_SIZE = 100  # 每个连接缓冲的事件数，客户端跟不上时丢弃多余事件
+STREAM_SCOPE = 'events'  # 事件流令牌的 scope 声明
+DEFAULT_TOKEN_EXPIRES = timedelta(seconds=60)
+
+
+class LocalBackend:
+    """进程内分发"""
+
+    def __init__(self, dispatch):
+        self._dispatch = dispatch
+
+    def publish(self, events):
+        self._dispatch(events)
+
+    def start(self):
+        pass
+
+
+class RedisBackend:
+    """经 Redis Pub/Sub 在多个进程间分发，每个进程一个监听线程"""
+
+    def __init__(self, dispatch, url, channel):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('EVENTS_BACKEND=redis 需要安装 redis 包')
+        self._dispatch = dispatch
+        self._redis = redis.Redis.from_url(url)
+        self._channel = channel
+        self._listener_pid = None
+        self._lock = threading.Lock()
+
+    def publish(self, events):
+        self._redis.publish(self._channel, json.dumps(events))
+
+    def start(self):
+        # fork 之后监听线程不会被继承，按进程启动
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            threading.Thread(target=self._listen, name='events-redis-listener', daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                for item in pubsub.listen():
+                    self._dispatch(json.loads(item['data']))
+            except Exception as e:
+                logger.warning(f'Events redis listener error, reconnecting: {e}')
+                time.sleep(1)
+
+
+class Broker:
+    """按用户管理本进程中的连接队列"""
+
+    def __init__(self):
+        self._subscribers = {}  # user_id -> {queue: user_type}
+        self._lock = threading.Lock()
+        self.backend = LocalBackend(self.dispatch)
+        self.enabled = True
+
+    def subscribe(self, user_id, user_type, limit=0):
+        """limit 为本进程的连接数上限（0 不限），已满时返回 None"""
+        self.backend.start()
+        q = queue.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            if limit and sum(len(queues) for queues in self._subscribers.values()) >= limit:
+                return None
+            self._subscribers.setdefault(user_id, {})[q] = user_type
+        return q
+
+    def unsubscribe(self, user_id, q):
+        with self._lock:
+            queues = self._subscribers.get(user_id)
+            if queues is not None:
+                queues.pop(q, None)
+                if not queues:
+                    del self._subscribers[user_id]
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(queues) for queues in self._subscribers.values())
+
+    def dispatch(self, events):
+        """events 为 [user_id 或 None（所有连接）, 事件名, 数据] 的列表"""
+        with self._lock:
+            targets = []
+            for user_id, name, data in events:
+                if user_id is None:
+                    queues = [q for subscribers in self._subscribers.values() for q in subscribers.items()]
+                else:
+                    queues = list(self._subscribers.get(user_id, {}).items())
+                targets.extend((q, user_type, user_id, name, data) for q, user_type in queues)
+
+        for q, user_type, user_id, name, data in targets:
+            if user_id is None and not _broadcast_visible(name, data, user_type):
+                continue
+            try:
+                q.put_nowait((name, data))
+            except queue.Full:
+                pass
+
+
+def _broadcast_visible(name, data, user_type):
+    if name != 'broadcast':
+        return True
+    return data.get('audience', 'all') in ('all', user_type)
+
+
+broker = Broker()
+
+
+def publish(events):
+    """
+    发布事件（在事务提交之后调用），推送失败只记录日志，不影响调用方
+
+    events 为 (user_id 或 None, 事件名, 数据) 的列表，user_id 为 None 时发给所有连接。
+    """
+    if not events:
+        return
+    try:
+        broker.backend.publish([list(event) for event in events])
+    except Exception as e:
+        logger.error(f'Publish events error: {str(e)}', exc_info=True)
+
+
+def publish_to_user(user_id, name, data):
+    """向一个用户的所有连接发布事件"""
+    publish([(user_id, name, data)])
+
+
+def publish_delivered(message_id):
+    """消息写入收件箱后，向每个接收者推送新消息及其最新未读数"""
+    try:
+        rows = db.session.query(MessageRecipient.recipient_id, InboxState.unread_count)\
+            .outerjoin(InboxState, InboxState.user_id == MessageRecipient.recipient_id)\
+            .filter(MessageRecipient.message_id == message_id).all()
+    except Exception as e:
+        logger.error(f'Publish events error: {str(e)}', exc_info=True)
+        return
+    publish([
+        (recipient_id, 'message', {'message_id': message_id, 'unread': unread or 0})
+        for recipient_id, unread in rows
+    ])
+
+
+def publish_broadcast(message_id, sender_id, audience):
+    """新公告推送给所有在线用户（按受众过滤），由客户端刷新未读数完成投递"""
+    publish([(None, 'broadcast', {'message_id': message_id, 'sender_id': sender_id, 'audience': audience})])
+
+
+def publish_question_message(question, message):
+    """对话新消息推送给提问学生和负责教师"""
+    data = {'question_id': question.id, 'message': message.to_dict()}
+    participants = {question.user_id, question.teacher_id} - {None}
+    publish([(user_id, 'question_message', data) for user_id in participants])
+
+
+def _format_event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+@events_bp.route('/events/token', methods=['POST'])
+@jwt_required()
+def stream_token():
+    """签发事件流令牌，只在建立连接时校验，断线重连时重新获取"""
+    if not broker.enabled:
+        return jsonify({'code': 503, 'message': '事件推送不可用'}), 503
+    expires = current_app.config.get('EVENTS_TOKEN_EXPIRES', DEFAULT_TOKEN_EXPIRES)
+    token = create_access_token(identity=get_jwt_identity(), expires_delta=expires,
+                                additional_claims={'scope': STREAM_SCOPE})
+    return jsonify({'code': 200, 'data': {'token': token, 'expires_in': int(expires.total_seconds())}}), 200
+
+
+@events_bp.route('/events', methods=['GET'])
+@jwt_required(locations=['query_string'])
+def event_stream():
+    """SSE 事件流，连接建立时先推送一次当前未读数"""
+    if not broker.enabled:
+        return jsonify({'code': 503, 'message': '事件推送不可用'}), 503
+    user_id = int(get_jwt_identity())
+    user = get_current_user()
+    sync_broadcasts(user)
+    db.session.commit()
+    unread = unread_count_for(user_id)
+
+    heartbeat = current_app.config.get('EVENTS_HEARTBEAT', 15)
+    lifetime = current_app.config.get('EVENTS_STREAM_TIMEOUT', 300)
+    q = broker.subscribe(user_id, user.user_type, current_app.config.get('EVENTS_MAX_STREAMS', 0))
+    db.session.remove()  # 长连接期间不占用数据库连接
+    if q is None:
+        response = jsonify({'code': 503, 'message': '事件推送连接已满，请稍后重试'})
+        response.headers['Retry-After'] = str(heartbeat)
+        return response, 503
+
+    def generate():
+        deadline = time.monotonic() + lifetime
+        try:
+            yield f'retry: {heartbeat * 1000}\n'
+            yield _format_event('unread', {'unread': unread})
+            # 超过连接时长后结束响应，由 EventSource 自动重连，避免长期占用 worker
+            while time.monotonic() < deadline:
+                try:
+                    name, data = q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                if name == 'broadcast' and data.get('sender_id') == user_id:
+                    continue
+                yield _format_event(name, data)
+        finally:
+            broker.unsubscribe(user_id, q)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 关闭 nginx 缓冲
+    return response
+
+
+def init_app(app, jwt):
+    """根据配置选择分发后端（多 worker 部署未使用 redis 时关闭事件流），注册事件流令牌的用途校验"""
+    @jwt.token_verification_loader
+    def _check_token_scope(jwt_header, jwt_data):
+        # 事件流令牌只能用于 /api/events，/api/events 也只接受事件流令牌
+        return (jwt_data.get('scope') == STREAM_SCOPE) == (request.endpoint == 'events.event_stream')
+
+    @jwt.token_verification_failed_loader
+    def _token_scope_error(jwt_header, jwt_data):
+        return {'code': 401, 'message': '令牌不能用于此接口'}, 401
+
+    broker.enabled = True
+    if app.config.get('EVENTS_BACKEND', 'local') == 'redis':
+        broker.backend = RedisBackend(
+            broker.dispatch,
+            app.config.get('EVENTS_REDIS_URL', 'redis://localhost:6379/0'),
+            app.config.get('EVENTS_REDIS_CHANNEL', 'guidance-events')
+        )
+    else:
+        broker.backend = LocalBackend(broker.dispatch)
+        if app.config.get('WEB_CONCURRENCY', 1) > 1:
+            logger.error('Event stream disabled: the local backend cannot reach connections in other workers '
+                         f"({app.config['WEB_CONCURRENCY']} workers), set EVENTS_BACKEND=redis")
+            broker.enabled = False
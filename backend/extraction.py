@@ -0,0 +1,255 @@
+"""
+上传文档的后台文本提取
+
+新上传的 txt/docx/pptx/xlsx/pdf 在进程池中提取纯文本，写入 file_contents 并建立全文索引。
+- 提取完全在请求之外进行，upload_file 只负责投递任务，不等待结果
+- 按 file_key（内容哈希）幂等：同一内容只提取一次，已完成的不会重复提取
+- 可重启：`flask extract-text` 为所有尚未提取的文件补做提取（--retry-failed 重试失败的）
+PDF 提取依赖可选的 pypdf，未安装时 PDF 记为 unsupported。
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from flask import current_app
+from flask.cli import with_appcontext
+from models import db, File, FileContent
+from storage import get_file_path
+import search
+import click
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+MAX_TEXT_LENGTH = 1000000  # 单个文件最多保留的字符数
+
+_OFFICE_XML_PARTS = {
+    'docx': re.compile(r'^word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$'),
+    'pptx': re.compile(r'^ppt/(slides/slide\d+|notesSlides/notesSlide\d+)\.xml$'),
+    'xlsx': re.compile(r'^xl/sharedStrings\.xml$'),
+}
+_XML_TEXT_RE = re.compile(r'<(?:w:t|a:t|t)(?:\s[^>]*)?>([^<]*)</(?:w:t|a:t|t)>')
+_XML_BREAK_RE = re.compile(r'</(?:w:p|a:p|si)>')
+
+_pool = None
+_pool_pid = None
+_in_flight = set()
+_lock = threading.Lock()
+
+
+class UnsupportedFileType(Exception):
+    """无法从该类型文件中提取文本"""
+
+
+# ==================== 提取（在子进程中执行） ====================
+
+def _decode_text(data):
+    for encoding in ('utf-8-sig', 'gb18030'):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', errors='replace')
+
+
+def _unescape_xml(value):
+    return (value.replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"')
+            .replace('&apos;', "'").replace('&amp;', '&'))
+
+
+def _extract_office_xml(file_path, file_type):
+    pattern = _OFFICE_XML_PARTS[file_type]
+    parts = []
+    with zipfile.ZipFile(file_path) as archive:
+        for name in sorted(n for n in archive.namelist() if pattern.match(n)):
+            xml = archive.read(name).decode('utf-8', errors='replace')
+            xml = _XML_BREAK_RE.sub(lambda m: m.group() + '\n', xml)
+            for line in xml.split('\n'):
+                texts = _XML_TEXT_RE.findall(line)
+                if texts:
+                    parts.append(_unescape_xml(''.join(texts)))
+    return '\n'.join(parts)
+
+
+def _extract_pdf(file_path):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise UnsupportedFileType('未安装 pypdf，无法提取 PDF 文本')
+
+    reader = PdfReader(file_path)
+    pages = []
+    length = 0
+    for page in reader.pages:
+        page_text = page.extract_text() or ''
+        pages.append(page_text)
+        length += len(page_text)
+        if length >= MAX_TEXT_LENGTH:
+            break
+    return '\n'.join(pages)
+
+
+def extract_text(file_path, file_type):
+    """从文件中提取纯文本（在进程池中运行，只能依赖参数，不能访问应用和数据库）"""
+    file_type = (file_type or '').lower()
+
+    if file_type == 'txt':
+        with open(file_path, 'rb') as f:
+            content = _decode_text(f.read(MAX_TEXT_LENGTH * 4))
+    elif file_type in _OFFICE_XML_PARTS:
+        content = _extract_office_xml(file_path, file_type)
+    elif file_type == 'pdf':
+        content = _extract_pdf(file_path)
+    else:
+        raise UnsupportedFileType(f'不支持提取 {file_type} 文件的文本')
+
+    return content[:MAX_TEXT_LENGTH]
+
+
+def _run_extraction(file_path, file_type):
+    """子进程入口：返回 (status, content, error)"""
+    try:
+        return 'done', extract_text(file_path, file_type), None
+    except UnsupportedFileType as e:
+        return 'unsupported', None, str(e)
+    except Exception as e:
+        return 'failed', None, f'{type(e).__name__}: {e}'
+
+
+# ==================== 任务调度（在 Web 进程中执行） ====================
+
+def _mp_context():
+    """
+    子进程的启动方式：forkserver（不支持时 spawn），不使用 fork
+
+    Web 进程中有多个请求线程、数据库连接池和日志锁，fork 时其他线程持有的锁会被子进程继承且永远不会释放，
+    子进程可能卡死；forkserver 从一个干净的单线程进程派生子进程，子进程只运行 _run_extraction，
+    不使用应用和数据库
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def _get_pool(app):
+    """按进程惰性创建进程池，pre-fork 之后每个 worker 各自持有自己的进程池"""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ProcessPoolExecutor(max_workers=app.config.get('TEXT_EXTRACTION_WORKERS', 1), mp_context=_mp_context())
+        _pool_pid = os.getpid()
+        _in_flight.clear()
+    return _pool
+
+
+def submit(file_key, file_type):
+    """
+    投递提取任务，立即返回；已提取或正在提取的内容会被跳过
+
+    返回 Future，未投递时返回 None
+    """
+    app = current_app._get_current_object()
+    if not app.config.get('TEXT_EXTRACTION_WORKERS'):
+        return None
+
+    with _lock:
+        if file_key in _in_flight:
+            return None
+        _in_flight.add(file_key)
+
+    try:
+        existing = db.session.query(FileContent.status).filter_by(file_key=file_key).scalar()
+        if existing in ('done', 'unsupported'):
+            with _lock:
+                _in_flight.discard(file_key)
+            return None
+
+        future = _get_pool(app).submit(_run_extraction, get_file_path(file_key), file_type)
+    except Exception:
+        with _lock:
+            _in_flight.discard(file_key)
+        raise
+
+    future.add_done_callback(lambda f: _on_extracted(app, file_key, f))
+    return future
+
+
+def _on_extracted(app, file_key, future):
+    """提取完成回调（在进程池的管理线程中运行），保存结果并更新索引"""
+    try:
+        status, content, error = future.result()
+    except Exception as e:
+        status, content, error = 'failed', None, f'{type(e).__name__}: {e}'
+
+    try:
+        with app.app_context():
+            # blob 可能在提取期间被删除
+            if not File.query.filter_by(file_key=file_key).first():
+                return
+
+            record = FileContent.query.filter_by(file_key=file_key).first()
+            if record is None:
+                record = FileContent(file_key=file_key)
+                db.session.add(record)
+            record.status = status
+            record.content = content
+            record.error = error
+            record.extracted_at = datetime.utcnow()
+            db.session.flush()
+
+            if status == 'done':
+                search.index_content(record.id, content)
+            else:
+                search.remove_content(record.id)
+            db.session.commit()
+
+        if status == 'failed':
+            logger.warning(f'Text extraction failed for {file_key}: {error}')
+        else:
+            logger.info(f'Text extraction {status} for {file_key}')
+    except Exception as e:
+        logger.error(f'Save extracted text error for {file_key}: {str(e)}', exc_info=True)
+    finally:
+        with _lock:
+            _in_flight.discard(file_key)
+
+
+def wait_for_pending():
+    """等待当前进程已投递的任务（包括结果回调）全部完成"""
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.shutdown(wait=True)
+    _pool = None
+    _pool_pid = None
+
+
+def pending_files(retry_failed=False):
+    """尚未提取（或提取失败）的文件 (file_key, file_type) 列表，每个内容只出现一次"""
+    finished = ['done', 'unsupported'] if retry_failed else ['done', 'unsupported', 'failed']
+    done_keys = db.session.query(FileContent.file_key).filter(FileContent.status.in_(finished))
+    rows = db.session.query(File.file_key, db.func.min(File.file_type))\
+        .filter(~File.file_key.in_(done_keys))\
+        .group_by(File.file_key).all()
+    return [(file_key, file_type) for file_key, file_type in rows]
+
+
+@click.command('extract-text')
+@click.option('--retry-failed', is_flag=True, help='同时重试之前提取失败的文件')
+@with_appcontext
+def extract_text_command(retry_failed):
+    """为尚未提取文本的文件补做提取（可重复执行）"""
+    pending = pending_files(retry_failed=retry_failed)
+    click.echo(f'待提取文件: {len(pending)}')
+
+    for file_key, file_type in pending:
+        submit(file_key, file_type)
+    wait_for_pending()
+
+    counts = dict(db.session.query(FileContent.status, db.func.count()).group_by(FileContent.status).all())
+    click.echo(f'提取完成: {counts}')
+
+
+def init_app(app):
+    """注册命令行命令"""
+    app.cli.add_command(extract_text_command)
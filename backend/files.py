@@ -1,11 +1,15 @@
-from flask import Blueprint, request, send_file, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_current_user
 from werkzeug.utils import secure_filename
-from models import db, File, User
-from datetime import datetime
+from models import db, File, User, UploadSession, FileContent
+from datetime import datetime, timedelta
+from storage import (stream_to_temp, acquire_blob, release_blob, remove_blob_file, discard_temp, send_stored_file,
+                     get_staging_path, link_to_temp, write_at, hash_file, UploadTooLarge)
+from pagination import paginate, InvalidCursor
+import extraction
+import search
 import os
 import uuid
-from pathlib import Path
 import logging
 
 # 配置日志
@@ -15,17 +19,67 @@ logger = logging.getLogger(__name__)
 files_bp = Blueprint('files', __name__, url_prefix='/api/files')
 
 # 配置
-UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
 ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt', 'zip', 'rar', 'jpg', 'jpeg', 'png', 'gif'}
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
-
-# 创建上传文件夹
-Path(UPLOAD_FOLDER).mkdir(exist_ok=True)
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024  # 分块上传的单块大小上限：5MB
+UPLOAD_SESSION_TTL = timedelta(hours=24)  # 未完成的分块上传会话保留时间
+FILE_ORDER_KEYS = [(File.created_at, 'desc'), (File.id, 'desc')]  # 文件列表的默认排序：最新的在前
 
 def allowed_file(filename):
     """检查文件是否允许上传"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _visible_files_query(user):
+    """用户可见的文件：管理员可以看所有文件，普通用户只能看自己的文件"""
+    if user.user_type == 'admin':
+        return File.query
+    return File.query.filter_by(user_id=user.id)
+
+def create_file_record(user_id, filename, file_key, file_size, temp_path, description='', is_public=False,
+                       document_type=None, submission_stage=None):
+    """
+    将已写入临时文件的上传内容入库为 blob，并创建 File 记录
+
+    普通上传和分块上传完成时共用，保证两种方式产生相同的记录
+    """
+    original_filename = secure_filename(filename)
+    file_ext = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else 'bin'
+    
+    file_record = File(
+        user_id=user_id,
+        filename=original_filename,
+        file_key=file_key,
+        file_type=file_ext,
+        file_size=file_size,
+        description=description,
+        is_public=is_public,
+        document_type=document_type,
+        submission_stage=submission_stage,
+        is_submitted=True,
+        submitted_at=datetime.utcnow() if document_type else None
+    )
+    
+    blob_created = False
+    try:
+        blob_created = acquire_blob(file_key, file_size, temp_path)
+        db.session.add(file_record)
+        db.session.flush()
+        search.index_file(file_record)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        discard_temp(temp_path)
+        if blob_created:
+            remove_blob_file(file_key)
+        raise
+    
+    # 后台提取文本，不阻塞上传请求
+    try:
+        extraction.submit(file_key, file_record.file_type)
+    except Exception as e:
+        logger.error(f'Submit text extraction error: {str(e)}', exc_info=True)
+    return file_record
+
 @files_bp.route('/upload', methods=['POST'])
 @jwt_required()
 def upload_file():
@@ -34,7 +88,7 @@ def upload_file():
         logger.info('File upload started')
         user_id = get_jwt_identity()
         logger.info(f'User ID: {user_id}')
-        user = User.query.get(user_id)
+        user = get_current_user()
         
         if not user:
             logger.warning(f'User not found: {user_id}')
@@ -85,36 +139,22 @@ def upload_file():
         
         logger.info(f'Document type: {document_type}, Submission stage: {submission_stage}')
         
-        # 生成唯一的文件名
-        original_filename = secure_filename(file.filename)
-        file_ext = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else 'bin'
-        file_key = f"{uuid.uuid4()}.{file_ext}"
-        file_path = os.path.join(UPLOAD_FOLDER, file_key)
-        
-        logger.info(f'Saving file to: {file_path}')
-        
-        # 保存文件
-        file.save(file_path)
-        logger.info(f'File saved successfully')
+        # 流式写入临时文件，同时计算内容哈希作为存储文件名
+        file_key, file_size, temp_path = stream_to_temp(file.stream, MAX_FILE_SIZE)
+        logger.info(f'File streamed, sha256={file_key}')
         
         # 创建文件记录
-        from datetime import datetime
-        file_record = File(
+        file_record = create_file_record(
             user_id=user_id,
-            filename=original_filename,
+            filename=file.filename,
             file_key=file_key,
-            file_type=file_ext,
             file_size=file_size,
+            temp_path=temp_path,
             description=description,
             is_public=is_public,
             document_type=document_type,
-            submission_stage=submission_stage,
-            is_submitted=True,
-            submitted_at=datetime.utcnow() if document_type else None
+            submission_stage=submission_stage
         )
-        
-        db.session.add(file_record)
-        db.session.commit()
         logger.info(f'File record created: {file_record.id}')
         
         return jsonify({
@@ -123,6 +163,9 @@ def upload_file():
             'data': file_record.to_dict()
         }), 201
     
+    except UploadTooLarge:
+        return jsonify({'code': 400, 'message': '文件大小不能超过100MB'}), 400
+    
     except Exception as e:
         db.session.rollback()
         logger.error(f'File upload error: {str(e)}', exc_info=True)
@@ -133,36 +176,24 @@ def upload_file():
 def list_files():
     """获取用户的文件列表"""
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
         
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
-        
-        # 根据用户类型获取文件
-        if user.user_type == 'admin':
-            # 管理员可以看所有文件
-            query = File.query
-        else:
-            # 普通用户只能看自己的文件
-            query = File.query.filter_by(user_id=user_id)
-        
-        paginated = query.order_by(File.created_at.desc()).paginate(page=page, per_page=per_page)
+        result = paginate(_visible_files_query(user), FILE_ORDER_KEYS)
         
         return jsonify({
             'code': 200,
             'message': '获取成功',
             'data': {
-                'files': [f.to_dict() for f in paginated.items],
-                'total': paginated.total,
-                'pages': paginated.pages,
-                'current_page': page
+                'files': [f.to_dict() for f in result.items],
+                **result.meta()
             }
         }), 200
     
+    except InvalidCursor as e:
+        return jsonify({'code': 400, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'code': 500, 'message': f'获取失败: {str(e)}'}), 500
 
@@ -172,7 +203,7 @@ def download_file(file_id):
     """下载文件"""
     try:
         user_id = int(get_jwt_identity())  # JWT identity是字符串，转换为整数
-        user = User.query.get(user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
@@ -186,16 +217,12 @@ def download_file(file_id):
         if file_record.user_id != user_id and user.user_type != 'admin' and not file_record.is_public:
             return jsonify({'code': 403, 'message': '没有权限下载此文件'}), 403
         
-        file_path = os.path.join(UPLOAD_FOLDER, file_record.file_key)
+        response = send_stored_file(file_record.file_key, file_record.filename)
         
-        if not os.path.exists(file_path):
+        if response is None:
             return jsonify({'code': 404, 'message': '文件不存在'}), 404
         
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=file_record.filename
-        )
+        return response
     
     except Exception as e:
         return jsonify({'code': 500, 'message': f'下载失败: {str(e)}'}), 500
@@ -206,7 +233,7 @@ def get_file_info(file_id):
     """获取文件信息"""
     try:
         user_id = int(get_jwt_identity())  # JWT identity是字符串，转换为整数
-        user = User.query.get(user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
@@ -251,6 +278,7 @@ def update_file(file_id):
         if 'is_public' in data:
             file_record.is_public = data['is_public']
         
+        search.index_file(file_record)
         db.session.commit()
         
         return jsonify({
@@ -278,13 +306,10 @@ def delete_file(file_id):
         if file_record.user_id != user_id:
             return jsonify({'code': 403, 'message': '没有权限删除此文件'}), 403
         
-        # 删除物理文件
-        file_path = os.path.join(UPLOAD_FOLDER, file_record.file_key)
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        
-        # 删除数据库记录
+        # 删除数据库记录，最后一个引用释放时才删除物理文件
         db.session.delete(file_record)
+        release_blob(file_record.file_key)
+        search.remove_file(file_record.id)
         db.session.commit()
         
         return jsonify({
@@ -301,43 +326,327 @@ def delete_file(file_id):
 def search_files():
     """搜索文件"""
     try:
-        user_id = int(get_jwt_identity())  # JWT identity是字符串，转换为整数
-        user = User.query.get(user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
         
-        keyword = request.args.get('keyword', '', type=str)
+        keyword = request.args.get('keyword', '', type=str).strip()
         file_type = request.args.get('file_type', '', type=str)
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
+        sort = request.args.get('sort', 'relevance' if keyword else 'time', type=str)  # relevance, time
         
-        # 根据用户类型构建查询
-        if user.user_type == 'admin':
-            query = File.query
-        else:
-            query = File.query.filter_by(user_id=user_id)
+        query = _visible_files_query(user)
         
-        # 关键词搜索
+        # 关键词搜索：优先使用全文索引（文件名 + 描述），不可用时回退为 LIKE
+        order_keys = FILE_ORDER_KEYS
         if keyword:
-            query = query.filter(File.filename.ilike(f'%{keyword}%'))
+            matches = search.file_search_subquery(keyword)
+            if matches is not None:
+                query = query.join(matches, File.id == matches.c.file_id)
+                if sort == 'relevance':
+                    order_keys = [(matches.c.rank, 'asc')] + order_keys
+            else:
+                query = query.filter(
+                    File.filename.ilike(f'%{keyword}%') | File.description.ilike(f'%{keyword}%')
+                )
         
         # 文件类型筛选
         if file_type:
             query = query.filter_by(file_type=file_type)
         
-        paginated = query.order_by(File.created_at.desc()).paginate(page=page, per_page=per_page)
+        result = paginate(query, order_keys)
         
         return jsonify({
             'code': 200,
             'message': '搜索成功',
             'data': {
-                'files': [f.to_dict() for f in paginated.items],
-                'total': paginated.total,
-                'pages': paginated.pages,
-                'current_page': page
+                'files': [f.to_dict() for f in result.items],
+                **result.meta()
             }
         }), 200
     
+    except InvalidCursor as e:
+        return jsonify({'code': 400, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'code': 500, 'message': f'搜索失败: {str(e)}'}), 500
+
+@files_bp.route('/content-search', methods=['GET'])
+@jwt_required()
+def search_file_contents():
+    """在文件内容中搜索（只返回有权查看的文件：本人的、公开的，管理员可看全部）"""
+    try:
+        user_id = int(get_jwt_identity())
+        user = get_current_user()
+        
+        if not user:
+            return jsonify({'code': 404, 'message': '用户不存在'}), 404
+        
+        keyword = request.args.get('keyword', '', type=str).strip()
+        
+        if not keyword:
+            return jsonify({'code': 400, 'message': '搜索关键词不能为空'}), 400
+        
+        query = File.query.join(FileContent, FileContent.file_key == File.file_key)\
+            .filter(FileContent.status == 'done')
+        
+        # 与 get_file_info 相同的权限规则
+        if user.user_type != 'admin':
+            query = query.filter((File.user_id == user_id) | (File.is_public == True))
+        
+        order_keys = [(File.created_at, 'desc'), (File.id, 'desc')]
+        matches = search.content_search_subquery(keyword)
+        if matches is not None:
+            query = query.join(matches, FileContent.id == matches.c.content_id)
+            order_keys = [(matches.c.rank, 'asc')] + order_keys
+        else:
+            query = query.filter(FileContent.content.ilike(f'%{keyword}%'))
+        
+        result = paginate(query.add_columns(FileContent.content), order_keys)
+        
+        return jsonify({
+            'code': 200,
+            'message': '搜索成功',
+            'data': {
+                'files': [
+                    {**f.to_dict(), 'snippet': search.make_snippet(content, keyword)}
+                    for f, content in result.items
+                ],
+                **result.meta()
+            }
+        }), 200
+    
+    except InvalidCursor as e:
+        return jsonify({'code': 400, 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f'Content search error: {str(e)}', exc_info=True)
+        return jsonify({'code': 500, 'message': f'搜索失败: {str(e)}'}), 500
+
+# ==================== 分块上传接口 ====================
+
+def _get_own_upload_session(upload_id, user_id):
+    """获取当前用户的分块上传会话，返回 (session, 错误响应)"""
+    session = UploadSession.query.get(upload_id)
+    if not session:
+        return None, (jsonify({'code': 404, 'message': '上传会话不存在或已过期'}), 404)
+    if session.user_id != user_id:
+        return None, (jsonify({'code': 403, 'message': '没有权限访问此上传会话'}), 403)
+    return session, None
+
+def _cleanup_expired_upload_sessions():
+    """清理超过有效期仍未完成的上传会话及其暂存文件"""
+    expired_before = datetime.utcnow() - UPLOAD_SESSION_TTL
+    expired = UploadSession.query.filter(UploadSession.updated_at < expired_before).limit(100).all()
+    for session in expired:
+        discard_temp(get_staging_path(session.id))
+        db.session.delete(session)
+    if expired:
+        db.session.commit()
+        logger.info(f'Removed {len(expired)} expired upload sessions')
+
+@files_bp.route('/uploads', methods=['POST'])
+@jwt_required()
+def init_chunked_upload():
+    """创建分块上传会话"""
+    try:
+        user_id = int(get_jwt_identity())
+        user = get_current_user()
+        
+        if not user:
+            return jsonify({'code': 404, 'message': '用户不存在'}), 404
+        
+        data = request.get_json() or {}
+        filename = data.get('filename', '')
+        file_size = data.get('file_size')
+        
+        if not filename:
+            return jsonify({'code': 400, 'message': '文件名不能为空'}), 400
+        
+        if not allowed_file(filename):
+            return jsonify({'code': 400, 'message': f'不支持的文件类型，允许的类型: {", ".join(ALLOWED_EXTENSIONS)}'}), 400
+        
+        if not isinstance(file_size, int) or file_size <= 0:
+            return jsonify({'code': 400, 'message': '文件不能为空'}), 400
+        
+        if file_size > MAX_FILE_SIZE:
+            return jsonify({'code': 400, 'message': '文件大小不能超过100MB'}), 400
+        
+        _cleanup_expired_upload_sessions()
+        
+        is_public = data.get('is_public', False)
+        if isinstance(is_public, str):
+            is_public = is_public.lower() in ['true', '1', 'yes']
+        
+        session = UploadSession(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            filename=filename,
+            file_size=file_size,
+            received_size=0,
+            description=data.get('description', ''),
+            is_public=bool(is_public),
+            document_type=data.get('document_type') or None,
+            submission_stage=data.get('submission_stage') or None
+        )
+        db.session.add(session)
+        db.session.commit()
+        
+        logger.info(f'Upload session {session.id} created by user {user_id}, size={file_size}')
+        
+        return jsonify({
+            'code': 201,
+            'message': '上传会话已创建',
+            'data': {**session.to_dict(), 'chunk_size': UPLOAD_CHUNK_SIZE}
+        }), 201
+    
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f'Init chunked upload error: {str(e)}', exc_info=True)
+        return jsonify({'code': 500, 'message': f'创建上传会话失败: {str(e)}'}), 500
+
+@files_bp.route('/uploads/<upload_id>', methods=['GET'])
+@jwt_required()
+def get_chunked_upload_status(upload_id):
+    """查询分块上传进度，客户端据此从 received_size 处续传"""
+    try:
+        user_id = int(get_jwt_identity())
+        session, error = _get_own_upload_session(upload_id, user_id)
+        if error:
+            return error
+        
+        return jsonify({
+            'code': 200,
+            'message': '获取成功',
+            'data': {**session.to_dict(), 'chunk_size': UPLOAD_CHUNK_SIZE}
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'获取失败: {str(e)}'}), 500
+
+@files_bp.route('/uploads/<upload_id>/chunks/<int:chunk_index>', methods=['PUT'])
+@jwt_required()
+def upload_chunk(upload_id, chunk_index):
+    """
+    上传第 chunk_index 个分块，请求体为原始字节
+
+    写入位置由 offset 参数（或 X-Upload-Offset 头）指定，缺省为 chunk_index * chunk_size。
+    offset 不能超过已接收的字节数；重传已完整接收的分块直接返回当前进度。
+    """
+    try:
+        user_id = int(get_jwt_identity())
+        session, error = _get_own_upload_session(upload_id, user_id)
+        if error:
+            return error
+        
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            offset = request.headers.get('X-Upload-Offset', type=int)
+        if offset is None:
+            offset = chunk_index * UPLOAD_CHUNK_SIZE
+        
+        staging_path = get_staging_path(session.id)
+        if session.received_size > 0 and not os.path.exists(staging_path):
+            # 暂存文件丢失，只能从头续传
+            session.received_size = 0
+            db.session.commit()
+        
+        if offset < 0 or offset > session.received_size:
+            return jsonify({
+                'code': 409,
+                'message': '分块偏移量与已接收进度不一致',
+                'data': session.to_dict()
+            }), 409
+        
+        chunk_length = request.content_length
+        if chunk_length is not None and chunk_length > UPLOAD_CHUNK_SIZE:
+            return jsonify({'code': 413, 'message': f'单个分块不能超过 {UPLOAD_CHUNK_SIZE} 字节'}), 413
+        
+        # 重试已完整接收的分块：不重复写入
+        if chunk_length is not None and offset + chunk_length <= session.received_size:
+            return jsonify({'code': 200, 'message': '分块已接收', 'data': session.to_dict()}), 200
+        
+        max_length = min(UPLOAD_CHUNK_SIZE, session.file_size - offset)
+        written = write_at(staging_path, offset, request.stream, max_length)
+        
+        session.received_size = offset + written
+        db.session.commit()
+        
+        return jsonify({'code': 200, 'message': '分块上传成功', 'data': session.to_dict()}), 200
+    
+    except UploadTooLarge:
+        db.session.rollback()
+        return jsonify({'code': 413, 'message': '分块超出文件声明的大小'}), 413
+    
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f'Upload chunk error: {str(e)}', exc_info=True)
+        return jsonify({'code': 500, 'message': f'分块上传失败: {str(e)}'}), 500
+
+@files_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+@jwt_required()
+def complete_chunked_upload(upload_id):
+    """完成分块上传，生成文件记录"""
+    try:
+        user_id = int(get_jwt_identity())
+        session, error = _get_own_upload_session(upload_id, user_id)
+        if error:
+            return error
+        
+        staging_path = get_staging_path(session.id)
+        if session.received_size != session.file_size or not os.path.exists(staging_path):
+            return jsonify({
+                'code': 400,
+                'message': '文件尚未上传完整',
+                'data': session.to_dict()
+            }), 400
+        
+        file_key, file_size = hash_file(staging_path)
+        if file_size != session.file_size:
+            return jsonify({'code': 400, 'message': '文件大小与声明不一致', 'data': session.to_dict()}), 400
+        
+        # 会话与文件记录在同一事务中提交。create_file_record 失败时会删除传入的临时文件，
+        # 因此传入暂存文件的硬链接：提交失败时暂存文件和会话都保留，客户端可以直接重试完成
+        db.session.delete(session)
+        file_record = create_file_record(
+            user_id=user_id,
+            filename=session.filename,
+            file_key=file_key,
+            file_size=file_size,
+            temp_path=link_to_temp(staging_path),
+            description=session.description,
+            is_public=session.is_public,
+            document_type=session.document_type,
+            submission_stage=session.submission_stage
+        )
+        discard_temp(staging_path)
+        logger.info(f'Upload session {upload_id} completed as file {file_record.id}')
+        
+        return jsonify({
+            'code': 201,
+            'message': '文件上传成功',
+            'data': file_record.to_dict()
+        }), 201
+    
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f'Complete chunked upload error: {str(e)}', exc_info=True)
+        return jsonify({'code': 500, 'message': f'上传失败: {str(e)}'}), 500
+
+@files_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@jwt_required()
+def abort_chunked_upload(upload_id):
+    """取消分块上传，删除暂存文件"""
+    try:
+        user_id = int(get_jwt_identity())
+        session, error = _get_own_upload_session(upload_id, user_id)
+        if error:
+            return error
+        
+        discard_temp(get_staging_path(session.id))
+        db.session.delete(session)
+        db.session.commit()
+        
+        return jsonify({'code': 200, 'message': '上传已取消'}), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'code': 500, 'message': f'取消失败: {str(e)}'}), 500
@@ -0,0 +1,89 @@
+"""
+gunicorn 配置：gunicorn -c gunicorn.conf.py wsgi:app
+
+通过环境变量选择 worker 模型（GUNICORN_PROFILE）：
+- threaded（默认）：gthread worker，每个 worker 多个线程；大文件下载、ZIP 导出和 /api/events 长连接
+  只占用一个线程而不是整个进程。每个打开的收件箱页面在连接期间占用一个线程，
+  每个 worker 的事件流默认最多占用一半线程（EVENTS_MAX_STREAMS），其余留给普通请求，超出的页面改为轮询；
+  预计同时打开的收件箱页面较多时，按 GUNICORN_THREADS ≥ 2 × 每个 worker 的并发事件流数 设置线程数，或使用 gevent
+- sync：每个 worker 一次处理一个请求，只适合没有长连接的部署——收件箱页面保持 /api/events 连接
+  （最长 EVENTS_STREAM_TIMEOUT 秒），每个打开的页面占用一整个 worker；
+  请求超时相应放宽到超过事件流的最长时间，否则长连接和慢下载会被杀掉
+- gevent：协程 worker（需安装 gevent），适合大量并发的慢下载和事件长连接
+
+其他变量：WEB_CONCURRENCY（worker 数）、GUNICORN_THREADS（threaded 时每个 worker 的线程数）、
+GUNICORN_BIND（监听地址）、GUNICORN_TIMEOUT（sync worker 的请求超时，秒）、
+METRICS_DIR（多进程指标文件目录，默认在临时目录下按端口区分）。
+
+多 worker 部署时，事件推送和响应缓存应使用共享后端（EVENTS_BACKEND=redis、RESPONSE_CACHE_BACKEND=redis）；
+worker 数大于 1 时，进程内的响应缓存在应用启动时自动关闭，避免写入后其他 worker 返回旧数据；
+进程内的事件推送同样关闭（/api/events 返回 503），前端改为轮询未读数。
+"""
+import multiprocessing
+import os
+import tempfile
+
+profile = os.environ.get('GUNICORN_PROFILE', 'threaded')
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# 应用据此判断是否多进程部署（进程内的响应缓存在多个 worker 间无法失效，会被关闭）
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+if profile == 'threaded':
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 8))
+    # 事件流长时间占用线程，最多占用一半，避免普通请求排队（须在加载应用前设置）
+    os.environ.setdefault('EVENTS_MAX_STREAMS', str(max(threads // 2, 1)))
+elif profile == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+else:
+    worker_class = 'sync'
+
+# sync worker 中一个请求超过 timeout 会被杀掉，须长于事件流的最长时间；threaded / gevent 中只用于 worker 心跳
+default_timeout = int(os.environ.get('EVENTS_STREAM_TIMEOUT', 300)) + 60 if worker_class == 'sync' else 120
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', default_timeout))
+graceful_timeout = 30
+keepalive = 5
+
+# 在主进程中加载应用一次，worker 通过 fork 共享代码（gevent 需在加载应用前打补丁，不预加载）
+preload_app = profile != 'gevent'
+
+# 定期重启 worker，避免长时间运行后内存增长
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+# 与默认格式相同，但请求行只记录路径（%(U)s），不记录查询参数（/api/events 的令牌在查询参数中）
+access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(m)s %(U)s %(H)s" %(s)s %(b)s "%(f)s" "%(a)s"'
+
+# 各 worker 把运行指标写入该目录，/metrics 合并全部 worker 的数据（须在加载应用前设置）
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f'guidance-metrics-{bind.rsplit(":", 1)[-1]}'))
+
+
+def on_starting(server):
+    """清空上一次运行留下的指标文件"""
+    from metrics import clear_directory
+    clear_directory()
+
+
+def post_fork(server, worker):
+    """worker fork 后丢弃继承自主进程的数据库连接池，避免多个进程共用同一连接"""
+    if preload_app:
+        from wsgi import app
+        from app import dispose_engine_after_fork
+        dispose_engine_after_fork(app)
+
+
+def worker_exit(server, worker):
+    """worker 退出前写出尚未写入的指标"""
+    from metrics import flush
+    flush()
+
+
+def child_exit(server, worker):
+    """worker 退出后保留其计数，丢弃其 gauge"""
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
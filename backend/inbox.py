@@ -0,0 +1,266 @@
+"""
+站内消息投递
+
+- 指定接收者的消息：一条 INSERT ... SELECT 写入全部 MessageRecipient，
+  接收者是否存在在 SELECT 中一并检查，不逐个查询用户
+- 全体公告（target == 'all'）：只写一条 Broadcast，发送耗时与用户数无关；
+  用户访问收件箱或未读数时由 sync_broadcasts 把新公告投递到自己的收件箱，
+  InboxState.broadcast_synced_upto 记录已投递到的位置，每条公告对每个用户只投递一次
+- 未读数：InboxState.unread_count 在投递和标记已读时以原子 UPDATE 增减，
+  读取未读数只需按主键读一行，不再对 message_recipients 计数
+"""
+from datetime import datetime
+from sqlalchemy import select, update, literal, false, exists, func, or_, case
+from sqlalchemy.exc import IntegrityError
+from models import db, User, TeacherStudent, Message, MessageRecipient, Broadcast, InboxState
+
+PREVIEW_LENGTH = 100  # 收件箱列表中消息内容的预览长度
+
+
+def _insert_recipients(message, recipients):
+    """recipients 为选出 (recipient_id) 的查询，返回写入的接收记录数"""
+    rows = select(
+        literal(message.id),
+        recipients.c.recipient_id,
+        false(),
+        literal(message.created_at or datetime.utcnow())
+    ).select_from(recipients)
+    result = db.session.execute(
+        MessageRecipient.__table__.insert().from_select(
+            ['message_id', 'recipient_id', 'is_read', 'created_at'], rows
+        )
+    )
+    if result.rowcount:
+        _increment_unread_for_message(message.id)
+    return result.rowcount
+
+
+def _increment_unread_for_message(message_id):
+    """message_id 的全部接收者未读数加一（先为没有 InboxState 的接收者补齐一行）"""
+    recipient_ids = select(MessageRecipient.recipient_id).where(MessageRecipient.message_id == message_id)
+    db.session.execute(
+        InboxState.__table__.insert().from_select(
+            ['user_id', 'broadcast_synced_upto', 'unread_count'],
+            select(MessageRecipient.recipient_id, literal(0), literal(0)).where(
+                MessageRecipient.message_id == message_id,
+                ~exists().where(InboxState.user_id == MessageRecipient.recipient_id)
+            )
+        )
+    )
+    db.session.execute(
+        update(InboxState)
+        .where(InboxState.user_id.in_(recipient_ids))
+        .values(unread_count=InboxState.unread_count + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _change_unread(user_id, delta):
+    """调整一个用户的未读数（原子更新，不会减到负数）"""
+    if delta >= 0:
+        value = InboxState.unread_count + delta
+    else:
+        value = case((InboxState.unread_count > -delta, InboxState.unread_count + delta), else_=0)
+    InboxState.query.filter_by(user_id=user_id).update(
+        {InboxState.unread_count: value}, synchronize_session=False
+    )
+
+
+def unread_count_for(user_id):
+    """用户的未读消息数（主键读取）"""
+    return db.session.query(InboxState.unread_count).filter_by(user_id=user_id).scalar() or 0
+
+
+def mark_read(user_id, message_id):
+    """
+    把一条消息标记为已读，状态发生变化时返回 True 并把未读数减一
+
+    以 is_read = false 为条件更新，并发重复标记只会生效一次。
+    """
+    updated = MessageRecipient.query.filter_by(
+        message_id=message_id, recipient_id=user_id, is_read=False
+    ).update({
+        MessageRecipient.is_read: True,
+        MessageRecipient.read_at: datetime.utcnow()
+    }, synchronize_session=False)
+    if updated:
+        _change_unread(user_id, -updated)
+    return bool(updated)
+
+
+def mark_read_bulk(user_id, message_ids=None, up_to_id=None, before=None):
+    """
+    批量标记已读，返回状态发生变化的条数（在调用方事务中执行）
+
+    message_ids 指定消息列表；up_to_id / before 标记 id 不大于 up_to_id、
+    或送达时间不晚于 before 的全部消息。条件可组合（取交集），一条 UPDATE 完成，
+    read_at 由数据库写入。
+    """
+    conditions = [MessageRecipient.recipient_id == user_id, MessageRecipient.is_read == False]
+    if message_ids is not None:
+        conditions.append(MessageRecipient.message_id.in_(set(message_ids)))
+    if up_to_id is not None:
+        conditions.append(MessageRecipient.message_id <= up_to_id)
+    if before is not None:
+        conditions.append(MessageRecipient.created_at <= before)
+
+    result = db.session.execute(
+        update(MessageRecipient)
+        .where(*conditions)
+        .values(is_read=True, read_at=func.current_timestamp())
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount:
+        _change_unread(user_id, -result.rowcount)
+    return result.rowcount
+
+
+# 收件箱的排序：最新的在前
+INBOX_ORDER_KEYS = [(Message.created_at, 'desc'), (Message.id, 'desc')]
+
+
+def inbox_query(user_id):
+    """
+    收件箱列表查询：一次连接 message_recipients、messages、users，只选出列表需要的列，
+    内容在数据库中截断为预览
+    """
+    return db.session.query(
+        MessageRecipient.id,
+        MessageRecipient.message_id,
+        MessageRecipient.is_read,
+        MessageRecipient.read_at,
+        Message.created_at,
+        Message.sender_id,
+        func.substr(Message.content, 1, PREVIEW_LENGTH).label('preview'),
+        (func.length(Message.content) > PREVIEW_LENGTH).label('truncated'),
+        User.username.label('sender_username'),
+        User.real_name.label('sender_real_name'),
+        User.user_type.label('sender_user_type')
+    ).join(Message, MessageRecipient.message_id == Message.id)\
+        .outerjoin(User, User.id == Message.sender_id)\
+        .filter(MessageRecipient.recipient_id == user_id)
+
+
+def inbox_item(row):
+    """inbox_query 的一行转换为字典"""
+    return {
+        'id': row.id,
+        'message_id': row.message_id,
+        'is_read': row.is_read,
+        'read_at': row.read_at.isoformat() if row.read_at else None,
+        'created_at': row.created_at.isoformat() if row.created_at else '',
+        'sender_id': row.sender_id,
+        'sender_username': row.sender_username or '',
+        'sender_name': row.sender_real_name or row.sender_username or '',
+        'sender_user_type': row.sender_user_type or 'system',
+        'content': row.preview or '',
+        'truncated': bool(row.truncated)
+    }
+
+
+def deliver_to_users(message, user_ids):
+    """发送给指定用户（忽略不存在的用户和重复 id），返回接收者数量"""
+    recipients = select(User.id.label('recipient_id'))\
+        .where(User.id.in_(set(user_ids))).subquery()
+    return _insert_recipients(message, recipients)
+
+
+def deliver_to_teacher_students(message, teacher_id):
+    """发送给教师管理的全部学生，返回接收者数量"""
+    recipients = select(TeacherStudent.student_id.label('recipient_id')).distinct()\
+        .join(User, User.id == TeacherStudent.student_id)\
+        .where(TeacherStudent.teacher_id == teacher_id).subquery()
+    return _insert_recipients(message, recipients)
+
+
+def _normalize_audience(audience):
+    return audience if audience in ('teacher', 'student') else 'all'
+
+
+def count_broadcast_audience(sender_id, audience):
+    """当前符合公告受众条件的用户数（不含发送者）"""
+    query = User.query.filter(User.is_active == True, User.id != sender_id)
+    audience = _normalize_audience(audience)
+    if audience != 'all':
+        query = query.filter(User.user_type == audience)
+    return query.count()
+
+
+def create_broadcast(message, audience='all'):
+    """
+    保存全体公告，只写一条记录（在调用方事务中执行，message 须已 flush）
+
+    audience 为 'teacher' / 'student' 时只发给该类用户，其他值发给全部用户。
+    """
+    broadcast = Broadcast(
+        message_id=message.id,
+        sender_id=message.sender_id,
+        audience=_normalize_audience(audience),
+        created_at=message.created_at
+    )
+    db.session.add(broadcast)
+    return broadcast
+
+
+def _get_or_create_state(user_id):
+    state = db.session.get(InboxState, user_id)
+    if state is None:
+        try:
+            with db.session.begin_nested():
+                state = InboxState(user_id=user_id, broadcast_synced_upto=0, unread_count=0)
+                db.session.add(state)
+        except IntegrityError:
+            # 并发请求已创建
+            state = db.session.get(InboxState, user_id)
+    return state
+
+
+def sync_broadcasts(user):
+    """
+    把 user 尚未投递的公告写入其收件箱，返回新投递的条数（在调用方事务中执行）
+
+    只投递发布时已注册、且受众匹配的公告；没有新公告时只做两次主键/索引读取，不产生写入。
+    """
+    latest = db.session.query(func.max(Broadcast.id)).scalar() or 0
+    state = db.session.get(InboxState, user.id)
+    synced_upto = state.broadcast_synced_upto if state else 0
+    if latest <= synced_upto:
+        return 0
+
+    state = _get_or_create_state(user.id)
+    # 条件更新认领 (synced_upto, latest] 区间，并发请求中只有一个会执行投递
+    claimed = InboxState.query.filter(
+        InboxState.user_id == user.id,
+        InboxState.broadcast_synced_upto == synced_upto
+    ).update({InboxState.broadcast_synced_upto: latest}, synchronize_session=False)
+    db.session.expire(state, ['broadcast_synced_upto'])
+    if not claimed:
+        return 0
+
+    already_delivered = exists().where(
+        MessageRecipient.message_id == Broadcast.message_id,
+        MessageRecipient.recipient_id == user.id
+    )
+    pending = select(
+        Broadcast.message_id,
+        literal(user.id),
+        false(),
+        Broadcast.created_at
+    ).where(
+        Broadcast.id > synced_upto,
+        Broadcast.id <= latest,
+        Broadcast.sender_id != user.id,
+        or_(Broadcast.audience == 'all', Broadcast.audience == user.user_type),
+        ~already_delivered
+    )
+    if user.created_at is not None:
+        pending = pending.where(Broadcast.created_at >= user.created_at)
+
+    result = db.session.execute(
+        MessageRecipient.__table__.insert().from_select(
+            ['message_id', 'recipient_id', 'is_read', 'created_at'], pending
+        )
+    )
+    if result.rowcount:
+        _change_unread(user.id, result.rowcount)
+    return result.rowcount
@@ -0,0 +1,324 @@
+"""
+运行指标 - GET /metrics（Prometheus 文本格式）
+
+按视图（blueprint.endpoint）统计：
+- http_requests_total              请求数（method、status）
+- http_request_duration_seconds    请求耗时直方图，流式响应（下载、导出、事件流）计到响应结束
+- http_requests_in_flight          正在处理的请求数
+- http_response_size_bytes         响应大小直方图（长度未知的流式响应不计入）
+以及：
+- db_pool_*                        数据库连接池的大小、已借出和溢出连接数（抓取时读取）
+- upload_bytes_total               写入存储的上传字节数
+- download_bytes_total             下载发送的字节数（kind 为 file / zip）
+
+多进程：配置 METRICS_DIR 后，每个 worker 每隔 METRICS_FLUSH_INTERVAL 秒把本进程的指标写入
+METRICS_DIR/worker-<pid>.json，抓取时合并目录中的全部文件，任意 worker 响应 /metrics 都得到全部进程的总和；
+worker 退出时由 gunicorn 主进程调用 mark_process_dead，把其计数并入 archive.json 并丢弃其 gauge。
+未配置时只统计当前进程。METRICS_TOKEN 非空时抓取须携带 Authorization: Bearer <METRICS_TOKEN>；
+METRICS_REQUIRE_TOKEN 为真（生产配置的默认值）而未设置 METRICS_TOKEN 时，/metrics 返回 404，只在进程内计数。
+"""
+from bisect import bisect_left
+from flask import Blueprint, Response, abort, g, request
+from models import db
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+metrics_bp = Blueprint('metrics', __name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+# 指标名 -> (类型, 说明, 直方图的桶)
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests by endpoint, method and status', None),
+    'http_request_duration_seconds': ('histogram', 'HTTP request latency until the response is closed', LATENCY_BUCKETS),
+    'http_requests_in_flight': ('gauge', 'HTTP requests currently being served', None),
+    'http_response_size_bytes': ('histogram', 'HTTP response body size (known lengths only)', SIZE_BUCKETS),
+    'upload_bytes_total': ('counter', 'Uploaded bytes written to storage', None),
+    'download_bytes_total': ('counter', 'Downloaded bytes sent to clients', None),
+    'db_pool_size': ('gauge', 'Configured database connection pool size', None),
+    'db_pool_checked_out': ('gauge', 'Database connections currently checked out', None),
+    'db_pool_overflow': ('gauge', 'Database connections opened beyond the pool size', None),
+}
+
+DEFAULT_FLUSH_INTERVAL = 1.0  # 秒
+
+
+class Registry:
+    """本进程的指标值，键为 (指标名, ((标签名, 值), ...))"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}  # 键 -> [各桶计数..., +Inf 计数, 总和]
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_gauge(self, name, labels=(), delta=1):
+        key = (name, labels)
+        with self._lock:
+            self.gauges[key] = self.gauges.get(key, 0) + delta
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            self._observe(name, labels, value)
+
+    def _observe(self, name, labels, value):
+        key = (name, labels)
+        buckets = METRICS[name][2]
+        values = self.histograms.get(key)
+        if values is None:
+            values = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+        values[bisect_left(buckets, value)] += 1
+        values[-1] += value
+
+    def record_request(self, endpoint, method, status, duration, size):
+        """一个请求结束：在一次加锁中更新全部请求指标（标签按名称排序）"""
+        by_endpoint = (('endpoint', endpoint),)
+        by_method = (('endpoint', endpoint), ('method', method))
+        key = ('http_requests_total', by_method + (('status', status),))
+        in_flight = ('http_requests_in_flight', by_endpoint)
+        with self._lock:
+            self.gauges[in_flight] -= 1
+            self.counters[key] = self.counters.get(key, 0) + 1
+            self._observe('http_request_duration_seconds', by_method, duration)
+            if size is not None:
+                self._observe('http_response_size_bytes', by_endpoint, size)
+
+    def snapshot(self):
+        """可写入 JSON 的副本"""
+        with self._lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'gauges': [[name, labels, value] for (name, labels), value in self.gauges.items()],
+                'histograms': [[name, labels, list(values)] for (name, labels), values in self.histograms.items()]
+            }
+
+
+registry = Registry()
+
+_settings = {'dir': '', 'interval': DEFAULT_FLUSH_INTERVAL, 'token': '', 'exposed': True, 'flushed_at': 0.0}
+_flush_lock = threading.Lock()
+
+
+def count_upload(size):
+    """上传内容写入存储后调用"""
+    if size:
+        registry.inc('upload_bytes_total', (), size)
+
+
+def count_download(size, kind='file'):
+    """下载内容发送时调用"""
+    if size:
+        registry.inc('download_bytes_total', (('kind', kind),), size)
+
+
+def _start_request():
+    endpoint = request.endpoint or 'unmatched'
+    g._metrics = (time.perf_counter(), endpoint)
+    registry.add_gauge('http_requests_in_flight', (('endpoint', endpoint),), 1)
+
+
+def _finish_request(response):
+    started = g.pop('_metrics', None)
+    if started is None:
+        return response
+    started_at, endpoint = started
+    method = request.method
+    status = str(response.status_code)
+    size = response.content_length if not response.is_streamed else None
+
+    def finish():
+        registry.record_request(endpoint, method, status, time.perf_counter() - started_at, size)
+        _maybe_flush()
+
+    # 在响应发送完毕（流式响应结束）后记录
+    response.call_on_close(finish)
+    return response
+
+
+def _worker_path(directory, pid):
+    return os.path.join(directory, f'worker-{pid}.json')
+
+
+def _write_json(path, data):
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as out:
+        json.dump(data, out)
+    os.replace(temp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def flush():
+    """把本进程的指标写入 METRICS_DIR"""
+    directory = _settings['dir']
+    if not directory:
+        return
+    with _flush_lock:
+        _settings['flushed_at'] = time.monotonic()
+        _write_json(_worker_path(directory, os.getpid()), registry.snapshot())
+
+
+def _maybe_flush():
+    if _settings['dir'] and time.monotonic() - _settings['flushed_at'] >= _settings['interval']:
+        try:
+            flush()
+        except OSError as e:
+            logger.warning(f'Metrics flush error: {e}')
+
+
+def _merge(target, snapshot, with_gauges=True):
+    for name, labels, value in snapshot.get('counters', []):
+        key = (name, tuple(map(tuple, labels)))
+        target['counters'][key] = target['counters'].get(key, 0) + value
+    if with_gauges:
+        for name, labels, value in snapshot.get('gauges', []):
+            key = (name, tuple(map(tuple, labels)))
+            target['gauges'][key] = target['gauges'].get(key, 0) + value
+    for name, labels, values in snapshot.get('histograms', []):
+        key = (name, tuple(map(tuple, labels)))
+        existing = target['histograms'].get(key)
+        target['histograms'][key] = values if existing is None else [a + b for a, b in zip(existing, values)]
+
+
+def _empty():
+    return {'counters': {}, 'gauges': {}, 'histograms': {}}
+
+
+def mark_process_dead(pid, directory=None):
+    """
+    worker 退出后由主进程调用：计数和直方图并入 archive.json，gauge 丢弃
+
+    只有主进程写 archive.json，不需要跨进程加锁。
+    """
+    directory = directory or os.environ.get('METRICS_DIR', '')
+    if not directory:
+        return
+    path = _worker_path(directory, pid)
+    snapshot = _read_json(path)
+    if snapshot is None:
+        return
+    archive = _empty()
+    _merge(archive, _read_json(os.path.join(directory, 'archive.json')) or {})
+    _merge(archive, snapshot, with_gauges=False)
+    _write_json(os.path.join(directory, 'archive.json'), {
+        'counters': [[name, labels, value] for (name, labels), value in archive['counters'].items()],
+        'histograms': [[name, labels, values] for (name, labels), values in archive['histograms'].items()]
+    })
+    os.remove(path)
+
+
+def clear_directory(directory=None):
+    """主进程启动时清空上一次运行留下的文件"""
+    directory = directory or os.environ.get('METRICS_DIR', '')
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.remove(path)
+
+
+def _pool_gauges():
+    """本进程连接池的当前状态（StaticPool 等没有大小的连接池不输出）"""
+    pool = db.engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return {}
+    return {
+        ('db_pool_size', ()): pool.size(),
+        ('db_pool_checked_out', ()): pool.checkedout(),
+        ('db_pool_overflow', ()): max(pool.overflow(), 0),
+    }
+
+
+def collect():
+    """全部进程（或本进程）的指标"""
+    merged = _empty()
+    directory = _settings['dir']
+    if directory:
+        flush()
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            snapshot = _read_json(path)
+            if snapshot is not None:
+                _merge(merged, snapshot)
+    else:
+        _merge(merged, registry.snapshot())
+    # 连接池状态只能在本进程读取，多进程时为响应抓取的 worker 的值
+    merged['gauges'].update(_pool_gauges())
+    return merged
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def render(merged):
+    """Prometheus 文本格式"""
+    series = {}
+    for kind in ('counters', 'gauges', 'histograms'):
+        for (name, labels), value in merged[kind].items():
+            series.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        if name not in series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(series[name]):
+            if kind != 'histogram':
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], value[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {value[-1]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def export_metrics():
+    if not _settings['exposed']:
+        abort(404)
+    token = _settings['token']
+    if token and request.headers.get('Authorization', '') != f'Bearer {token}':
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    return Response(render(collect()), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """注册请求计时；METRICS_DIR 不为空时启用多进程合并"""
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    _settings['dir'] = app.config.get('METRICS_DIR', '')
+    _settings['interval'] = app.config.get('METRICS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+    _settings['token'] = app.config.get('METRICS_TOKEN', '')
+    _settings['exposed'] = bool(_settings['token']) or not app.config.get('METRICS_REQUIRE_TOKEN', False)
+    if not _settings['exposed']:
+        logger.warning('METRICS_TOKEN is not set, /metrics is disabled')
+    if _settings['dir']:
+        os.makedirs(_settings['dir'], exist_ok=True)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
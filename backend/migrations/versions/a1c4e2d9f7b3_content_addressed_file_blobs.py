@@ -0,0 +1,39 @@
+"""Content-addressed file blobs with reference counts
+
+Revision ID: a1c4e2d9f7b3
+Revises: 3b3070edb1fe
+Create Date: 2026-10-18 09:12:41.208113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1c4e2d9f7b3'
+down_revision = '3b3070edb1fe'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('file_blobs',
+        sa.Column('file_key', sa.String(length=255), nullable=False),
+        sa.Column('file_size', sa.Integer(), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('file_key')
+    )
+
+    # 多条 File 记录可以共享同一个 blob，file_key 不再唯一
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_files_file_key'))
+        batch_op.create_index(batch_op.f('ix_files_file_key'), ['file_key'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_files_file_key'))
+        batch_op.create_index(batch_op.f('ix_files_file_key'), ['file_key'], unique=True)
+
+    op.drop_table('file_blobs')
@@ -0,0 +1,47 @@
+"""Add per-user unread counters and the message_recipients indexes
+
+Revision ID: a8e4f2c67d19
+Revises: f1a7d3e8b952
+Create Date: 2026-10-18 13:41:27.905316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8e4f2c67d19'
+down_revision = 'f1a7d3e8b952'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('inbox_states', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False))
+
+    # 模型中声明的索引在已有数据库中可能缺失
+    existing = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('message_recipients')}
+    with op.batch_alter_table('message_recipients', schema=None) as batch_op:
+        if 'ix_message_recipients_message_id' not in existing:
+            batch_op.create_index('ix_message_recipients_message_id', ['message_id'], unique=False)
+        if 'ix_message_recipients_recipient_id' not in existing:
+            batch_op.create_index('ix_message_recipients_recipient_id', ['recipient_id'], unique=False)
+
+    # 根据已有的接收记录回填未读数
+    op.execute("""
+        INSERT INTO inbox_states (user_id, broadcast_synced_upto, unread_count)
+        SELECT DISTINCT recipient_id, 0, 0 FROM message_recipients
+        WHERE recipient_id NOT IN (SELECT user_id FROM inbox_states)
+    """)
+    op.execute("""
+        UPDATE inbox_states SET unread_count = (
+            SELECT count(*) FROM message_recipients mr
+            WHERE mr.recipient_id = inbox_states.user_id AND NOT mr.is_read
+        )
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('inbox_states', schema=None) as batch_op:
+        batch_op.drop_column('unread_count')
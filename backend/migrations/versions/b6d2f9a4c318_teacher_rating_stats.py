@@ -0,0 +1,45 @@
+"""Add teacher_rating_stats and backfill it from teacher_reviews
+
+Revision ID: b6d2f9a4c318
+Revises: a8e4f2c67d19
+Create Date: 2026-10-18 15:02:44.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d2f9a4c318'
+down_revision = 'a8e4f2c67d19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('teacher_rating_stats',
+        sa.Column('teacher_id', sa.Integer(), nullable=False),
+        sa.Column('review_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('rating_sum', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('rating_1', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('rating_2', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('rating_3', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('rating_4', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('rating_5', sa.Integer(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['teacher_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('teacher_id')
+    )
+
+    # 根据已有评价回填统计（之后也可用 flask rebuild-rating-stats 重建）
+    op.execute("""
+        INSERT INTO teacher_rating_stats
+            (teacher_id, review_count, rating_sum, rating_1, rating_2, rating_3, rating_4, rating_5)
+        SELECT teacher_id, count(*), sum(rating),
+               sum(rating = 1), sum(rating = 2), sum(rating = 3), sum(rating = 4), sum(rating = 5)
+        FROM teacher_reviews
+        GROUP BY teacher_id
+    """)
+
+
+def downgrade():
+    op.drop_table('teacher_rating_stats')
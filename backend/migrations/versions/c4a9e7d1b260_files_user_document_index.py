@@ -0,0 +1,28 @@
+"""Add a composite (user_id, document_type, created_at) index on files
+
+Revision ID: c4a9e7d1b260
+Revises: b6d2f9a4c318
+Create Date: 2026-10-18 15:47:09.532871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a9e7d1b260'
+down_revision = 'b6d2f9a4c318'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('files')}
+    if 'ix_files_user_document_created' not in existing:
+        with op.batch_alter_table('files', schema=None) as batch_op:
+            batch_op.create_index('ix_files_user_document_created', ['user_id', 'document_type', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.drop_index('ix_files_user_document_created')
@@ -0,0 +1,37 @@
+"""Add file_contents table for extracted document text
+
+Revision ID: d3f8a6c21b47
+Revises: c7e91b3f5a20
+Create Date: 2026-10-18 11:26:40.182934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3f8a6c21b47'
+down_revision = 'c7e91b3f5a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('file_contents',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('file_key', sa.String(length=255), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('content', sa.Text(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('extracted_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('file_contents', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_file_contents_file_key'), ['file_key'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('file_contents', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_file_contents_file_key'))
+
+    op.drop_table('file_contents')
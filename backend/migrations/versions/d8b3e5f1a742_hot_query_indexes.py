@@ -0,0 +1,61 @@
+"""Add indexes for the question, file and teacher-student list queries, restore message_recipients.created_at
+
+Revision ID: d8b3e5f1a742
+Revises: c4a9e7d1b260
+Create Date: 2026-10-18 17:05:41.218634
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8b3e5f1a742'
+down_revision = 'c4a9e7d1b260'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = {
+    'questions': [
+        ('ix_questions_teacher_created', ['teacher_id', 'created_at']),
+        ('ix_questions_user_created', ['user_id', 'created_at']),
+    ],
+    'files': [
+        ('ix_files_user_created', ['user_id', 'created_at']),
+        ('ix_files_created_at', ['created_at']),
+    ],
+    'teacher_students': [
+        ('ix_teacher_students_student_id', ['student_id']),
+    ],
+}
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    # 3b3070edb1fe 删除了模型中仍在使用的送达时间列，投递消息时写入该列
+    if 'created_at' not in {column['name'] for column in inspector.get_columns('message_recipients')}:
+        with op.batch_alter_table('message_recipients', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+        op.execute("""
+            UPDATE message_recipients SET created_at = (
+                SELECT m.created_at FROM messages m WHERE m.id = message_recipients.message_id
+            )
+        """)
+
+    for table, indexes in INDEXES.items():
+        existing = {index['name'] for index in inspector.get_indexes(table)}
+        missing = [(name, columns) for name, columns in indexes if name not in existing]
+        if not missing:
+            continue
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for name, columns in missing:
+                batch_op.create_index(name, columns, unique=False)
+
+
+def downgrade():
+    for table, indexes in INDEXES.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for name, _ in reversed(indexes):
+                batch_op.drop_index(name)
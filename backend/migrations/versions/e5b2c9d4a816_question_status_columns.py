@@ -0,0 +1,53 @@
+"""Add denormalized status columns to questions
+
+Revision ID: e5b2c9d4a816
+Revises: d3f8a6c21b47
+Create Date: 2026-10-18 12:14:52.603117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b2c9d4a816'
+down_revision = 'd3f8a6c21b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('questions', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_message_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('last_sender_role', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('student_unread_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('teacher_unread_count', sa.Integer(), server_default='0', nullable=False))
+
+    # 根据已有消息回填
+    op.execute("""
+        UPDATE questions SET
+            last_message_at = (
+                SELECT max(m.created_at) FROM messages m WHERE m.question_id = questions.id
+            ),
+            last_sender_role = (
+                SELECT u.user_type FROM messages m JOIN users u ON u.id = m.sender_id
+                WHERE m.question_id = questions.id
+                ORDER BY m.created_at DESC, m.id DESC LIMIT 1
+            ),
+            student_unread_count = (
+                SELECT count(*) FROM messages m
+                WHERE m.question_id = questions.id AND NOT m.is_read AND m.sender_id != questions.user_id
+            ),
+            teacher_unread_count = (
+                SELECT count(*) FROM messages m
+                WHERE m.question_id = questions.id AND NOT m.is_read AND m.sender_id = questions.user_id
+            )
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('questions', schema=None) as batch_op:
+        batch_op.drop_column('teacher_unread_count')
+        batch_op.drop_column('student_unread_count')
+        batch_op.drop_column('last_sender_role')
+        batch_op.drop_column('last_message_at')
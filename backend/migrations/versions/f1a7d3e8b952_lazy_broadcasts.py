@@ -0,0 +1,41 @@
+"""Add broadcasts and inbox_states tables for lazy announcement fan-out
+
+Revision ID: f1a7d3e8b952
+Revises: e5b2c9d4a816
+Create Date: 2026-10-18 13:02:11.274390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a7d3e8b952'
+down_revision = 'e5b2c9d4a816'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('broadcasts',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('message_id', sa.Integer(), nullable=False),
+        sa.Column('sender_id', sa.Integer(), nullable=False),
+        sa.Column('audience', sa.String(length=20), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ),
+        sa.ForeignKeyConstraint(['sender_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('message_id')
+    )
+    op.create_table('inbox_states',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('broadcast_synced_upto', sa.Integer(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('inbox_states')
+    op.drop_table('broadcasts')
@@ -77,7 +77,7 @@ class File(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     filename = db.Column(db.String(255), nullable=False)  # 原始文件名
-    file_key = db.Column(db.String(255), unique=True, nullable=False, index=True)  # 存储文件名
+    file_key = db.Column(db.String(255), nullable=False, index=True)  # 存储文件名（内容 SHA-256，可被多条记录共享）
     file_type = db.Column(db.String(50))  # 文件类型
     file_size = db.Column(db.Integer)  # 文件大小（字节）
     description = db.Column(db.Text)  # 文件描述
@@ -97,6 +97,13 @@ class File(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # 教师按学生、文档类型筛选并按时间排序查看上交文档；文件列表按上传者或全部文件按时间排序
+    __table_args__ = (
+        db.Index('ix_files_user_document_created', 'user_id', 'document_type', 'created_at'),
+        db.Index('ix_files_user_created', 'user_id', 'created_at'),
+        db.Index('ix_files_created_at', 'created_at'),
+    )
+    
     def to_dict(self):
         """转换为字典"""
         return {
@@ -126,6 +133,66 @@ class File(db.Model):
         return f'<File {self.filename}>'
 
 
+class FileBlob(db.Model):
+    """按内容寻址的文件实体，相同内容的上传共享一个物理文件"""
+    __tablename__ = 'file_blobs'
+
+    file_key = db.Column(db.String(255), primary_key=True)  # 内容的 SHA-256，同时是物理文件名
+    file_size = db.Column(db.Integer, nullable=False)  # 文件大小（字节）
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # 引用该内容的 File 记录数
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<FileBlob {self.file_key} refs={self.ref_count}>'
+
+
+class FileContent(db.Model):
+    """从上传文件中提取的文本，按 file_key（内容哈希）去重，供全文检索使用"""
+    __tablename__ = 'file_contents'
+
+    id = db.Column(db.Integer, primary_key=True)  # 同时作为全文索引的 rowid
+    file_key = db.Column(db.String(255), unique=True, nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # done, unsupported, failed
+    content = db.Column(db.Text)  # 提取出的纯文本
+    error = db.Column(db.Text)  # 提取失败原因
+    extracted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<FileContent {self.file_key} {self.status}>'
+
+
+class UploadSession(db.Model):
+    """分块上传会话，完成后生成与普通上传相同的 File 记录"""
+    __tablename__ = 'upload_sessions'
+
+    id = db.Column(db.String(32), primary_key=True)  # 上传会话ID（uuid hex）
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)  # 原始文件名
+    file_size = db.Column(db.Integer, nullable=False)  # 声明的文件总大小（字节）
+    received_size = db.Column(db.Integer, nullable=False, default=0)  # 已接收的字节数
+    description = db.Column(db.Text)
+    is_public = db.Column(db.Boolean, default=False)
+    document_type = db.Column(db.String(50))
+    submission_stage = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        """转换为字典"""
+        return {
+            'upload_id': self.id,
+            'filename': self.filename,
+            'file_size': self.file_size,
+            'received_size': self.received_size,
+            'is_complete': self.received_size >= self.file_size,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.received_size}/{self.file_size}>'
+
+
 class Question(db.Model):
     """问题模型，作为对话的主题"""
     __tablename__ = 'questions'
@@ -137,59 +204,112 @@ class Question(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_updated_by_student = db.Column(db.DateTime, default=datetime.utcnow)
     last_updated_by_teacher = db.Column(db.DateTime, nullable=True)
+    # 对话状态的冗余字段：发送消息和标记已读时维护，列表查询无需加载消息即可得到状态
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    last_sender_role = db.Column(db.String(20), nullable=True)  # 最后一条消息发送者的 user_type
+    student_unread_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')  # 提问学生未读的消息数
+    teacher_unread_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')  # 指导教师未读的消息数
 
     # 关系
     teacher = db.relationship('User', foreign_keys='Question.teacher_id', backref=db.backref('assigned_questions', lazy='dynamic'))
     messages = db.relationship('Message', backref='question', cascade="all, delete-orphan")
 
-    def get_dynamic_status(self, current_user_id):
-        if not self.messages:
-            return "未知"
+    # 问题列表按提问学生或负责教师筛选，并按创建时间排序
+    __table_args__ = (
+        db.Index('ix_questions_teacher_created', 'teacher_id', 'created_at'),
+        db.Index('ix_questions_user_created', 'user_id', 'created_at'),
+    )
 
-        # 确保消息按时间排序
-        sorted_messages = sorted(self.messages, key=lambda m: m.created_at)
-        last_message = sorted_messages[-1]
-        
-        # 判断当前用户角色（这需要数据库查询，但为了简化调用签名，我们在内部做）
-        # 注意：这里可能会有性能问题，但在小规模应用中可接受
-        # 更好的做法是从外部传入 current_user 对象
-        # User 类在当前文件中定义，直接使用即可
-        current_user = User.query.get(current_user_id)
-        if not current_user:
+    # 各视角下的状态，按需要处理的优先级排列
+    TEACHER_STATUSES = ['待回答', '已回复', '开放中', '未知']
+    STUDENT_STATUSES = ['待查看', '等待回答', '已回复', '开放中', '未知']
+
+    def record_message(self, message, sender_role):
+        """
+        记录一条新消息：更新最后消息信息，对方的未读数加一
+
+        使用原子 UPDATE，在调用方事务中执行；message 须已 flush。
+        """
+        values = {
+            Question.last_message_at: message.created_at,
+            Question.last_sender_role: sender_role,
+        }
+        if message.sender_id == self.user_id:
+            values[Question.teacher_unread_count] = Question.teacher_unread_count + 1
+        else:
+            values[Question.student_unread_count] = Question.student_unread_count + 1
+        Question.query.filter_by(id=self.id).update(values, synchronize_session=False)
+
+    def unread_count_for(self, user_id):
+        """user_id 在该对话中的未读消息数"""
+        if user_id == self.user_id:
+            return self.student_unread_count or 0
+        if user_id == self.teacher_id:
+            return self.teacher_unread_count or 0
+        return 0
+
+    def mark_read_by(self, user_id):
+        """清零 user_id 一侧的未读数，返回是否有变化"""
+        if not self.unread_count_for(user_id):
+            return False
+        if user_id == self.user_id:
+            self.student_unread_count = 0
+        else:
+            self.teacher_unread_count = 0
+        return True
+
+    def get_dynamic_status(self, current_user_id):
+        """根据冗余字段计算当前用户视角下的状态，与 status_expression 保持一致"""
+        if self.last_message_at is None:
             return "未知"
-            
-        is_teacher = (current_user.user_type == 'teacher')
-        
-        # 检查是否有未读消息（针对当前用户）
-        # 如果是老师，关注来自学生的未读消息
-        # 如果是学生，关注来自老师的未读消息
-        has_unread_for_me = any(not m.is_read for m in self.messages if m.sender_id != current_user_id)
 
-        if is_teacher:
+        if current_user_id == self.teacher_id:
             # --- 教师视角状态 ---
-            if has_unread_for_me:
-                return "待回答" # 有学生的新消息
-            
-            # 如果最后一条消息是学生发的，且没有未读（这在逻辑上有点冲突，除非已读但未回），通常算待回答
-            if last_message.sender.user_type == 'student':
+            if self.teacher_unread_count:
+                return "待回答"  # 有学生的新消息
+            if self.last_sender_role == 'student':
                 return "待回答"
-            
-            # 如果最后一条是老师发的
-            if last_message.sender.user_type == 'teacher':
+            if self.last_sender_role == 'teacher':
                 return "已回复"
-                
         else:
             # --- 学生视角状态 ---
-            if has_unread_for_me:
-                return "待查看" # 老师回复了
-            
-            if last_message.sender.user_type == 'student':
+            if self.student_unread_count:
+                return "待查看"  # 老师回复了
+            if self.last_sender_role == 'student':
                 return "等待回答"
-            elif last_message.sender.user_type == 'teacher':
-                return "已回复" # 已查看
-        
+            if self.last_sender_role == 'teacher':
+                return "已回复"  # 已查看
+
         return "开放中"
 
+    @classmethod
+    def status_expression(cls, as_teacher):
+        """get_dynamic_status 的 SQL 版本，用于在数据库中按状态筛选和排序"""
+        if as_teacher:
+            return db.case(
+                (cls.last_message_at.is_(None), '未知'),
+                (cls.teacher_unread_count > 0, '待回答'),
+                (cls.last_sender_role == 'student', '待回答'),
+                (cls.last_sender_role == 'teacher', '已回复'),
+                else_='开放中'
+            )
+        return db.case(
+            (cls.last_message_at.is_(None), '未知'),
+            (cls.student_unread_count > 0, '待查看'),
+            (cls.last_sender_role == 'student', '等待回答'),
+            (cls.last_sender_role == 'teacher', '已回复'),
+            else_='开放中'
+        )
+
+    @classmethod
+    def status_priority_expression(cls, as_teacher):
+        """状态的排序值，需要处理的对话排在前面"""
+        statuses = cls.TEACHER_STATUSES if as_teacher else cls.STUDENT_STATUSES
+        return db.case(
+            {status: index for index, status in enumerate(statuses)},
+            value=cls.status_expression(as_teacher)
+        )
+
     def to_dict(self, current_user_id=None):
         """基本序列化，不含消息列表"""
         
@@ -270,7 +390,11 @@ class TeacherStudent(db.Model):
     teacher = db.relationship('User', foreign_keys=[teacher_id], backref=db.backref('managed_students', lazy=True))
     student = db.relationship('User', foreign_keys=[student_id], backref=db.backref('teachers', lazy=True))
     
-    __table_args__ = (db.UniqueConstraint('teacher_id', 'student_id', name='unique_teacher_student'),)
+    # 唯一约束的索引以 teacher_id 开头，按学生查找其教师另需 student_id 索引
+    __table_args__ = (
+        db.UniqueConstraint('teacher_id', 'student_id', name='unique_teacher_student'),
+        db.Index('ix_teacher_students_student_id', 'student_id'),
+    )
     
     def to_dict(self):
         """转换为字典"""
@@ -342,6 +466,35 @@ class MessageRecipient(db.Model):
     def __repr__(self):
         return f'<MessageRecipient message={self.message_id} recipient={self.recipient_id} is_read={self.is_read}>'
 
+
+class Broadcast(db.Model):
+    """全体公告，只保存一条记录，接收者访问收件箱时再按需投递（见 inbox.sync_broadcasts）"""
+    __tablename__ = 'broadcasts'
+
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('messages.id'), nullable=False, unique=True)
+    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    audience = db.Column(db.String(20), nullable=False, default='all')  # all, teacher, student
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    message = db.relationship('Message', backref=db.backref('broadcast', uselist=False))
+
+    def __repr__(self):
+        return f'<Broadcast {self.id} message={self.message_id} audience={self.audience}>'
+
+
+class InboxState(db.Model):
+    """用户收件箱状态（每个用户一行，未读数按主键直接读取）"""
+    __tablename__ = 'inbox_states'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    broadcast_synced_upto = db.Column(db.Integer, default=0, nullable=False, server_default='0')  # 已投递到收件箱的最大 Broadcast.id
+    unread_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')  # 未读消息数，随投递和标记已读原子增减
+
+    def __repr__(self):
+        return f'<InboxState user={self.user_id} synced={self.broadcast_synced_upto} unread={self.unread_count}>'
+
+
 class TeacherReview(db.Model):
     """学生对教师的评价"""
     __tablename__ = 'teacher_reviews'
@@ -380,4 +533,36 @@ class TeacherReview(db.Model):
             'rating': self.rating,
             'comment': self.comment,
             'created_at': self.created_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+class TeacherRatingStats(db.Model):
+    """教师评价的汇总统计（每位教师一行），提交评价时在同一事务中原子更新，见 ratings.record_review"""
+    __tablename__ = 'teacher_rating_stats'
+
+    teacher_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    review_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    rating_sum = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    # 各分值的评价数
+    rating_1 = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    rating_2 = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    rating_3 = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    rating_4 = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    rating_5 = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+
+    @property
+    def avg_rating(self):
+        return round(self.rating_sum / self.review_count, 1) if self.review_count else 0
+
+    def rating_distribution(self):
+        return {score: getattr(self, f'rating_{score}') for score in range(1, 6)}
+
+    def to_dict(self):
+        """转换为字典（字段与原先按评价计算的统计一致）"""
+        return {
+            'total_count': self.review_count,
+            'avg_rating': self.avg_rating,
+            'rating_distribution': self.rating_distribution()
+        }
+
+    def __repr__(self):
+        return f'<TeacherRatingStats teacher={self.teacher_id} count={self.review_count} sum={self.rating_sum}>'
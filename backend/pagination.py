@@ -0,0 +1,131 @@
+"""
+列表分页 - 页码分页与键集（游标）分页
+
+所有列表接口共用：
+- 默认沿用页码分页（page / per_page），返回 total / pages / current_page，兼容现有前端
+- 请求带 cursor 参数时（首页传空字符串）使用键集分页：按排序键 (created_at, id) 等定位，
+  不使用 OFFSET，也不执行 COUNT(*)，任意深度的翻页代价与第一页相同；
+  返回 next_cursor / has_more，只有传 with_total=1 时才统计总数
+- per_page 由服务端限制在 MAX_PER_PAGE 以内
+"""
+from collections import namedtuple
+from datetime import datetime
+from flask import current_app, request
+from sqlalchemy import and_, or_
+import base64
+import json
+
+DEFAULT_MAX_PER_PAGE = 100
+
+
+class InvalidCursor(ValueError):
+    """游标无法解析或与当前排序不匹配"""
+
+
+def get_per_page(default=10):
+    """读取 per_page 参数并限制在 [1, MAX_PER_PAGE]"""
+    max_per_page = current_app.config.get('MAX_PER_PAGE', DEFAULT_MAX_PER_PAGE)
+    per_page = request.args.get('per_page', default, type=int)
+    return max(1, min(per_page, max_per_page))
+
+
+def is_cursor_request():
+    """请求是否使用键集分页"""
+    return 'cursor' in request.args
+
+
+def encode_cursor(values):
+    """将排序键的值编码为不透明的游标字符串"""
+    payload = [{'dt': v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """解析游标，返回排序键的值列表"""
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(data)
+        values = [datetime.fromisoformat(v['dt']) if isinstance(v, dict) else v for v in payload]
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor('无效的分页游标')
+    if len(values) != size:
+        raise InvalidCursor('无效的分页游标')
+    return values
+
+
+def _order_clauses(keys):
+    return [column.desc() if direction == 'desc' else column.asc() for column, direction in keys]
+
+
+def _after(keys, values):
+    """排在游标之后的行：按排序键做字典序比较，展开为 OR/AND 以便使用索引"""
+    conditions = []
+    for i, (column, direction) in enumerate(keys):
+        equal = [keys[j][0] == values[j] for j in range(i)]
+        beyond = column < values[i] if direction == 'desc' else column > values[i]
+        conditions.append(and_(*equal, beyond))
+    return or_(*conditions)
+
+
+class Page:
+    """一页结果，meta() 给出对应分页方式的分页信息"""
+
+    def __init__(self, items, total=None, page=None, pages=None, next_cursor=None, cursor_mode=False):
+        self.items = items
+        self.total = total
+        self.page = page
+        self.pages = pages
+        self.next_cursor = next_cursor
+        self.cursor_mode = cursor_mode
+
+    def meta(self):
+        if not self.cursor_mode:
+            return {'total': self.total, 'pages': self.pages, 'current_page': self.page}
+        meta = {'next_cursor': self.next_cursor, 'has_more': self.next_cursor is not None}
+        if self.total is not None:
+            meta['total'] = self.total
+        return meta
+
+
+def paginate(query, keys, default_per_page=10):
+    """
+    按请求参数分页
+
+    keys 为 [(列或表达式, 'asc' | 'desc'), ...]，最后一个应为唯一列（如 id），
+    同时作为排序条件；查询本身不应再设置 order_by。
+    查询结果为多列（add_columns）时，items 中的每一项是去掉排序键后的行。
+    """
+    per_page = get_per_page(default_per_page)
+
+    if not is_cursor_request():
+        page = request.args.get('page', 1, type=int)
+        paginated = query.order_by(*_order_clauses(keys)).paginate(page=page, per_page=per_page, error_out=False)
+        return Page(paginated.items, total=paginated.total, page=page, pages=paginated.pages)
+
+    total = None
+    if request.args.get('with_total', type=int):
+        total = query.order_by(None).count()
+
+    cursor = request.args.get('cursor', '')
+    if cursor:
+        query = query.filter(_after(keys, decode_cursor(cursor, len(keys))))
+
+    key_columns = [column.label(f'_page_key_{i}') for i, (column, _) in enumerate(keys)]
+    rows = query.add_columns(*key_columns).order_by(*_order_clauses(keys)).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(list(rows[-1][-len(keys):]))
+
+    items = []
+    if rows:
+        # 多列结果保留列名，与页码分页时的行一样可按属性访问
+        fields = rows[0]._fields[:-len(keys)]
+        item_row = namedtuple('Row', [f or f'_{i}' for i, f in enumerate(fields)], rename=True)
+    for row in rows:
+        entity = row[:-len(keys)]
+        items.append(entity[0] if len(entity) == 1 else item_row(*entity))
+
+    return Page(items, total=total, next_cursor=next_cursor, cursor_mode=True)
@@ -1,12 +1,38 @@
 
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_current_user
+from sqlalchemy import select, func
 from sqlalchemy.orm import joinedload, selectinload
 from models import db, Question, User, Message
+from datetime import datetime
+from pagination import paginate, InvalidCursor
+import search
+import events
+from response_cache import cached, invalidate, question_tag
 import traceback
 
 questions_bp = Blueprint('questions_bp', __name__, url_prefix='/api/questions')
 
+# 问题列表的默认排序：最新的在前
+QUESTION_ORDER_KEYS = [(Question.created_at, 'desc'), (Question.id, 'desc')]
+
+
+def _questions_query(user_id, as_teacher):
+    """教师负责的问题或学生本人提出的问题"""
+    if as_teacher:
+        return Question.query.filter_by(teacher_id=user_id)
+    return Question.query.filter_by(user_id=user_id)
+
+
+def _participant_questions_query(user_id):
+    """本人提问或本人负责的问题"""
+    return Question.query.filter((Question.user_id == user_id) | (Question.teacher_id == user_id))
+
+
+def _dashboard_questions_query(teacher_id):
+    """教师负责的全部问题，按学生分组排列（同一学生的问题最新的在前）"""
+    return Question.query.filter_by(teacher_id=teacher_id).order_by(Question.user_id, Question.created_at.desc())
+
 @questions_bp.route('/', methods=['POST'], strict_slashes=False)
 @jwt_required()
 def create_question():
@@ -19,14 +45,18 @@ def create_question():
         return jsonify({'code': 400, 'message': '标题和内容不能为空'}), 400
 
     try:
-        user = User.query.get(user_id)
+        user = get_current_user()
         if not user:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
 
-        # 创建 Question 作为对话线程
+        # 创建 Question 作为对话线程，第一条消息由提问者发出，对教师未读
+        now = datetime.utcnow()
         question_data = {
             'title': title,
-            'user_id': user_id
+            'user_id': user_id,
+            'last_message_at': now,
+            'last_sender_role': user.user_type,
+            'teacher_unread_count': 1
         }
         if user.guidance_teacher_id:
             question_data['teacher_id'] = user.guidance_teacher_id
@@ -35,12 +65,18 @@ def create_question():
         # 创建第一条 Message
         message = Message(
             sender_id=user_id,
-            content=content
+            content=content,
+            created_at=now
         )
         question.messages.append(message)
 
         db.session.add(question)
+        db.session.flush()
+        search.index_question(question)
+        search.index_message(message)
+        invalidate(question_tag(question.teacher_id))
         db.session.commit()
+        events.publish_question_message(question, message)
         
         return jsonify({'code': 201, 'message': '问题已提交', 'data': question.to_dict(current_user_id=user_id)}), 201
     except Exception as e:
@@ -55,43 +91,122 @@ def create_question():
 @jwt_required()
 def get_questions():
     search_keyword = request.args.get('search', '')
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    status = request.args.get('status', '')
+    sort = request.args.get('sort', 'created')  # created, activity, status
     user_id = int(get_jwt_identity())
 
     try:
-        user = User.query.get(user_id)
+        user = get_current_user()
         if not user:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
 
         # 根据用户角色构建查询
-        if user.user_type == 'teacher':
-            query = Question.query.filter_by(teacher_id=user_id)
-        else:
-            query = Question.query.filter_by(user_id=user_id)
-
-        query = query.options(
+        as_teacher = user.user_type == 'teacher'
+        query = _questions_query(user_id, as_teacher).options(
             joinedload(Question.author), 
-            joinedload(Question.teacher),
-            selectinload(Question.messages).options(joinedload(Message.sender))
-        ).order_by(Question.created_at.desc())
+            joinedload(Question.teacher)
+        )
 
-        if search_keyword:
-            query = query.filter(Question.title.ilike(f'%{search_keyword}%'))
+        # 状态由冗余字段在数据库中计算，可直接筛选和排序
+        if status:
+            query = query.filter(Question.status_expression(as_teacher) == status)
+
+        last_activity = func.coalesce(Question.last_message_at, Question.created_at)
+        if sort == 'status':
+            order_keys = [(Question.status_priority_expression(as_teacher), 'asc'),
+                          (last_activity, 'desc'), (Question.id, 'desc')]
+        elif sort == 'activity':
+            order_keys = [(last_activity, 'desc'), (Question.id, 'desc')]
+        else:
+            order_keys = QUESTION_ORDER_KEYS
 
-        paginated_questions = query.paginate(page=page, per_page=per_page, error_out=False)
+        if search_keyword:
+            # 优先使用全文索引（标题 + 消息内容），不可用时回退为标题 LIKE
+            matches = search.question_search_subquery(search_keyword)
+            if matches is not None:
+                query = query.filter(Question.id.in_(select(matches.c.question_id)))
+            else:
+                query = query.filter(Question.title.ilike(f'%{search_keyword}%'))
+
+        result = paginate(query, order_keys)
         
-        questions_data = [q.to_dict(current_user_id=user_id) for q in paginated_questions.items]
+        questions_data = [q.to_dict(current_user_id=user_id) for q in result.items]
 
         return jsonify({
             'code': 200,
             'data': {
                 'questions': questions_data,
-                'total': paginated_questions.total,
-                'page': paginated_questions.page,
-                'pages': paginated_questions.pages,
+                'page': result.page,
+                **result.meta()
             }
         }), 200
+    except InvalidCursor as e:
+        return jsonify({'code': 400, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
+
+@questions_bp.route('/search', methods=['GET'])
+@jwt_required()
+def search_questions():
+    """在问题标题和对话消息中全文检索，只搜索本人提问或本人负责的对话，结果按相关度排序"""
+    user_id = int(get_jwt_identity())
+    keyword = request.args.get('keyword', '', type=str).strip()
+
+    if not keyword:
+        return jsonify({'code': 400, 'message': '搜索关键词不能为空'}), 400
+
+    try:
+        query = _participant_questions_query(user_id)\
+            .options(joinedload(Question.author), joinedload(Question.teacher))
+
+        order_keys = QUESTION_ORDER_KEYS
+        matches = search.question_search_subquery(keyword)
+        if matches is not None:
+            query = query.join(matches, Question.id == matches.c.question_id)\
+                .add_columns(matches.c.message_id)
+            order_keys = [(matches.c.rank, 'asc')] + order_keys
+        else:
+            # 回退为 LIKE：取每个对话中最新一条命中的消息
+            matched_message = select(func.max(Message.id))\
+                .where(Message.question_id == Question.id, Message.content.ilike(f'%{keyword}%'))\
+                .correlate(Question).scalar_subquery()
+            query = query.add_columns(matched_message.label('message_id'))\
+                .filter(Question.title.ilike(f'%{keyword}%') | matched_message.isnot(None))
+
+        result = paginate(query, order_keys)
+
+        message_ids = [message_id for _, message_id in result.items if message_id]
+        messages = {}
+        if message_ids:
+            messages = {m.id: m for m in Message.query.options(joinedload(Message.sender))
+                        .filter(Message.id.in_(message_ids)).all()}
+
+        results = []
+        for question, message_id in result.items:
+            item = question.to_dict(current_user_id=user_id)
+            item['title_highlight'] = search.make_snippet(question.title, keyword, width=100)
+            message = messages.get(message_id)
+            if message:
+                item['matched_message'] = {
+                    'id': message.id,
+                    'sender_name': message.sender.real_name or message.sender.username if message.sender else '',
+                    'created_at': message.created_at.isoformat() if message.created_at else '',
+                    'snippet': search.make_snippet(message.content, keyword)
+                }
+            else:
+                item['matched_message'] = None
+            results.append(item)
+
+        return jsonify({
+            'code': 200,
+            'data': {
+                'questions': results,
+                'page': result.page,
+                **result.meta()
+            }
+        }), 200
+    except InvalidCursor as e:
+        return jsonify({'code': 400, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
 
@@ -113,14 +228,18 @@ def get_question_details(question_id):
         if user_id != question.user_id and user_id != question.teacher_id:
             return jsonify({'code': 403, 'message': '无权访问此问题'}), 403
 
-        # 标记消息为已读
+        # 标记消息为已读，并清零当前用户一侧的未读数
         updated = False
         for msg in question.messages:
             if msg.sender_id != user_id and not msg.is_read:
                 msg.is_read = True
                 updated = True
+
+        if question.mark_read_by(user_id):
+            updated = True
         
         if updated:
+            invalidate(question_tag(question.teacher_id))
             db.session.commit()
             
         return jsonify({'code': 200, 'data': question.to_dict_with_messages(current_user_id=user_id)}), 200
@@ -158,7 +277,13 @@ def create_message(question_id):
         )
         
         db.session.add(message)
+        db.session.flush()
+        sender = get_current_user()
+        question.record_message(message, sender.user_type if sender else None)
+        search.index_message(message)
+        invalidate(question_tag(question.teacher_id))
         db.session.commit()
+        events.publish_question_message(question, message)
 
         return jsonify({'code': 201, 'message': '消息已发送', 'data': message.to_dict()}), 201
 
@@ -179,7 +304,9 @@ def delete_question(question_id):
         if user_id != question.user_id:
             return jsonify({'code': 403, 'message': '无权删除此问题'}), 403
 
+        search.remove_question(question.id)
         db.session.delete(question)
+        invalidate(question_tag(question.teacher_id))
         db.session.commit()
         return jsonify({'code': 200, 'message': '问题已成功删除'}), 200
     except Exception as e:
@@ -188,18 +315,21 @@ def delete_question(question_id):
 
 @questions_bp.route('/teacher-dashboard', methods=['GET'])
 @jwt_required()
+@cached(tags=lambda: [question_tag(get_jwt_identity()), 'users'])
 def get_teacher_dashboard_questions():
     user_id = int(get_jwt_identity())
     try:
-        user = User.query.get(user_id)
+        user = get_current_user()
         if not user or user.user_type != 'teacher':
             return jsonify({'code': 403, 'message': '仅教师有权访问'}), 403
 
-        # 获取该老师指导的所有问题，并按学生ID和创建时间排序
-        questions = Question.query.filter_by(teacher_id=user_id)\
-            .options(joinedload(Question.author))\
-            .order_by(Question.user_id, Question.created_at.desc())\
-            .all()
+        # 获取该老师指导的所有问题，并按学生ID和创建时间排序（可按状态筛选）
+        query = _dashboard_questions_query(user_id)\
+            .options(joinedload(Question.author), joinedload(Question.teacher))
+        status = request.args.get('status', '')
+        if status:
+            query = query.filter(Question.status_expression(True) == status)
+        questions = query.all()
 
         # 按学生ID对问题进行分组
         from collections import defaultdict
@@ -0,0 +1,89 @@
+"""
+教师评价统计
+
+- teacher_rating_stats 为每位教师保存评价数、总分和 1-5 分的分布，
+  submit_teacher_review 在插入评价的同一事务中以原子 UPDATE 累加，读取统计不再扫描 teacher_reviews
+- 每位教师最新的几条评价用窗口函数一次查出，与教师数量无关
+- flask rebuild-rating-stats 根据 teacher_reviews 重新计算全部统计（可重复执行）
+"""
+from sqlalchemy import select, literal, exists, func, case
+from flask.cli import with_appcontext
+import click
+from models import db, TeacherReview, TeacherRatingStats
+
+
+def record_review(teacher_id, rating):
+    """为教师累加一条评价（在调用方事务中执行）"""
+    db.session.execute(
+        TeacherRatingStats.__table__.insert().from_select(
+            ['teacher_id'],
+            select(literal(teacher_id)).where(~exists().where(TeacherRatingStats.teacher_id == teacher_id))
+        )
+    )
+    values = {
+        TeacherRatingStats.review_count: TeacherRatingStats.review_count + 1,
+        TeacherRatingStats.rating_sum: TeacherRatingStats.rating_sum + rating
+    }
+    bucket = getattr(TeacherRatingStats, f'rating_{rating}')
+    values[bucket] = bucket + 1
+    TeacherRatingStats.query.filter_by(teacher_id=teacher_id).update(values, synchronize_session=False)
+
+
+def get_stats(teacher_id):
+    """一位教师的统计（没有评价时为零值）"""
+    stats = db.session.get(TeacherRatingStats, teacher_id)
+    if stats is None:
+        return {'total_count': 0, 'avg_rating': 0, 'rating_distribution': {score: 0 for score in range(1, 6)}}
+    return stats.to_dict()
+
+
+def latest_reviews(teacher_ids, limit=3):
+    """每位教师最新的 limit 条评价，返回 {teacher_id: [TeacherReview, ...]}"""
+    if not teacher_ids:
+        return {}
+    row_number = func.row_number().over(
+        partition_by=TeacherReview.teacher_id,
+        order_by=(TeacherReview.created_at.desc(), TeacherReview.id.desc())
+    ).label('row_number')
+    ranked = select(TeacherReview.id, row_number)\
+        .where(TeacherReview.teacher_id.in_(teacher_ids)).subquery()
+    reviews = TeacherReview.query.join(ranked, ranked.c.id == TeacherReview.id)\
+        .filter(ranked.c.row_number <= limit)\
+        .order_by(TeacherReview.created_at.desc(), TeacherReview.id.desc()).all()
+
+    result = {teacher_id: [] for teacher_id in teacher_ids}
+    for review in reviews:
+        result[review.teacher_id].append(review)
+    return result
+
+
+def rebuild_rating_stats():
+    """根据 teacher_reviews 重新计算全部教师的统计，返回有评价的教师数"""
+    columns = [
+        TeacherReview.teacher_id,
+        func.count(TeacherReview.id),
+        func.coalesce(func.sum(TeacherReview.rating), 0)
+    ] + [func.sum(case((TeacherReview.rating == score, 1), else_=0)) for score in range(1, 6)]
+
+    TeacherRatingStats.query.delete(synchronize_session=False)
+    result = db.session.execute(
+        TeacherRatingStats.__table__.insert().from_select(
+            ['teacher_id', 'review_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5'],
+            select(*columns).group_by(TeacherReview.teacher_id)
+        )
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+@click.command('rebuild-rating-stats')
+@with_appcontext
+def rebuild_rating_stats_command():
+    """根据全部评价重建教师评价统计（可重复执行）"""
+    count = rebuild_rating_stats()
+    click.echo(f'已重建 {count} 位教师的评价统计')
+
+
+def init_app(app):
+    """注册命令行命令"""
+    app.cli.add_command(rebuild_rating_stats_command)
@@ -0,0 +1,240 @@
+"""
+响应缓存 - 读多写少的接口按标签失效
+
+- 缓存键由接口名、规范化后的查询参数、调用者（JWT 身份）和相关标签的当前版本号组成
+- 写操作通过 invalidate(*tags) 使标签版本号加一，版本号在事务提交后才递增：
+  读请求先读版本号再查库，提交前读到旧版本号的结果只会写入旧键，之后不再被命中，
+  因此写入提交后不会返回旧数据；旧条目由 LRU 淘汰
+- 后端：默认 'memory'（进程内 LRU，版本号也在进程内，只适用于单进程或测试，
+  WEB_CONCURRENCY 大于 1 时自动关闭缓存，避免一个 worker 写入后其他 worker 返回旧数据）；
+  'redis' 时版本号和条目保存在 Redis 中（RESPONSE_CACHE_REDIS_URL，需安装 redis 包），
+  多个 worker 之间共享，本进程另有一层 LRU 缓存条目
+- User 行在任何会话中新增、修改或删除时自动使 'users' 标签失效
+"""
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, request, current_app
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, User
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 2048
+DEFAULT_CACHE_TTL = 300  # 秒
+
+
+class LRU:
+    """线程安全、带过期时间的 LRU 字典"""
+
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()  # key -> (过期时间, 值)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class MemoryBackend:
+    """进程内后端：版本号和条目都保存在本进程中"""
+
+    def __init__(self, size):
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.entries = LRU(size)
+
+    def versions(self, tags):
+        return [self._versions.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value, ttl):
+        self.entries.set(key, value, ttl)
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+        self.entries.clear()
+
+
+class RedisBackend:
+    """共享后端：版本号和条目保存在 Redis 中，条目另在本进程 LRU 中缓存（键含版本号，失效后不会再命中）"""
+
+    def __init__(self, size, url, prefix):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RESPONSE_CACHE_BACKEND=redis 需要安装 redis 包')
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._local_ttl = 30  # 本进程中的条目只作为 Redis 读取的缓冲
+        self.entries = LRU(size)
+
+    def versions(self, tags):
+        values = self._redis.mget([f'{self._prefix}tag:{tag}' for tag in tags])
+        return [int(value) if value else 0 for value in values]
+
+    def bump(self, tags):
+        pipe = self._redis.pipeline()
+        for tag in tags:
+            pipe.incr(f'{self._prefix}tag:{tag}')
+        pipe.execute()
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            raw = self._redis.get(f'{self._prefix}entry:{key}')
+            if raw is not None:
+                value = json.loads(raw)
+                self.entries.set(key, value, self._local_ttl)
+        return value
+
+    def set(self, key, value, ttl):
+        self.entries.set(key, value, min(ttl, self._local_ttl))
+        self._redis.set(f'{self._prefix}entry:{key}', json.dumps(value), ex=ttl)
+
+    def clear(self):
+        self.entries.clear()
+
+
+_state = {'backend': MemoryBackend(DEFAULT_CACHE_SIZE), 'ttl': DEFAULT_CACHE_TTL, 'enabled': True}
+
+
+def _cache_key(tags):
+    args = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+    versions = ','.join(str(v) for v in _state['backend'].versions(tags))
+    return f'{request.endpoint}|{get_jwt_identity()}|{args}|{versions}'
+
+
+def cached(tags):
+    """
+    缓存视图的 200 响应（放在 jwt_required 之后，按调用者区分）
+
+    tags 为标签列表，或在请求上下文中返回标签列表的函数。
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not _state['enabled']:
+                return view(*args, **kwargs)
+
+            resolved = tags() if callable(tags) else tags
+            try:
+                key = _cache_key(resolved)
+                entry = _state['backend'].get(key)
+            except Exception as e:
+                logger.warning(f'Response cache unavailable: {e}')
+                return view(*args, **kwargs)
+
+            if entry is not None:
+                body, mimetype = entry
+                response = Response(body, status=200, mimetype=mimetype)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                try:
+                    _state['backend'].set(key, [response.get_data(as_text=True), response.mimetype], _state['ttl'])
+                except Exception as e:
+                    logger.warning(f'Response cache unavailable: {e}')
+                response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate(*tags):
+    """使标签失效（在写事务中、提交之前调用，提交后生效；回滚则不生效）"""
+    db.session.info.setdefault('_invalidated_cache_tags', set()).update(tag for tag in tags if tag)
+
+
+def bump(*tags):
+    """立即使标签失效（不在事务中的写入使用）"""
+    if tags:
+        _state['backend'].bump(sorted(tags))
+
+
+def clear():
+    """清空缓存"""
+    _state['backend'].clear()
+
+
+def question_tag(teacher_id):
+    """教师问答看板的标签"""
+    return f'questions:teacher:{teacher_id}'
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_flushed_users(session, flush_context):
+    if any(isinstance(obj, User) for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+        session.info.setdefault('_invalidated_cache_tags', set()).add('users')
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_committed_tags(session):
+    tags = session.info.pop('_invalidated_cache_tags', None)
+    if tags:
+        try:
+            bump(*tags)
+        except Exception as e:
+            logger.error(f'Response cache invalidation error: {str(e)}', exc_info=True)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidated_tags(session):
+    session.info.pop('_invalidated_cache_tags', None)
+
+
+def init_app(app):
+    """根据配置选择缓存后端"""
+    size = app.config.get('RESPONSE_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+    _state['ttl'] = app.config.get('RESPONSE_CACHE_TTL', DEFAULT_CACHE_TTL)
+    _state['enabled'] = size > 0
+    backend = app.config.get('RESPONSE_CACHE_BACKEND', 'memory')
+    if backend != 'redis' and _state['enabled'] and app.config.get('WEB_CONCURRENCY', 1) > 1:
+        logger.warning('Response cache disabled: the memory backend cannot be invalidated across '
+                       f"{app.config['WEB_CONCURRENCY']} workers, set RESPONSE_CACHE_BACKEND=redis")
+        _state['enabled'] = False
+    if backend == 'redis':
+        _state['backend'] = RedisBackend(
+            size,
+            app.config.get('RESPONSE_CACHE_REDIS_URL', 'redis://localhost:6379/0'),
+            app.config.get('RESPONSE_CACHE_PREFIX', 'guidance-cache:')
+        )
+    else:
+        _state['backend'] = MemoryBackend(size)
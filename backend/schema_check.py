@@ -0,0 +1,140 @@
+"""
+结构漂移与查询计划检查
+
+- 结构漂移：对比 models.py 声明的表、列、索引与当前数据库。create_all 不会给已有的表补建索引，
+  缺失的索引需要通过迁移（flask db upgrade）补齐
+- 查询计划：对列表接口的热点查询执行 EXPLAIN QUERY PLAN（仅 SQLite），
+  出现全表扫描（SCAN 表 且未使用索引）时判定失败——这类接口的耗时随表的行数线性增长
+
+flask check-schema 输出两项检查的结果，存在问题时以非零状态退出，可用于部署前和 CI 中的检查。
+"""
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import with_parent
+from werkzeug.datastructures import MultiDict
+import click
+import re
+from models import db, User, Question, Message
+from pagination import _order_clauses
+from inbox import inbox_query, INBOX_ORDER_KEYS
+from questions import (_questions_query, _participant_questions_query, _dashboard_questions_query,
+                       QUESTION_ORDER_KEYS)
+from files import _visible_files_query, FILE_ORDER_KEYS
+from teacher import (_students_query, _student_documents_query, _my_teachers_query, _reviews_query,
+                     STUDENT_ORDER_KEYS, DOCUMENT_ORDER_KEYS, REVIEW_ORDER_KEYS)
+
+REPRESENTATIVE_ID = 1  # 查询计划与参数值无关，使用任意 id
+
+# 不带 USING INDEX 的 SCAN 为全表扫描；SCAN 子查询、常量行、虚拟表（全文索引）不计入
+_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(?!CONSTANT ROW)([^\s(]+)(?: AS \S+)?$')
+
+
+def _page(query, keys):
+    """与列表接口（paginate）一致：按排序键排序后取第一页"""
+    return query.order_by(*_order_clauses(keys)).limit(10)
+
+
+def _question_messages(question_id):
+    """问题详情通过 selectinload(Question.messages) 加载消息，条件取自同一关系"""
+    return Message.query.filter(with_parent(Question(id=question_id), Question.messages))
+
+
+# 接口名 -> 根据用户 id 构造该接口主查询的函数；查询和排序键与接口使用的是同一组函数和常量
+HOT_QUERIES = {
+    'questions.list (teacher)': lambda uid: _page(_questions_query(uid, as_teacher=True), QUESTION_ORDER_KEYS),
+    'questions.list (student)': lambda uid: _page(_questions_query(uid, as_teacher=False), QUESTION_ORDER_KEYS),
+    'questions.search': lambda uid: _page(_participant_questions_query(uid), QUESTION_ORDER_KEYS),
+    'questions.teacher_dashboard': _dashboard_questions_query,
+    'questions.messages': _question_messages,
+    'files.list': lambda uid: _page(_visible_files_query(User(id=uid, user_type='student')), FILE_ORDER_KEYS),
+    'files.list (admin)': lambda uid: _page(_visible_files_query(User(id=uid, user_type='admin')), FILE_ORDER_KEYS),
+    'teacher.students': lambda uid: _page(_students_query(uid), STUDENT_ORDER_KEYS),
+    'teacher.student_documents': lambda uid: _page(_student_documents_query(uid, MultiDict()), DOCUMENT_ORDER_KEYS),
+    'teacher.my_teachers': _my_teachers_query,
+    'teacher.messages': lambda uid: _page(inbox_query(uid), INBOX_ORDER_KEYS),
+    'teacher.reviews': lambda uid: _page(_reviews_query(uid), REVIEW_ORDER_KEYS),
+}
+
+
+def schema_drift():
+    """返回模型与数据库不一致之处的描述列表（缺失的表、列和索引）"""
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    problems = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            problems.append(f'缺少表 {table.name}')
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                problems.append(f'缺少列 {table.name}.{column.name}')
+
+        # 按列组合比较，同样的索引在旧数据库中可能名称不同
+        existing = {tuple(index['column_names']) for index in inspector.get_indexes(table.name)}
+        existing |= {tuple(constraint['column_names']) for constraint in inspector.get_unique_constraints(table.name)}
+        for index in table.indexes:
+            if tuple(column.name for column in index.columns) not in existing:
+                problems.append(f'缺少索引 {index.name} ON {table.name} '
+                                f'({", ".join(column.name for column in index.columns)})')
+    return problems
+
+
+def explain(query):
+    """SQLite 的 EXPLAIN QUERY PLAN，返回计划中每一步的描述"""
+    statement = query.statement if hasattr(query, 'statement') else query
+    sql = str(statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    return [row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+
+
+def full_scans(plan):
+    """计划中被全表扫描的表"""
+    return [match.group(1) for match in (_FULL_SCAN.match(step.strip()) for step in plan) if match]
+
+
+def check_query_plans():
+    """返回 {接口名: (计划, 全表扫描的表)}，非 SQLite 数据库返回 None"""
+    if db.engine.dialect.name != 'sqlite':
+        return None
+    return {
+        name: (plan, full_scans(plan))
+        for name, plan in ((name, explain(build(REPRESENTATIVE_ID))) for name, build in HOT_QUERIES.items())
+    }
+
+
+@click.command('check-schema')
+@click.option('--verbose', '-v', is_flag=True, help='输出每个查询的完整计划')
+@with_appcontext
+def check_schema_command(verbose):
+    """检查结构漂移和热点查询的全表扫描，存在问题时以非零状态退出"""
+    failed = False
+
+    problems = schema_drift()
+    if problems:
+        failed = True
+        click.echo('结构漂移（执行 flask db upgrade 补齐）：')
+        for problem in problems:
+            click.echo(f'  - {problem}')
+    else:
+        click.echo('结构：与模型一致')
+
+    plans = check_query_plans()
+    if plans is None:
+        click.echo('查询计划：仅支持 SQLite，已跳过')
+    else:
+        for name, (plan, scans) in plans.items():
+            if scans:
+                failed = True
+            status = f'全表扫描 {", ".join(scans)}' if scans else 'OK'
+            click.echo(f'{name:<32} {status}')
+            if verbose or scans:
+                for step in plan:
+                    click.echo(f'    {step}')
+
+    if failed:
+        raise SystemExit(1)
+
+
+def init_app(app):
+    """注册命令行命令"""
+    app.cli.add_command(check_schema_command)
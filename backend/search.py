@@ -0,0 +1,362 @@
+"""
+全文检索 - 基于 SQLite FTS5 的倒排索引
+
+中文没有空格分词，这里在写入索引前先做切分：
+- 连续的中日韩字符输出单字和相邻二元组（bigram），单字查询和多字查询都能命中
+- 字母数字按单词切分并转为小写
+切分结果以空格拼接后写入 FTS5（unicode61 分词器按空格再切一次），查询时做同样的切分。
+数据库不是 SQLite 或未编译 FTS5 时，调用方回退到 LIKE 查询。
+"""
+from sqlalchemy import text, Integer, Float
+from markupsafe import escape
+from models import db, File, FileContent, Question, Message
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+_CJK_RANGES = (
+    '\u3040-\u30ff'  # 日文假名
+    '\u3400-\u4dbf'  # CJK 扩展 A
+    '\u4e00-\u9fff'  # CJK 统一汉字
+    '\uac00-\ud7af'  # 韩文音节
+    '\uf900-\ufaff'  # CJK 兼容汉字
+)
+_TOKEN_RE = re.compile(f'([{_CJK_RANGES}]+)|([^\\W_{_CJK_RANGES}]+)')
+
+_fts_available = {}
+
+
+def tokenize(value):
+    """将文本切分为索引词：中日韩字符输出单字和二元组，其他按单词切分"""
+    tokens = []
+    if not value:
+        return tokens
+    for cjk, word in _TOKEN_RE.findall(value.lower()):
+        if cjk:
+            tokens.extend(cjk)
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def to_index_text(value):
+    """生成写入 FTS 索引的文本"""
+    return ' '.join(tokenize(value))
+
+
+def build_match_query(keyword):
+    """
+    将用户输入转换为 FTS5 MATCH 表达式，无有效词时返回 None
+
+    中文连续片段用二元组（单字用单字）、英文单词逐个 AND 匹配，
+    最后一个英文单词按前缀匹配，便于边输入边搜索。
+    """
+    terms = []
+    matches = _TOKEN_RE.findall((keyword or '').lower())
+    for index, (cjk, word) in enumerate(matches):
+        if cjk:
+            if len(cjk) == 1:
+                terms.append(f'"{cjk}"')
+            else:
+                terms.extend(f'"{cjk[i:i + 2]}"' for i in range(len(cjk) - 1))
+        elif index == len(matches) - 1:
+            terms.append(f'"{word}"*')
+        else:
+            terms.append(f'"{word}"')
+    return ' AND '.join(terms) if terms else None
+
+
+def fts_available():
+    """当前数据库是否支持 FTS5"""
+    engine = db.engine
+    if engine.url in _fts_available:
+        return _fts_available[engine.url]
+
+    available = False
+    if engine.dialect.name == 'sqlite':
+        try:
+            with engine.connect() as conn:
+                conn.execute(text('CREATE VIRTUAL TABLE IF NOT EXISTS temp._fts5_probe USING fts5(x)'))
+                conn.execute(text('DROP TABLE IF EXISTS temp._fts5_probe'))
+            available = True
+        except Exception as e:
+            logger.warning(f'SQLite FTS5 不可用，全文检索回退为 LIKE 查询: {e}')
+
+    _fts_available[engine.url] = available
+    return available
+
+
+# ==================== 文件索引 ====================
+
+def init_search_index():
+    """创建全文索引表，索引为空而源表不为空时自动重建"""
+    if not fts_available():
+        return
+
+    db.session.execute(text(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(filename, description)'
+    ))
+    db.session.execute(text(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS file_contents_fts USING fts5(content)'
+    ))
+    db.session.execute(text(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(title)'
+    ))
+    db.session.execute(text(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, question_id UNINDEXED)'
+    ))
+    db.session.commit()
+
+    indexed = db.session.execute(text('SELECT count(*) FROM files_fts')).scalar()
+    if not indexed and db.session.query(File.id).first() is not None:
+        rebuild_file_index()
+
+    indexed = db.session.execute(text('SELECT count(*) FROM questions_fts')).scalar()
+    if not indexed and db.session.query(Question.id).first() is not None:
+        rebuild_question_index()
+
+
+def rebuild_file_index():
+    """根据 files 表重建全文索引"""
+    if not fts_available():
+        return
+
+    db.session.execute(text('DELETE FROM files_fts'))
+    count = 0
+    last_id = 0
+    while True:
+        batch = File.query.with_entities(File.id, File.filename, File.description)\
+            .filter(File.id > last_id).order_by(File.id).limit(1000).all()
+        if not batch:
+            break
+        for file_id, filename, description in batch:
+            _insert_file_row(file_id, filename, description)
+        count += len(batch)
+        last_id = batch[-1].id
+    db.session.commit()
+    logger.info(f'文件全文索引已重建，共 {count} 条')
+
+
+def _insert_file_row(file_id, filename, description):
+    db.session.execute(
+        text('INSERT INTO files_fts (rowid, filename, description) VALUES (:id, :filename, :description)'),
+        {'id': file_id, 'filename': to_index_text(filename), 'description': to_index_text(description)}
+    )
+
+
+def index_file(file_record):
+    """写入或更新一个文件的索引（在调用方事务中执行，file_record 须已 flush 获得 id）"""
+    if not fts_available():
+        return
+
+    remove_file(file_record.id)
+    _insert_file_row(file_record.id, file_record.filename, file_record.description)
+
+
+def remove_file(file_id):
+    """从索引中删除一个文件（在调用方事务中执行）"""
+    if not fts_available():
+        return
+
+    db.session.execute(text('DELETE FROM files_fts WHERE rowid = :id'), {'id': file_id})
+
+
+def file_search_subquery(keyword):
+    """
+    返回匹配关键词的 (file_id, rank) 子查询，rank 越小越相关（bm25）
+
+    不支持 FTS5 或关键词中没有有效词时返回 None
+    """
+    match = build_match_query(keyword)
+    if match is None or not fts_available():
+        return None
+
+    return text(
+        'SELECT rowid AS file_id, bm25(files_fts, 10.0, 1.0) AS rank FROM files_fts WHERE files_fts MATCH :match'
+    ).bindparams(match=match).columns(file_id=Integer, rank=Float).subquery('file_matches')
+
+
+# ==================== 文件内容索引 ====================
+
+def index_content(content_id, content):
+    """写入或更新提取出的文件文本（rowid 为 FileContent.id，在调用方事务中执行）"""
+    if not fts_available():
+        return
+
+    db.session.execute(text('DELETE FROM file_contents_fts WHERE rowid = :id'), {'id': content_id})
+    db.session.execute(
+        text('INSERT INTO file_contents_fts (rowid, content) VALUES (:id, :content)'),
+        {'id': content_id, 'content': to_index_text(content)}
+    )
+
+
+def remove_content(content_id):
+    """从内容索引中删除（在调用方事务中执行）"""
+    if not fts_available():
+        return
+
+    db.session.execute(text('DELETE FROM file_contents_fts WHERE rowid = :id'), {'id': content_id})
+
+
+def remove_file_content(file_key):
+    """blob 被删除时清理对应的提取文本及其索引（在调用方事务中执行）"""
+    record = FileContent.query.filter_by(file_key=file_key).first()
+    if record is not None:
+        remove_content(record.id)
+        db.session.delete(record)
+
+
+def content_search_subquery(keyword):
+    """返回匹配关键词的 (content_id, rank) 子查询，不可用时返回 None"""
+    match = build_match_query(keyword)
+    if match is None or not fts_available():
+        return None
+
+    return text(
+        'SELECT rowid AS content_id, bm25(file_contents_fts) AS rank FROM file_contents_fts '
+        'WHERE file_contents_fts MATCH :match'
+    ).bindparams(match=match).columns(content_id=Integer, rank=Float).subquery('content_matches')
+
+
+# ==================== 问答索引 ====================
+#
+# questions_fts 的 rowid 为 Question.id；messages_fts 的 rowid 为 Message.id，
+# 并冗余保存 question_id，命中消息时无需回表即可得到所属对话。
+# 没有 question_id 的公告类消息不进入索引。
+
+def rebuild_question_index():
+    """根据 questions / messages 表重建问答全文索引"""
+    if not fts_available():
+        return
+
+    db.session.execute(text('DELETE FROM questions_fts'))
+    db.session.execute(text('DELETE FROM messages_fts'))
+
+    last_id = 0
+    while True:
+        batch = Question.query.with_entities(Question.id, Question.title)\
+            .filter(Question.id > last_id).order_by(Question.id).limit(1000).all()
+        if not batch:
+            break
+        for question_id, title in batch:
+            _insert_question_row(question_id, title)
+        last_id = batch[-1].id
+
+    count = 0
+    last_id = 0
+    while True:
+        batch = Message.query.with_entities(Message.id, Message.question_id, Message.content)\
+            .filter(Message.id > last_id, Message.question_id.isnot(None))\
+            .order_by(Message.id).limit(1000).all()
+        if not batch:
+            break
+        for message_id, question_id, content in batch:
+            _insert_message_row(message_id, question_id, content)
+        count += len(batch)
+        last_id = batch[-1].id
+
+    db.session.commit()
+    logger.info(f'问答全文索引已重建，共 {count} 条消息')
+
+
+def _insert_question_row(question_id, title):
+    db.session.execute(
+        text('INSERT INTO questions_fts (rowid, title) VALUES (:id, :title)'),
+        {'id': question_id, 'title': to_index_text(title)}
+    )
+
+
+def _insert_message_row(message_id, question_id, content):
+    db.session.execute(
+        text('INSERT INTO messages_fts (rowid, content, question_id) VALUES (:id, :content, :question_id)'),
+        {'id': message_id, 'content': to_index_text(content), 'question_id': question_id}
+    )
+
+
+def index_question(question):
+    """写入或更新一个问题标题的索引（在调用方事务中执行，question 须已 flush 获得 id）"""
+    if not fts_available():
+        return
+
+    db.session.execute(text('DELETE FROM questions_fts WHERE rowid = :id'), {'id': question.id})
+    _insert_question_row(question.id, question.title)
+
+
+def index_message(message):
+    """写入一条对话消息的索引（在调用方事务中执行，message 须已 flush 获得 id）"""
+    if not fts_available() or message.question_id is None:
+        return
+
+    db.session.execute(text('DELETE FROM messages_fts WHERE rowid = :id'), {'id': message.id})
+    _insert_message_row(message.id, message.question_id, message.content)
+
+
+def remove_question(question_id):
+    """删除一个问题及其全部消息的索引（在调用方事务中、删除消息之前执行）"""
+    if not fts_available():
+        return
+
+    db.session.execute(text('DELETE FROM questions_fts WHERE rowid = :id'), {'id': question_id})
+    db.session.execute(
+        text('DELETE FROM messages_fts WHERE rowid IN (SELECT id FROM messages WHERE question_id = :id)'),
+        {'id': question_id}
+    )
+
+
+def question_search_subquery(keyword):
+    """
+    返回匹配关键词的 (question_id, rank, message_id) 子查询，每个问题一行
+
+    标题命中的权重高于消息命中；rank 取该问题所有命中中最相关的一个，
+    message_id 为该命中所在的消息（标题命中时为 NULL）。不可用时返回 None。
+    """
+    match = build_match_query(keyword)
+    if match is None or not fts_available():
+        return None
+
+    # SQLite 中与 min() 同时选出的裸列取自 min 所在的行
+    return text(
+        'SELECT question_id, min(rank) AS rank, message_id FROM ('
+        '  SELECT rowid AS question_id, bm25(questions_fts) * 2.0 AS rank, NULL AS message_id'
+        '  FROM questions_fts WHERE questions_fts MATCH :match'
+        '  UNION ALL'
+        '  SELECT question_id, bm25(messages_fts) AS rank, rowid AS message_id'
+        '  FROM messages_fts WHERE messages_fts MATCH :match'
+        ') GROUP BY question_id'
+    ).bindparams(match=match).columns(
+        question_id=Integer, rank=Float, message_id=Integer
+    ).subquery('question_matches')
+
+
+def make_snippet(value, keyword, width=60):
+    """
+    截取 value 中第一个命中关键词的片段，命中部分用 <mark> 包裹（其余内容已转义）
+
+    没有命中时返回开头的一段文本
+    """
+    if not value:
+        return ''
+
+    terms = sorted({t for t in re.split(r'\s+', (keyword or '').strip()) if t}, key=len, reverse=True)
+    pattern = re.compile('|'.join(re.escape(t) for t in terms), re.IGNORECASE) if terms else None
+    first = pattern.search(value) if pattern else None
+
+    if first is None:
+        plain = value[:width * 2]
+        return str(escape(plain)) + ('…' if len(value) > len(plain) else '')
+
+    start = max(0, first.start() - width)
+    end = min(len(value), first.end() + width)
+    fragment = value[start:end]
+
+    parts = []
+    position = 0
+    for match in pattern.finditer(fragment):
+        parts.append(str(escape(fragment[position:match.start()])))
+        parts.append(f'<mark>{escape(match.group())}</mark>')
+        position = match.end()
+    parts.append(str(escape(fragment[position:])))
+
+    return ('…' if start > 0 else '') + ''.join(parts) + ('…' if end < len(value) else '')
@@ -0,0 +1,223 @@
+"""
+SQL 统计 - 每个请求的查询数、数据库耗时和重复语句
+
+- 引擎的 before/after_cursor_execute 事件为请求中的每条语句计时，按 SQL 文本（参数为占位符）归并
+- 同一请求中同一语句执行次数达到 SQL_STATS_N_PLUS_ONE 时视为 N+1，记录日志并按视图汇总
+- 调试模式（或 SQL_STATS_HEADERS）下响应附加 X-SQL-Queries / X-SQL-Time-Ms / X-SQL-N-Plus-One
+- 管理员通过 GET /api/debug/sql-stats 查看本进程的汇总，DELETE 清空
+
+流式响应在视图返回之后执行的查询不计入。汇总按进程保存，多 worker 部署时每次请求看到的是处理它的 worker 的数据。
+"""
+from flask import Blueprint, jsonify, g, request, has_request_context
+from flask_jwt_extended import jwt_required, get_current_user
+from sqlalchemy import event
+from datetime import datetime
+from models import db
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+debug_bp = Blueprint('debug', __name__, url_prefix='/api/debug')
+
+DEFAULT_N_PLUS_ONE = 5  # 同一请求中同一语句执行的次数达到该值视为 N+1
+SLOWEST_LIMIT = 20  # 保留的最慢语句条数
+STATEMENT_LENGTH = 500  # 汇总中语句文本的最大长度
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _short(statement):
+    return _WHITESPACE.sub(' ', statement).strip()[:STATEMENT_LENGTH]
+
+
+class RequestStats:
+    """一个请求中执行的语句：SQL 文本 -> [次数, 总耗时, 最长耗时]"""
+
+    __slots__ = ('count', 'time', 'statements')
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.statements = {}
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.time += elapsed
+        entry = self.statements.get(statement)
+        if entry is None:
+            self.statements[statement] = [1, elapsed, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+
+    def repeated(self, threshold):
+        """执行次数达到 threshold 的语句 [(语句, 次数)]"""
+        return [(statement, entry[0]) for statement, entry in self.statements.items() if entry[0] >= threshold]
+
+
+class Collector:
+    """本进程的汇总：按视图统计查询数和耗时，记录 N+1 语句和最慢的语句"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.since = datetime.utcnow()
+            self.endpoints = {}  # 视图 -> 统计
+            self.n_plus_one = {}  # (视图, 语句) -> 统计
+            self.slowest = []  # [(耗时, 语句, 视图)]，按耗时降序
+
+    def add(self, endpoint, stats, repeated):
+        """repeated 为该请求中判定为 N+1 的 [(语句, 次数)]"""
+        with self._lock:
+            item = self.endpoints.get(endpoint)
+            if item is None:
+                item = self.endpoints[endpoint] = {
+                    'requests': 0, 'queries': 0, 'max_queries': 0, 'time': 0.0, 'max_time': 0.0, 'n_plus_one': 0
+                }
+            item['requests'] += 1
+            item['queries'] += stats.count
+            item['max_queries'] = max(item['max_queries'], stats.count)
+            item['time'] += stats.time
+            item['max_time'] = max(item['max_time'], stats.time)
+            if repeated:
+                item['n_plus_one'] += 1
+
+            for statement, count in repeated:
+                finding = self.n_plus_one.setdefault((endpoint, statement), {'requests': 0, 'max_repeats': 0})
+                finding['requests'] += 1
+                finding['max_repeats'] = max(finding['max_repeats'], count)
+
+            fastest_kept = self.slowest[-1][0] if len(self.slowest) >= SLOWEST_LIMIT else 0.0
+            candidates = [(entry[2], statement) for statement, entry in stats.statements.items() if entry[2] > fastest_kept]
+            if candidates:
+                self.slowest.extend((elapsed, statement, endpoint) for elapsed, statement in candidates)
+                self.slowest.sort(key=lambda slow: slow[0], reverse=True)
+                del self.slowest[SLOWEST_LIMIT:]
+
+    def snapshot(self):
+        with self._lock:
+            endpoints = [
+                {
+                    'endpoint': endpoint,
+                    'requests': item['requests'],
+                    'avg_queries': round(item['queries'] / item['requests'], 2),
+                    'max_queries': item['max_queries'],
+                    'avg_time_ms': round(item['time'] * 1000 / item['requests'], 2),
+                    'max_time_ms': round(item['max_time'] * 1000, 2),
+                    'n_plus_one_requests': item['n_plus_one']
+                }
+                for endpoint, item in self.endpoints.items()
+            ]
+            n_plus_one = [
+                {'endpoint': endpoint, 'statement': _short(statement), **finding}
+                for (endpoint, statement), finding in self.n_plus_one.items()
+            ]
+            slowest = [
+                {'endpoint': endpoint, 'statement': _short(statement), 'time_ms': round(elapsed * 1000, 2)}
+                for elapsed, statement, endpoint in self.slowest
+            ]
+            since = self.since
+
+        endpoints.sort(key=lambda item: item['avg_queries'], reverse=True)
+        n_plus_one.sort(key=lambda item: item['max_repeats'], reverse=True)
+        return {
+            'pid': os.getpid(),
+            'since': since.isoformat(),
+            'endpoints': endpoints,
+            'n_plus_one': n_plus_one,
+            'slowest': slowest
+        }
+
+
+collector = Collector()
+
+_settings = {'threshold': DEFAULT_N_PLUS_ONE, 'headers': False}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context() and '_sql_stats' in g:
+        context._sql_stats_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_sql_stats_started', None)
+    if started is None:
+        return
+    stats = g.get('_sql_stats') if has_request_context() else None
+    if stats is not None:
+        stats.record(statement, time.perf_counter() - started)
+
+
+def _start_request():
+    g._sql_stats = RequestStats()
+
+
+def _finish_request(response):
+    stats = g.pop('_sql_stats', None)
+    if stats is None:
+        return response
+
+    # 未匹配路由的请求归入同一项，任意 URL 不会产生新的汇总条目
+    endpoint = request.endpoint or 'unmatched'
+    repeated = stats.repeated(_settings['threshold'])
+    collector.add(endpoint, stats, repeated)
+    for statement, count in repeated:
+        logger.warning(f'N+1 queries in {endpoint}: {count}x {_short(statement)[:200]}')
+
+    if _settings['headers']:
+        response.headers['X-SQL-Queries'] = str(stats.count)
+        response.headers['X-SQL-Time-Ms'] = f'{stats.time * 1000:.2f}'
+        response.headers['X-SQL-N-Plus-One'] = str(len(repeated))
+    return response
+
+
+def _admin_or_error():
+    user = get_current_user()
+    if not user:
+        return jsonify({'code': 404, 'message': '用户不存在'}), 404
+    if user.user_type != 'admin':
+        return jsonify({'code': 403, 'message': '只有管理员可以访问此接口'}), 403
+    return None
+
+
+@debug_bp.route('/sql-stats', methods=['GET'])
+@jwt_required()
+def get_sql_stats():
+    """本进程自启动（或上次清空）以来的 SQL 统计"""
+    error = _admin_or_error()
+    if error:
+        return error
+    return jsonify({'code': 200, 'data': {'n_plus_one_threshold': _settings['threshold'], **collector.snapshot()}}), 200
+
+
+@debug_bp.route('/sql-stats', methods=['DELETE'])
+@jwt_required()
+def reset_sql_stats():
+    """清空本进程的 SQL 统计"""
+    error = _admin_or_error()
+    if error:
+        return error
+    collector.reset()
+    return jsonify({'code': 200, 'message': '统计已清空'}), 200
+
+
+def init_app(app):
+    """在 db.init_app 之后调用：为引擎注册计时事件，为请求注册统计的开始和结束"""
+    if not app.config.get('SQL_STATS_ENABLED', True):
+        return
+    _settings['threshold'] = app.config.get('SQL_STATS_N_PLUS_ONE', DEFAULT_N_PLUS_ONE)
+    _settings['headers'] = bool(app.config.get('SQL_STATS_HEADERS') or app.debug)
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
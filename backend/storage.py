@@ -0,0 +1,361 @@
+"""
+上传文件存储 - 按内容寻址（SHA-256）去重的 blob 存储
+
+每个 blob 以其内容的 SHA-256 作为 file_key 存放在上传目录中，
+多条 File 记录可以共享同一个 blob，由 FileBlob.ref_count 记录引用次数，
+只有最后一个引用被释放时才删除物理文件。
+
+删除引用时物理文件在事务提交之后才删除（release_blob 只登记，after_commit 中删除），
+提交失败回滚时文件保持不变。
+
+下载统一经过 send_stored_file：以 file_key 作为 ETag 支持 304，支持 Range 断点续传，
+并可配置为 X-Accel-Redirect / X-Sendfile 由前置代理发送文件内容。
+"""
+from flask import current_app, request, send_file
+from sqlalchemy import event, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.utils import send_file as werkzeug_send_file
+from models import db, FileBlob
+import search
+import metrics
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
+CHUNK_SIZE = 1024 * 1024  # 流式读写的块大小：1MB
+
+# 本身已压缩的格式在 ZIP 中直接存储，避免无意义的 CPU 开销
+ZIP_STORED_TYPES = {'pdf', 'docx', 'xlsx', 'pptx', 'zip', 'rar', 'jpg', 'jpeg', 'png', 'gif'}
+
+
+class UploadTooLarge(Exception):
+    """上传内容超过大小限制"""
+
+
+def get_upload_folder():
+    """获取上传目录（可通过 UPLOAD_FOLDER 配置覆盖）"""
+    folder = current_app.config.get('UPLOAD_FOLDER') or DEFAULT_UPLOAD_FOLDER
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def get_file_path(file_key):
+    """根据 file_key 获取物理文件路径"""
+    return os.path.join(get_upload_folder(), file_key)
+
+
+def get_staging_path(upload_id):
+    """分块上传会话的暂存文件路径（与 blob 位于同一目录树，完成时可原子移动）"""
+    staging_folder = os.path.join(get_upload_folder(), '.staging')
+    os.makedirs(staging_folder, exist_ok=True)
+    return os.path.join(staging_folder, f'{upload_id}.part')
+
+
+def write_at(path, offset, stream, max_length):
+    """
+    从 offset 处写入流内容（截断 offset 之后的旧数据），返回写入的字节数
+
+    写入超过 max_length 时抛出 UploadTooLarge
+    """
+    written = 0
+    mode = 'r+b' if os.path.exists(path) else 'wb'
+    with open(path, mode) as out:
+        out.seek(offset)
+        out.truncate()
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > max_length:
+                out.truncate(offset)
+                raise UploadTooLarge()
+            out.write(chunk)
+    metrics.count_upload(written)
+    return written
+
+
+def stream_to_temp(stream, max_size):
+    """
+    将上传流写入临时文件，同时计算 SHA-256 和大小
+
+    返回 (sha256, size, temp_path)；超过 max_size 时删除临时文件并抛出 UploadTooLarge
+    """
+    temp_path = os.path.join(get_upload_folder(), f'.tmp-{uuid.uuid4().hex}')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        discard_temp(temp_path)
+        raise
+    metrics.count_upload(size)
+    return digest.hexdigest(), size, temp_path
+
+
+def hash_file(path):
+    """计算已有文件的 SHA-256 和大小"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            digest.update(chunk)
+    return digest.hexdigest(), size
+
+
+def link_to_temp(path):
+    """
+    为已有文件创建一个临时路径（硬链接，文件系统不支持时复制），返回临时路径
+
+    临时路径交给 acquire_blob 移动或删除，原文件保留
+    """
+    temp_path = os.path.join(get_upload_folder(), f'.tmp-{uuid.uuid4().hex}')
+    try:
+        os.link(path, temp_path)
+    except OSError:
+        shutil.copyfile(path, temp_path)
+    return temp_path
+
+
+def discard_temp(temp_path):
+    """删除临时文件（忽略不存在的情况）"""
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+
+
+def acquire_blob(file_key, file_size, temp_path):
+    """
+    为内容 file_key 增加一个引用，并把临时文件落盘为 blob
+
+    必须在调用方的数据库事务中执行，由调用方提交。
+    已存在相同内容的 blob 时直接丢弃临时文件，不产生任何写盘。
+    返回 True 表示新建了 blob 文件（提交失败时调用方应调用 remove_blob_file 清理）。
+    """
+    # 先更新数据库以获得写锁，避免与并发的 release_blob 交错
+    updated = FileBlob.query.filter_by(file_key=file_key).update(
+        {FileBlob.ref_count: FileBlob.ref_count + 1},
+        synchronize_session=False
+    )
+    blob_path = get_file_path(file_key)
+
+    if not updated:
+        try:
+            with db.session.begin_nested():
+                db.session.add(FileBlob(file_key=file_key, file_size=file_size, ref_count=1))
+        except IntegrityError:
+            # 并发上传了相同内容，改为增加引用
+            FileBlob.query.filter_by(file_key=file_key).update(
+                {FileBlob.ref_count: FileBlob.ref_count + 1},
+                synchronize_session=False
+            )
+        else:
+            os.replace(temp_path, blob_path)
+            logger.info(f'Blob created: {file_key} ({file_size} bytes)')
+            return True
+
+    # 内容已存在：丢弃临时文件；若物理文件意外丢失则用本次上传补齐
+    if os.path.exists(blob_path):
+        discard_temp(temp_path)
+    else:
+        logger.warning(f'Blob file missing on disk, restoring: {file_key}')
+        os.replace(temp_path, blob_path)
+    logger.info(f'Blob deduplicated: {file_key}')
+    return False
+
+
+def release_blob(file_key):
+    """
+    释放一个对 file_key 的引用，最后一个引用释放时删除 blob 记录，物理文件在事务提交后删除
+
+    必须在调用方的数据库事务中执行，由调用方提交；回滚时物理文件保留。
+    没有 FileBlob 记录的旧文件（uuid 命名）同样在提交后删除物理文件。
+    返回 True 表示物理文件将在提交后被删除。
+    """
+    updated = FileBlob.query.filter_by(file_key=file_key).update(
+        {FileBlob.ref_count: FileBlob.ref_count - 1},
+        synchronize_session=False
+    )
+
+    if updated:
+        ref_count = db.session.query(FileBlob.ref_count).filter_by(file_key=file_key).scalar()
+        if ref_count > 0:
+            return False
+        FileBlob.query.filter_by(file_key=file_key).delete(synchronize_session=False)
+        search.remove_file_content(file_key)
+
+    db.session.info.setdefault('_released_blobs', set()).add(file_key)
+    return True
+
+
+@event.listens_for(Session, 'after_commit')
+def _remove_released_blobs(session):
+    file_keys = session.info.pop('_released_blobs', None)
+    if not file_keys:
+        return
+    # 提交后相同内容的并发上传可能已由 acquire_blob 重新创建 blob 记录并放回物理文件（尚未提交）。
+    # 检查和删除在写事务（BEGIN IMMEDIATE）中进行：acquire_blob 从更新记录到提交一直持有写锁，
+    # 两者互斥——未提交的上传先提交，这里随后能看到其记录并保留文件
+    try:
+        with db.engine.connect() as conn:
+            if conn.dialect.name == 'sqlite':
+                conn.exec_driver_sql('BEGIN IMMEDIATE')
+            recreated = set(conn.execute(
+                select(FileBlob.file_key).where(FileBlob.file_key.in_(file_keys))
+            ).scalars())
+            for file_key in file_keys - recreated:
+                try:
+                    remove_blob_file(file_key)
+                except OSError as e:
+                    logger.error(f'Blob file removal failed: {file_key}: {str(e)}')
+            conn.commit()
+    except Exception as e:
+        logger.error(f'Blob cleanup failed, keeping files: {str(e)}', exc_info=True)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _keep_released_blobs(session):
+    session.info.pop('_released_blobs', None)
+
+
+def remove_blob_file(file_key):
+    """删除物理文件"""
+    file_path = get_file_path(file_key)
+    if os.path.exists(file_path):
+        os.remove(file_path)
+        logger.info(f'Blob file removed: {file_key}')
+
+
+def send_stored_file(file_key, download_name):
+    """
+    发送已存储的文件，物理文件不存在时返回 None
+
+    - file_key 对应的内容不可变，直接用作 ETag，If-None-Match 命中时返回 304
+    - 支持 Range 请求，返回 206 部分内容
+    - DOWNLOAD_OFFLOAD 配置为 'x-accel-redirect'（nginx）或 'x-sendfile'（Apache/lighttpd）时，
+      只返回响应头，由前置代理发送文件内容（Range 也由代理处理）
+    """
+    file_path = get_file_path(file_key)
+
+    if not os.path.exists(file_path):
+        return None
+
+    offload = current_app.config.get('DOWNLOAD_OFFLOAD')
+
+    try:
+        if offload in ('x-accel-redirect', 'x-sendfile'):
+            response = werkzeug_send_file(
+                file_path,
+                request.environ,
+                as_attachment=True,
+                download_name=download_name,
+                etag=file_key,
+                conditional=False,
+                use_x_sendfile=True,
+                response_class=current_app.response_class
+            )
+            response = response.make_conditional(request.environ)
+
+            if offload == 'x-accel-redirect':
+                response.headers.pop('X-Sendfile', None)
+                if response.status_code != 304:
+                    prefix = current_app.config.get('DOWNLOAD_ACCEL_PREFIX', '/protected-uploads/')
+                    response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + file_key
+                    # 内容由 nginx 发送，长度也由 nginx 决定
+                    response.headers.pop('Content-Length', None)
+            elif response.status_code == 304:
+                response.headers.pop('X-Sendfile', None)
+        else:
+            response = send_file(
+                file_path,
+                as_attachment=True,
+                download_name=download_name,
+                etag=file_key,
+                conditional=True
+            )
+    except RequestedRangeNotSatisfiable as e:
+        return e.get_response()
+
+    # 允许浏览器缓存，但每次都携带 If-None-Match 回源校验权限
+    response.cache_control.private = True
+    if response.status_code in (200, 206):
+        # 由代理发送时响应中没有长度，按整个文件计
+        metrics.count_download(response.content_length or os.path.getsize(file_path))
+    return response
+
+
+class _ZipStreamBuffer:
+    """只写、不可 seek 的缓冲区，zipfile 写入后由生成器取走已产生的字节"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries):
+    """
+    以生成器方式流式生成 ZIP，内存占用与文件数量和大小无关
+
+    entries 为 (压缩包内路径, 物理文件路径, 文件类型) 的列表。
+    输出流不可 seek，zipfile 会为每个条目写入数据描述符，并在需要时自动启用 ZIP64。
+    """
+    for data in _zip_chunks(entries):
+        if data:
+            metrics.count_download(len(data), 'zip')
+            yield data
+
+
+def _zip_chunks(entries):
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as archive:
+        for arcname, file_path, file_type in entries:
+            zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+            if file_type in ZIP_STORED_TYPES:
+                zinfo.compress_type = zipfile.ZIP_STORED
+            else:
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+
+            with open(file_path, 'rb') as src, archive.open(zinfo, 'w') as dst:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            yield buffer.drain()
+    yield buffer.drain()
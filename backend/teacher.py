@@ -1,7 +1,18 @@
-from flask import Blueprint, request, jsonify, send_file
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, User, TeacherStudent, File
-from datetime import datetime
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_current_user
+from sqlalchemy.orm import aliased, contains_eager
+from models import db, User, TeacherStudent, File, InboxState, TeacherRatingStats, TeacherReview
+from storage import send_stored_file, release_blob, get_file_path, stream_zip
+from pagination import paginate, get_per_page, InvalidCursor
+from inbox import (deliver_to_users, deliver_to_teacher_students, count_broadcast_audience, create_broadcast,
+                   sync_broadcasts, unread_count_for, mark_read, mark_read_bulk, inbox_query, inbox_item,
+                   INBOX_ORDER_KEYS)
+import events
+from ratings import record_review, get_stats, latest_reviews
+from response_cache import cached, invalidate
+from datetime import datetime, timezone
+import search
+import json
 import logging
 import os
 
@@ -11,6 +22,33 @@ logger = logging.getLogger(__name__)
 
 teacher_bp = Blueprint('teacher', __name__, url_prefix='/api/teacher')
 
+# 列表接口的排序：最新的在前
+STUDENT_ORDER_KEYS = [(TeacherStudent.created_at, 'desc'), (TeacherStudent.id, 'desc')]
+DOCUMENT_ORDER_KEYS = [(File.created_at, 'desc'), (File.id, 'desc')]
+REVIEW_ORDER_KEYS = [(TeacherReview.created_at, 'desc'), (TeacherReview.id, 'desc')]
+
+
+def _students_query(teacher_id):
+    """教师管理的学生关系"""
+    return TeacherStudent.query.filter_by(teacher_id=teacher_id)
+
+
+def _my_teachers_query(student_id):
+    """学生的教师（id、用户名、姓名）及该学生对其评价的 id（未评价为 None），按建立关系的顺序"""
+    return db.session.query(User.id, User.username, User.real_name, TeacherReview.id)\
+        .select_from(TeacherStudent)\
+        .join(User, User.id == TeacherStudent.teacher_id)\
+        .outerjoin(TeacherReview, (TeacherReview.teacher_id == TeacherStudent.teacher_id)
+                   & (TeacherReview.student_id == student_id))\
+        .filter(TeacherStudent.student_id == student_id)\
+        .order_by(TeacherStudent.id)
+
+
+def _reviews_query(teacher_id):
+    """教师收到的评价"""
+    return TeacherReview.query.filter_by(teacher_id=teacher_id)
+
+
 @teacher_bp.route('/students', methods=['GET'])
 @jwt_required()
 def get_students():
@@ -19,7 +57,7 @@ def get_students():
         teacher_id = int(get_jwt_identity())
         logger.info(f'教师 {teacher_id} 查询学生列表')
         
-        teacher = User.query.get(teacher_id)
+        teacher = get_current_user()
         
         if not teacher:
             logger.warning(f'教师 {teacher_id} 不存在')
@@ -30,13 +68,13 @@ def get_students():
             return jsonify({'code': 403, 'message': '只有教师和管理员可以查看学生列表'}), 403
         
         page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
+        per_page = get_per_page()
         keyword = request.args.get('keyword', '', type=str)
         
         logger.info(f'查询参数 - 页码: {page}, 每页数: {per_page}, 关键词: {keyword}')
         
         # 查询学生关系
-        query = TeacherStudent.query.filter_by(teacher_id=teacher_id)
+        query = _students_query(teacher_id)
         logger.info(f'初始查询：教师 {teacher_id} 管理的所有学生')
         
         # 关键词搜索
@@ -49,12 +87,12 @@ def get_students():
                 (User.student_id.ilike(f'%{keyword}%'))
             )
         
-        paginated = query.order_by(TeacherStudent.created_at.desc()).paginate(page=page, per_page=per_page)
+        result = paginate(query, STUDENT_ORDER_KEYS)
         
-        logger.info(f'查询结果 - 总数: {paginated.total}, 返回: {len(paginated.items)}, 总页数: {paginated.pages}')
+        logger.info(f'查询结果 - 总数: {result.total}, 返回: {len(result.items)}, 总页数: {result.pages}')
         
-        if paginated.items:
-            student_ids = [ts.student_id for ts in paginated.items]
+        if result.items:
+            student_ids = [ts.student_id for ts in result.items]
             logger.info(f'返回学生ID列表: {student_ids}')
         else:
             logger.info('没有找到匹配的学生')
@@ -63,13 +101,13 @@ def get_students():
             'code': 200,
             'message': '获取成功',
             'data': {
-                'students': [ts.to_dict() for ts in paginated.items],
-                'total': paginated.total,
-                'pages': paginated.pages,
-                'current_page': page
+                'students': [ts.to_dict() for ts in result.items],
+                **result.meta()
             }
         }), 200
     
+    except InvalidCursor as e:
+        return jsonify({'code': 400, 'message': str(e)}), 400
     except Exception as e:
         logger.error(f'Get students error: {str(e)}', exc_info=True)
         return jsonify({'code': 500, 'message': f'获取失败: {str(e)}'}), 500
@@ -83,7 +121,7 @@ def add_student():
         teacher_id = int(get_jwt_identity())
         logger.info(f'教师 {teacher_id} 尝试添加学生')
         
-        teacher = User.query.get(teacher_id)
+        teacher = get_current_user()
         
         if not teacher:
             logger.warning(f'教师 {teacher_id} 不存在')
@@ -139,6 +177,7 @@ def add_student():
         # 创建关系
         ts = TeacherStudent(teacher_id=teacher_id, student_id=student_id)
         db.session.add(ts)
+        invalidate('teacher_students')
         db.session.commit()
         
         logger.info(f'学生 {student_id} 成功添加到教师 {teacher_id} 的管理列表中，关系ID: {ts.id}')
@@ -161,7 +200,7 @@ def remove_student(student_id):
     """删除学生从教师的管理列表"""
     try:
         teacher_id = int(get_jwt_identity())
-        teacher = User.query.get(teacher_id)
+        teacher = get_current_user()
         
         if not teacher:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
@@ -179,6 +218,7 @@ def remove_student(student_id):
             return jsonify({'code': 404, 'message': '该学生不在您的管理列表中'}), 404
         
         db.session.delete(ts)
+        invalidate('teacher_students')
         db.session.commit()
         
         logger.info(f'Student {student_id} removed from teacher {teacher_id}')
@@ -196,13 +236,14 @@ def remove_student(student_id):
 
 @teacher_bp.route('/available-students', methods=['GET'])
 @jwt_required()
+@cached(tags=['teacher_students', 'users'])
 def get_available_students():
     """获取可以添加的学生列表（未被该教师管理的）"""
     try:
         teacher_id = int(get_jwt_identity())
         logger.info(f'教师 {teacher_id} 查询可用学生列表')
         
-        teacher = User.query.get(teacher_id)
+        teacher = get_current_user()
         
         if not teacher:
             logger.warning(f'教师 {teacher_id} 不存在')
@@ -213,36 +254,17 @@ def get_available_students():
             return jsonify({'code': 403, 'message': '只有教师和管理员可以查看可用学生'}), 403
         
         page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
+        per_page = get_per_page()
         keyword = request.args.get('keyword', '', type=str)
         
         logger.info(f'查询参数 - 页码: {page}, 每页数: {per_page}, 关键词: {keyword}')
         
-        # 获取已管理的学生ID列表
-        managed_ids = db.session.query(TeacherStudent.student_id).filter_by(
-            teacher_id=teacher_id
-        ).all()
-        managed_ids = [m[0] for m in managed_ids]
-        logger.info(f'教师 {teacher_id} 已管理的学生ID: {managed_ids}')
-        
-        # 查询所有学生数量
-        all_students_count = User.query.filter(User.user_type == 'student').count()
-        logger.info(f'系统中学生总数: {all_students_count}')
-        
-        # 查询未被管理的学生
-        if managed_ids:
-            query = User.query.filter(
-                (User.user_type == 'student') &
-                (~User.id.in_(managed_ids))
-            )
-            logger.info(f'排除已管理的学生后，执行查询')
-        else:
-            query = User.query.filter(User.user_type == 'student')
-            logger.info(f'教师未管理任何学生，查询所有学生')
-        
-        # 统计未管理的学生数
-        unmanaged_count = query.count()
-        logger.info(f'未被该教师管理的学生总数: {unmanaged_count}')
+        # 查询未被该教师管理的学生（子查询排除，不把已管理的ID列表取回应用层）
+        managed = db.session.query(TeacherStudent.student_id).filter_by(teacher_id=teacher_id)
+        query = User.query.filter(
+            (User.user_type == 'student') &
+            (~User.id.in_(managed))
+        )
         
         # 关键词搜索
         if keyword:
@@ -252,15 +274,13 @@ def get_available_students():
                 (User.real_name.ilike(f'%{keyword}%')) |
                 (User.student_id.ilike(f'%{keyword}%'))
             )
-            keyword_count = query.count()
-            logger.info(f'关键词搜索结果数: {keyword_count}')
         
-        paginated = query.order_by(User.created_at.desc()).paginate(page=page, per_page=per_page)
+        result = paginate(query, [(User.created_at, 'desc'), (User.id, 'desc')])
         
-        logger.info(f'分页结果 - 总数: {paginated.total}, 返回: {len(paginated.items)}, 总页数: {paginated.pages}')
+        logger.info(f'分页结果 - 总数: {result.total}, 返回: {len(result.items)}, 总页数: {result.pages}')
         
-        if paginated.items:
-            student_usernames = [s.username for s in paginated.items]
+        if result.items:
+            student_usernames = [s.username for s in result.items]
             logger.info(f'返回的学生用户名: {student_usernames}')
         else:
             logger.info('没有找到匹配的学生')
@@ -269,13 +289,13 @@ def get_available_students():
             'code': 200,
             'message': '获取成功',
             'data': {
-                'students': [s.to_dict() for s in paginated.items],
-                'total': paginated.total,
-                'pages': paginated.pages,
-                'current_page': page
+                'students': [s.to_dict() for s in result.items],
+                **result.meta()
             }
         }), 200
     
+    except InvalidCursor as e:
+        return jsonify({'code': 400, 'message': str(e)}), 400
     except Exception as e:
         logger.error(f'Get available students error: {str(e)}', exc_info=True)
         return jsonify({'code': 500, 'message': f'获取失败: {str(e)}'}), 500
@@ -287,7 +307,7 @@ def get_student_info(student_id):
     """获取教师管理的特定学生详细信息"""
     try:
         teacher_id = int(get_jwt_identity())
-        teacher = User.query.get(teacher_id)
+        teacher = get_current_user()
         
         if not teacher:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
@@ -325,7 +345,7 @@ def admin_get_users():
     """管理员获取所有用户列表"""
     try:
         admin_id = int(get_jwt_identity())
-        admin = User.query.get(admin_id)
+        admin = get_current_user()
         
         if not admin:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
@@ -334,7 +354,7 @@ def admin_get_users():
             return jsonify({'code': 403, 'message': '只有管理员可以访问此接口'}), 403
         
         page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
+        per_page = get_per_page()
         keyword = request.args.get('keyword', '', type=str)
         user_type = request.args.get('user_type', '', type=str)
         
@@ -354,90 +374,187 @@ def admin_get_users():
                 (User.student_id.ilike(f'%{keyword}%'))
             )
         
-        paginated = query.order_by(User.created_at.desc()).paginate(page=page, per_page=per_page)
+        result = paginate(query, [(User.created_at, 'desc'), (User.id, 'desc')])
         
         return jsonify({
             'code': 200,
             'message': '获取成功',
             'data': {
-                'users': [u.to_dict() for u in paginated.items],
-                'total': paginated.total,
-                'pages': paginated.pages,
-                'current_page': page
+                'users': [u.to_dict() for u in result.items],
+                **result.meta()
             }
         }), 200
     
+    except InvalidCursor as e:
+        return jsonify({'code': 400, 'message': str(e)}), 400
     except Exception as e:
         logger.error(f'Admin get users error: {str(e)}', exc_info=True)
         return jsonify({'code': 500, 'message': f'获取失败: {str(e)}'}), 500
 
 
+def _managed_student_item(student, linked_at):
+    return {
+        'id': student.id,
+        'username': student.username,
+        'real_name': student.real_name,
+        'student_id': student.student_id,
+        'email': student.email,
+        'phone': student.phone,
+        'college': student.college,
+        'major': student.major,
+        'created_at': linked_at.isoformat() if linked_at else None
+    }
+
+
+def _managed_student_filters(args, student=User):
+    """按学生的学院 / 专业筛选（参数为空时不筛选），student 为学生对应的实体或别名"""
+    filters = []
+    college = args.get('college', '', type=str).strip()
+    major = args.get('major', '', type=str).strip()
+    if college:
+        filters.append(student.college == college)
+    if major:
+        filters.append(student.major == major)
+    return filters
+
+
 @teacher_bp.route('/admin/teacher-students', methods=['GET'])
 @jwt_required()
+@cached(tags=['teacher_students', 'users'])
 def admin_get_teacher_students():
-    """管理员获取所有教师及其管理的学生"""
+    """
+    管理员获取教师及其管理的学生（按教师分页）
+
+    college / major 按学生筛选，此时只返回有符合条件学生的教师。
+    一页教师一次查询，这些教师的学生一次连接查询取出。
+    """
     try:
         admin_id = int(get_jwt_identity())
-        admin = User.query.get(admin_id)
-        
+        admin = get_current_user()
+
         if not admin:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
-        
+
         if admin.user_type != 'admin':
             return jsonify({'code': 403, 'message': '只有管理员可以访问此接口'}), 403
-        
+
         logger.info(f'管理员 {admin_id} 查询教师及其学生关系')
-        
-        # 获取所有教师
-        teachers = User.query.filter_by(user_type='teacher').all()
-        
-        result = []
-        for teacher in teachers:
-            # 获取该教师管理的学生
-            teacher_students = TeacherStudent.query.filter_by(teacher_id=teacher.id).all()
-            
-            result.append({
+
+        filters = _managed_student_filters(request.args)
+        query = User.query.filter_by(user_type='teacher')
+        if filters:
+            student = aliased(User)
+            query = query.filter(
+                db.session.query(TeacherStudent.id)
+                .join(student, student.id == TeacherStudent.student_id)
+                .filter(TeacherStudent.teacher_id == User.id,
+                        *_managed_student_filters(request.args, student))
+                .exists()
+            )
+        result = paginate(query, [(User.id, 'asc')])
+
+        teacher_ids = [teacher.id for teacher in result.items]
+        students = {teacher_id: [] for teacher_id in teacher_ids}
+        if teacher_ids:
+            rows = db.session.query(TeacherStudent.teacher_id, TeacherStudent.created_at, User)\
+                .join(User, User.id == TeacherStudent.student_id)\
+                .filter(TeacherStudent.teacher_id.in_(teacher_ids), *filters)\
+                .order_by(TeacherStudent.teacher_id, TeacherStudent.id).all()
+            for teacher_id, linked_at, student in rows:
+                students[teacher_id].append(_managed_student_item(student, linked_at))
+
+        teachers = [
+            {
                 'teacher': teacher.to_dict(),
-                'students': [
-                    {
-                        'id': ts.student_id,
-                        'username': ts.student.username,
-                        'real_name': ts.student.real_name,
-                        'student_id': ts.student.student_id,
-                        'email': ts.student.email,
-                        'phone': ts.student.phone,
-                        'college': ts.student.college,
-                        'major': ts.student.major,
-                        'created_at': ts.created_at.isoformat() if ts.created_at else None
-                    }
-                    for ts in teacher_students
-                ],
-                'student_count': len(teacher_students)
-            })
-        
-        logger.info(f'返回 {len(result)} 个教师的信息')
-        
+                'students': students[teacher.id],
+                'student_count': len(students[teacher.id])
+            }
+            for teacher in result.items
+        ]
+
         return jsonify({
             'code': 200,
             'message': '获取成功',
             'data': {
-                'teachers': result,
-                'total': len(result)
+                'teachers': teachers,
+                **result.meta()
             }
         }), 200
-    
+
+    except InvalidCursor as e:
+        return jsonify({'code': 400, 'message': str(e)}), 400
     except Exception as e:
         logger.error(f'Admin get teacher students error: {str(e)}', exc_info=True)
         return jsonify({'code': 500, 'message': f'获取失败: {str(e)}'}), 500
 
 
+@teacher_bp.route('/admin/teacher-students/export', methods=['GET'])
+@jwt_required()
+def admin_export_teacher_students():
+    """
+    管理员导出全部教师及其学生（JSON 流式输出，格式与列表接口相同，不分页）
+
+    一次按教师排序的外连接查询分批读取，边读边发送，内存占用与教师数量无关。
+    """
+    try:
+        admin_id = int(get_jwt_identity())
+        admin = get_current_user()
+
+        if not admin:
+            return jsonify({'code': 404, 'message': '用户不存在'}), 404
+
+        if admin.user_type != 'admin':
+            return jsonify({'code': 403, 'message': '只有管理员可以访问此接口'}), 403
+
+        # 不筛选时外连接，保留没有学生的教师；按学院 / 专业筛选时只导出有符合条件学生的教师
+        student = aliased(User)
+        filters = _managed_student_filters(request.args, student)
+        query = db.session.query(User, TeacherStudent.created_at, student)\
+            .filter(User.user_type == 'teacher')\
+            .join(TeacherStudent, TeacherStudent.teacher_id == User.id, isouter=not filters)\
+            .join(student, student.id == TeacherStudent.student_id, isouter=not filters)\
+            .filter(*filters)\
+            .order_by(User.id, TeacherStudent.id)
+
+        logger.info(f'管理员 {admin_id} 导出教师及其学生关系')
+
+        def generate():
+            yield '{"code": 200, "message": "获取成功", "data": {"teachers": ['
+            total = 0
+            current = None
+            for teacher, linked_at, managed in query.yield_per(500):
+                if current is None or current['teacher']['id'] != teacher.id:
+                    if current is not None:
+                        yield (',' if total else '') + json.dumps(current, ensure_ascii=False)
+                        total += 1
+                    current = {'teacher': teacher.to_dict(), 'students': [], 'student_count': 0}
+                if managed is not None:
+                    current['students'].append(_managed_student_item(managed, linked_at))
+                    current['student_count'] += 1
+            if current is not None:
+                yield (',' if total else '') + json.dumps(current, ensure_ascii=False)
+                total += 1
+            yield f'], "total": {total}}}}}'
+
+        download_name = f'teacher_students_{datetime.now().strftime("%Y%m%d%H%M%S")}.json'
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/json',
+            headers={'Content-Disposition': f'attachment; filename={download_name}'}
+        )
+
+    except Exception as e:
+        logger.error(f'Admin export teacher students error: {str(e)}', exc_info=True)
+        return jsonify({'code': 500, 'message': f'导出失败: {str(e)}'}), 500
+
+
 @teacher_bp.route('/admin/users', methods=['POST'])
 @jwt_required()
 def admin_create_user():
     """管理员创建用户"""
     try:
         admin_id = int(get_jwt_identity())
-        admin = User.query.get(admin_id)
+        admin = get_current_user()
         if not admin:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
         if admin.user_type != 'admin':
@@ -491,7 +608,7 @@ def admin_update_user(user_id):
     """管理员更新用户"""
     try:
         admin_id = int(get_jwt_identity())
-        admin = User.query.get(admin_id)
+        admin = get_current_user()
         if not admin:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
         if admin.user_type != 'admin':
@@ -537,7 +654,7 @@ def admin_delete_user(user_id):
     """管理员删除用户（并清理关联关系）"""
     try:
         admin_id = int(get_jwt_identity())
-        admin = User.query.get(admin_id)
+        admin = get_current_user()
         if not admin:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
         if admin.user_type != 'admin':
@@ -553,6 +670,16 @@ def admin_delete_user(user_id):
         # 删除教师-学生关系中与该用户相关的记录
         TeacherStudent.query.filter((TeacherStudent.teacher_id == user_id) | (TeacherStudent.student_id == user_id)).delete(synchronize_session=False)
 
+        # 删除该用户的文件记录，共享内容只在最后一个引用释放时删除
+        for file_record in File.query.filter_by(user_id=user_id).all():
+            db.session.delete(file_record)
+            release_blob(file_record.file_key)
+            search.remove_file(file_record.id)
+
+        InboxState.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+        TeacherRatingStats.query.filter_by(teacher_id=user_id).delete(synchronize_session=False)
+        invalidate('teacher_students', 'reviews')
+
         db.session.delete(user)
         db.session.commit()
 
@@ -568,48 +695,54 @@ def admin_delete_user(user_id):
 
 
 # ==================== 学生文档管理接口 ====================
+def _student_documents_query(teacher_id, args):
+    """
+    按 student_id、document_type、submission_stage 筛选教师管理的学生上交的文档
+
+    文档与 teacher_students、users 连接（(teacher_id, student_id) 唯一，不会产生重复行），
+    不先取出学生 id 列表；查询已连接 User，可直接选取学生的列。
+    """
+    student_id = args.get('student_id', type=int)
+    document_type = args.get('document_type')
+    submission_stage = args.get('submission_stage')
+
+    query = File.query\
+        .join(TeacherStudent, (TeacherStudent.student_id == File.user_id) & (TeacherStudent.teacher_id == teacher_id))\
+        .join(User, User.id == File.user_id)
+    
+    if student_id:
+        query = query.filter(File.user_id == student_id)
+    
+    if document_type:
+        query = query.filter(File.document_type == document_type)
+    
+    if submission_stage:
+        query = query.filter(File.submission_stage == submission_stage)
+    
+    # 排除纯文件管理的文件，只返回有文档类型的毕业设计文档
+    query = query.filter(File.document_type.isnot(None))
+    return query
+
+
 @teacher_bp.route('/student-documents', methods=['GET'])
 @jwt_required()
 def get_student_documents():
     """获取教师管理的学生所有上交的文档"""
     try:
-        from models import File
         teacher_id = int(get_jwt_identity())
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
-        student_id = request.args.get('student_id', type=int)
-        document_type = request.args.get('document_type')
-        submission_stage = request.args.get('submission_stage')
-
-        # 获取教师管理的学生
-        managed_students = db.session.query(TeacherStudent).filter_by(teacher_id=teacher_id).all()
-        managed_student_ids = [ts.student_id for ts in managed_students]
 
-        # 构建查询
-        query = File.query.filter(File.user_id.in_(managed_student_ids))
-        
-        if student_id and student_id in managed_student_ids:
-            query = query.filter_by(user_id=student_id)
-        
-        if document_type:
-            query = query.filter_by(document_type=document_type)
-        
-        if submission_stage:
-            query = query.filter_by(submission_stage=submission_stage)
-        
-        # 排除纯文件管理的文件，只返回有文档类型的毕业设计文档
-        query = query.filter(File.document_type.isnot(None))
-        query = query.order_by(File.created_at.desc())
-        
-        paginated = query.paginate(page=page, per_page=per_page)
+        # 学生信息来自同一连接查询（只加载用户名和姓名），不再逐个查询 users
+        query = _student_documents_query(teacher_id, request.args)\
+            .options(contains_eager(File.owner).load_only(User.username, User.real_name))
+        result = paginate(query, DOCUMENT_ORDER_KEYS)
         
         items = [
             {
                 **f.to_dict(),
-                'student_username': User.query.get(f.user_id).username if f.user_id else None,
-                'student_real_name': User.query.get(f.user_id).real_name if f.user_id else None,
+                'student_username': f.owner.username if f.owner else None,
+                'student_real_name': f.owner.real_name if f.owner else None,
             }
-            for f in paginated.items
+            for f in result.items
         ]
         
         return jsonify({
@@ -617,24 +750,63 @@ def get_student_documents():
             'message': '获取成功',
             'data': {
                 'documents': items,
-                'total': paginated.total,
-                'pages': paginated.pages,
-                'current_page': page
+                **result.meta()
             }
         }), 200
 
+    except InvalidCursor as e:
+        return jsonify({'code': 400, 'message': str(e)}), 400
     except Exception as e:
         logger.error(f'Get student documents error: {str(e)}', exc_info=True)
         return jsonify({'code': 500, 'message': f'获取失败: {str(e)}'}), 500
 
 
+@teacher_bp.route('/student-documents/export', methods=['GET'])
+@jwt_required()
+def export_student_documents():
+    """将筛选出的学生文档打包为 ZIP 流式下载（边读边发送，不生成临时文件）"""
+    try:
+        teacher_id = int(get_jwt_identity())
+        teacher = get_current_user()
+        
+        if not teacher or teacher.user_type not in ('teacher', 'admin'):
+            return jsonify({'code': 403, 'message': '只有教师或管理员可以导出文档'}), 403
+
+        rows = _student_documents_query(teacher_id, request.args)\
+            .with_entities(File.id, File.filename, File.file_key, File.file_type, User.username)\
+            .order_by(File.created_at.desc()).all()
+
+        entries = []
+        for doc_id, filename, file_key, file_type, username in rows:
+            file_path = get_file_path(file_key)
+            if not os.path.exists(file_path):
+                logger.warning(f'导出时文档 {doc_id} 的文件不存在: {file_key}')
+                continue
+            entries.append((f'{username}/{doc_id}_{filename}', file_path, file_type))
+
+        if not entries:
+            return jsonify({'code': 404, 'message': '没有可导出的文档'}), 404
+
+        logger.info(f'教师 {teacher_id} 导出了 {len(entries)} 个文档')
+        download_name = f'student_documents_{datetime.now().strftime("%Y%m%d%H%M%S")}.zip'
+        return Response(
+            stream_zip(entries),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename={download_name}'}
+        )
+
+    except Exception as e:
+        logger.error(f'Export student documents error: {str(e)}', exc_info=True)
+        return jsonify({'code': 500, 'message': f'导出失败: {str(e)}'}), 500
+
+
 @teacher_bp.route('/student-documents/<int:doc_id>/feedback', methods=['PUT'])
 @jwt_required()
 def add_document_feedback(doc_id):
     """添加文档评价"""
     try:
         teacher_id = int(get_jwt_identity())
-        teacher = User.query.get(teacher_id)
+        teacher = get_current_user()
         
         if teacher.user_type not in ('teacher', 'admin'):
             return jsonify({'code': 403, 'message': '只有教师或管理员可以评价文档'}), 403
@@ -675,7 +847,7 @@ def remind_student_submission(doc_id):
     """催交文档"""
     try:
         teacher_id = int(get_jwt_identity())
-        teacher = User.query.get(teacher_id)
+        teacher = get_current_user()
         
         if teacher.user_type not in ('teacher', 'admin'):
             return jsonify({'code': 403, 'message': '只有教师或管理员可以催交'}), 403
@@ -717,7 +889,7 @@ def download_student_document(doc_id):
     """下载学生文档"""
     try:
         teacher_id = int(get_jwt_identity())
-        teacher = User.query.get(teacher_id)
+        teacher = get_current_user()
         
         if teacher.user_type not in ('teacher', 'admin'):
             return jsonify({'code': 403, 'message': '只有教师或管理员可以下载文档'}), 403
@@ -732,19 +904,13 @@ def download_student_document(doc_id):
             if not managed:
                 return jsonify({'code': 403, 'message': '您无权下载此文档'}), 403
 
-        # 获取上传文件夹路径
-        UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
-        file_path = os.path.join(UPLOAD_FOLDER, doc.file_key)
+        response = send_stored_file(doc.file_key, doc.filename)
         
-        if not os.path.exists(file_path):
+        if response is None:
             return jsonify({'code': 404, 'message': '文件不存在'}), 404
 
         logger.info(f'教师 {teacher_id} 下载了文档 {doc_id}')
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=doc.filename
-        )
+        return response
 
     except Exception as e:
         logger.error(f'Download student document error: {str(e)}', exc_info=True)
@@ -757,7 +923,7 @@ def send_message():
     """发送消息：管理员可发全体公告或指定用户；教师可群发给自己管理的学生或指定学生列表"""
     try:
         sender_id = int(get_jwt_identity())
-        sender = User.query.get(sender_id)
+        sender = get_current_user()
         if not sender:
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
 
@@ -770,66 +936,59 @@ def send_message():
         if not content:
             return jsonify({'code': 400, 'message': '消息内容不能为空'}), 400
 
-        # 构造接收者列表
-        recipient_ids = set()
-
         if sender.user_type == 'admin':
             if target == 'all':
-                # 管理员发送，支持按用户类型筛选
-                if recipient_type == 'teacher':
-                    # 只发给教师
-                    users = User.query.filter(User.is_active == True, User.user_type == 'teacher').all()
-                elif recipient_type == 'student':
-                    # 只发给学生
-                    users = User.query.filter(User.is_active == True, User.user_type == 'student').all()
-                else:
-                    # 发给所有用户（包括其他管理员）
-                    users = User.query.filter(User.is_active == True).all()
-                recipient_ids = {u.id for u in users if u.id != sender_id}
+                # 管理员发送全体公告，支持按用户类型筛选（recipient_type 为 teacher / student）
+                mode = 'broadcast'
             elif target == 'users' and user_ids:
-                recipient_ids = set(user_ids)
+                mode = 'users'
             else:
                 return jsonify({'code': 400, 'message': '管理员发送时 target 参数无效'}), 400
 
         elif sender.user_type == 'teacher':
             if target == 'teacher_students':
                 # 教师群发给自己管理的学生
-                managed = TeacherStudent.query.filter_by(teacher_id=sender_id).all()
-                recipient_ids = {ts.student_id for ts in managed}
+                mode = 'teacher_students'
             elif target == 'users' and user_ids:
-                # 验证这些用户是否为教师的学生或允许直接发送
-                recipient_ids = set(user_ids)
+                mode = 'users'
             else:
                 return jsonify({'code': 400, 'message': '教师发送时 target 参数无效'}), 400
         else:
             return jsonify({'code': 403, 'message': '只有教师或管理员可以发送消息'}), 403
 
-        if not recipient_ids:
-            return jsonify({'code': 400, 'message': '接收者为空'}), 400
+        if mode == 'broadcast':
+            # 在开始写入之前统计受众，避免在写事务中做全表计数
+            recipient_count = count_broadcast_audience(sender_id, recipient_type)
+            if not recipient_count:
+                return jsonify({'code': 400, 'message': '接收者为空'}), 400
 
-        # 创建消息
-        msg = db.session.query(db.session.bind.mapper_registry.maps[0].class_).class_ if False else None
-        # 简单创建Message
-        from models import Message, MessageRecipient
-        message = Message(sender_id=sender_id, content=content)
+        from models import Message
+        message = Message(sender_id=sender_id, content=content, created_at=datetime.utcnow())
         db.session.add(message)
         db.session.flush()
 
-        # 为每个接收者创建接收记录
-        recipients = []
-        for rid in recipient_ids:
-            # 跳过不存在的用户
-            user = User.query.get(rid)
-            if not user:
-                continue
-            mr = MessageRecipient(message_id=message.id, recipient_id=rid, is_read=False)
-            recipients.append(mr)
-            db.session.add(mr)
+        if mode == 'broadcast':
+            # 全体公告只写一条记录，接收者访问收件箱时再投递
+            broadcast = create_broadcast(message, recipient_type)
+        elif mode == 'teacher_students':
+            recipient_count = deliver_to_teacher_students(message, sender_id)
+        else:
+            # 一条 INSERT ... SELECT 写入全部接收者，不存在的用户被跳过
+            recipient_count = deliver_to_users(message, user_ids)
+
+        if not recipient_count:
+            db.session.rollback()
+            return jsonify({'code': 400, 'message': '接收者为空'}), 400
 
         db.session.commit()
 
-        logger.info(f'用户 {sender_id} 发送消息 id={message.id} 给 {len(recipients)} 个接收者')
-        return jsonify({'code': 201, 'message': '发送成功', 'data': {'message_id': message.id, 'recipient_count': len(recipients)}}), 201
+        if mode == 'broadcast':
+            events.publish_broadcast(message.id, sender_id, broadcast.audience)
+        else:
+            events.publish_delivered(message.id)
+
+        logger.info(f'用户 {sender_id} 发送消息 id={message.id} 给 {recipient_count} 个接收者')
+        return jsonify({'code': 201, 'message': '发送成功', 'data': {'message_id': message.id, 'recipient_count': recipient_count}}), 201
 
     except Exception as e:
         db.session.rollback()
@@ -843,28 +1002,57 @@ def get_messages():
     """获取当前用户的收件箱消息（分页）"""
     try:
         user_id = int(get_jwt_identity())
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
+        sync_broadcasts(get_current_user())
+        db.session.commit()
 
-        from models import MessageRecipient, Message
-        query = MessageRecipient.query.filter_by(recipient_id=user_id)
-        paginated = query.join(Message, MessageRecipient.message_id == Message.id).order_by(Message.created_at.desc()).paginate(page=page, per_page=per_page)
+        result = paginate(inbox_query(user_id), INBOX_ORDER_KEYS)
 
-        items = [mr.to_dict() for mr in paginated.items]
-        return jsonify({'code': 200, 'message': '获取成功', 'data': {'messages': items, 'total': paginated.total, 'pages': paginated.pages, 'current_page': page}}), 200
+        # 内容为截断后的预览（truncated 表示还有后续），全文通过 /messages/<id> 获取
+        items = [inbox_item(row) for row in result.items]
+        return jsonify({'code': 200, 'message': '获取成功', 'data': {'messages': items, **result.meta()}}), 200
+    except InvalidCursor as e:
+        return jsonify({'code': 400, 'message': str(e)}), 400
     except Exception as e:
         logger.error(f'Get messages error: {str(e)}', exc_info=True)
         return jsonify({'code': 500, 'message': f'获取失败: {str(e)}'}), 500
 
 
+@teacher_bp.route('/messages/<int:message_id>', methods=['GET'])
+@jwt_required()
+def get_message_detail(message_id):
+    """获取收件箱中一条消息的完整内容"""
+    try:
+        user_id = int(get_jwt_identity())
+        from models import MessageRecipient, Message
+        row = inbox_query(user_id).add_columns(Message.content)\
+            .filter(MessageRecipient.message_id == message_id).first()
+        if not row:
+            return jsonify({'code': 404, 'message': '消息不存在或无权访问'}), 404
+
+        item = inbox_item(row)
+        item['content'] = row.content
+        item['truncated'] = False
+        return jsonify({'code': 200, 'message': '获取成功', 'data': item}), 200
+    except Exception as e:
+        logger.error(f'Get message detail error: {str(e)}', exc_info=True)
+        return jsonify({'code': 500, 'message': f'获取失败: {str(e)}'}), 500
+
+
 @teacher_bp.route('/messages/unread-count', methods=['GET'])
 @jwt_required()
 def get_unread_count():
     try:
         user_id = int(get_jwt_identity())
-        from models import MessageRecipient
-        count = MessageRecipient.query.filter_by(recipient_id=user_id, is_read=False).count()
-        return jsonify({'code': 200, 'message': '获取成功', 'data': {'unread': count}}), 200
+        sync_broadcasts(get_current_user())
+        db.session.commit()
+        count = unread_count_for(user_id)
+
+        # 各页面轮询此接口：未读数不变时返回 304
+        response = jsonify({'code': 200, 'message': '获取成功', 'data': {'unread': count}})
+        response.set_etag(f'unread-{user_id}-{count}')
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
     except Exception as e:
         logger.error(f'Get unread count error: {str(e)}', exc_info=True)
         return jsonify({'code': 500, 'message': f'获取失败: {str(e)}'}), 500
@@ -875,20 +1063,64 @@ def get_unread_count():
 def mark_message_read(message_id):
     try:
         user_id = int(get_jwt_identity())
+        sync_broadcasts(get_current_user())
+        db.session.commit()
         from models import MessageRecipient
         mr = MessageRecipient.query.filter_by(message_id=message_id, recipient_id=user_id).first()
         if not mr:
             return jsonify({'code': 404, 'message': '消息不存在或无权访问'}), 404
-        if not mr.is_read:
-            from datetime import datetime
-            mr.is_read = True
-            mr.read_at = datetime.utcnow()
+        if not mr.is_read and mark_read(user_id, message_id):
             db.session.commit()
+            events.publish_to_user(user_id, 'unread', {'unread': unread_count_for(user_id)})
         return jsonify({'code': 200, 'message': '已标记为已读'}), 200
     except Exception as e:
         db.session.rollback()
         logger.error(f'Mark message read error: {str(e)}', exc_info=True)
         return jsonify({'code': 500, 'message': f'标记失败: {str(e)}'}), 500
+
+
+@teacher_bp.route('/messages/read', methods=['PUT'])
+@jwt_required()
+def mark_messages_read():
+    """
+    批量标记已读：message_ids 为消息 id 列表，或用 up_to_id / before（ISO 时间）
+    标记此前的全部消息；返回最新未读数
+    """
+    try:
+        user_id = int(get_jwt_identity())
+        data = request.get_json() or {}
+        message_ids = data.get('message_ids')
+        up_to_id = data.get('up_to_id')
+        before = data.get('before')
+
+        if message_ids is None and up_to_id is None and before is None:
+            return jsonify({'code': 400, 'message': '需要提供 message_ids、up_to_id 或 before'}), 400
+        try:
+            if message_ids is not None:
+                if not isinstance(message_ids, list):
+                    raise ValueError
+                message_ids = [int(i) for i in message_ids]
+            if up_to_id is not None:
+                up_to_id = int(up_to_id)
+            if before is not None:
+                before = datetime.fromisoformat(str(before).replace('Z', '+00:00'))
+                if before.tzinfo is not None:
+                    before = before.astimezone(timezone.utc).replace(tzinfo=None)
+        except (TypeError, ValueError):
+            return jsonify({'code': 400, 'message': '参数格式错误'}), 400
+
+        sync_broadcasts(get_current_user())
+        updated = mark_read_bulk(user_id, message_ids=message_ids, up_to_id=up_to_id, before=before)
+        db.session.commit()
+        unread = unread_count_for(user_id)
+        if updated:
+            events.publish_to_user(user_id, 'unread', {'unread': unread})
+
+        return jsonify({'code': 200, 'message': '已标记为已读', 'data': {'updated': updated, 'unread': unread}}), 200
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f'Mark messages read error: {str(e)}', exc_info=True)
+        return jsonify({'code': 500, 'message': f'标记失败: {str(e)}'}), 500
 # ==================== 教师评价相关接口 ====================
 
 @teacher_bp.route('/my-teachers', methods=['GET'])
@@ -897,31 +1129,23 @@ def get_my_teachers():
     """学生获取自己的教师列表"""
     try:
         student_id = int(get_jwt_identity())
-        user = User.query.get(student_id)
+        user = get_current_user()
         
         if not user or user.user_type != 'student':
             return jsonify({'code': 403, 'message': '只有学生可以查看'}), 403
 
-        # 获取与该学生相关的教师
-        teacher_students = TeacherStudent.query.filter_by(student_id=student_id).all()
-        teachers = []
-        
-        for ts in teacher_students:
-            teacher = User.query.get(ts.teacher_id)
-            if teacher:
-                # 检查是否已经评价过
-                from models import TeacherReview
-                review = TeacherReview.query.filter_by(
-                    student_id=student_id,
-                    teacher_id=ts.teacher_id
-                ).first()
-                
-                teachers.append({
-                    'id': teacher.id,
-                    'username': teacher.username,
-                    'real_name': teacher.real_name,
-                    'reviewed': review is not None
-                })
+        # 与该学生相关的教师及是否已经评价过，一次连接查询取出
+        rows = _my_teachers_query(student_id).all()
+
+        teachers = [
+            {
+                'id': teacher_id,
+                'username': username,
+                'real_name': real_name,
+                'reviewed': review_id is not None
+            }
+            for teacher_id, username, real_name, review_id in rows
+        ]
         
         return jsonify({
             'code': 200,
@@ -939,7 +1163,7 @@ def submit_teacher_review():
     """学生提交对教师的评价"""
     try:
         student_id = int(get_jwt_identity())
-        user = User.query.get(student_id)
+        user = get_current_user()
         
         if not user or user.user_type != 'student':
             return jsonify({'code': 403, 'message': '只有学生可以提交评价'}), 403
@@ -990,6 +1214,10 @@ def submit_teacher_review():
             comment=comment
         )
         db.session.add(review)
+        db.session.flush()
+        # 评价统计与评价在同一事务中更新
+        record_review(teacher_id, rating)
+        invalidate('reviews')
         db.session.commit()
 
         logger.info(f'学生 {student_id} 评价了教师 {teacher_id}，评分: {rating}')
@@ -1010,39 +1238,25 @@ def get_my_reviews():
     """教师查看自己收到的评价汇总"""
     try:
         teacher_id = int(get_jwt_identity())
-        user = User.query.get(teacher_id)
+        user = get_current_user()
         
         if not user or user.user_type != 'teacher':
             return jsonify({'code': 403, 'message': '只有教师可以查看'}), 403
 
-        from models import TeacherReview
-        # 获取所有评价（不显示学生身份）
-        reviews = TeacherReview.query.filter_by(teacher_id=teacher_id).order_by(
-            TeacherReview.created_at.desc()
-        ).all()
-
-        review_list = [review.to_dict() for review in reviews]
-        
-        # 计算统计信息
-        if reviews:
-            avg_rating = sum(r.rating for r in reviews) / len(reviews)
-            rating_dist = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-            for review in reviews:
-                rating_dist[review.rating] += 1
-        else:
-            avg_rating = 0
-            rating_dist = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
+        # 统计信息读取汇总表，评价列表分页返回（不显示学生身份）
+        result = paginate(_reviews_query(teacher_id), REVIEW_ORDER_KEYS)
 
         return jsonify({
             'code': 200,
             'message': '获取成功',
             'data': {
-                'reviews': review_list,
-                'total_count': len(reviews),
-                'avg_rating': round(avg_rating, 1),
-                'rating_distribution': rating_dist
+                'reviews': [review.to_dict() for review in result.items],
+                **get_stats(teacher_id),
+                **result.meta()
             }
         }), 200
+    except InvalidCursor as e:
+        return jsonify({'code': 400, 'message': str(e)}), 400
     except Exception as e:
         logger.error(f'Get my reviews error: {str(e)}', exc_info=True)
         return jsonify({'code': 500, 'message': f'获取失败: {str(e)}'}), 500
@@ -1075,66 +1289,71 @@ def check_review_status():
         return jsonify({'code': 500, 'message': f'获取失败: {str(e)}'}), 500
 
 
+@teacher_bp.route('/reviews/check-status/batch', methods=['GET'])
+@jwt_required()
+def check_review_status_batch():
+    """学生批量检查对多位教师的评价状态，teacher_ids 为逗号分隔的教师 ID"""
+    try:
+        student_id = int(get_jwt_identity())
+        try:
+            teacher_ids = {int(i) for i in request.args.get('teacher_ids', '').split(',') if i.strip()}
+        except ValueError:
+            return jsonify({'code': 400, 'message': '教师ID格式错误'}), 400
+
+        if not teacher_ids:
+            return jsonify({'code': 400, 'message': '教师ID不能为空'}), 400
+        if len(teacher_ids) > current_app.config.get('MAX_PER_PAGE', 100):
+            return jsonify({'code': 400, 'message': '教师ID数量过多'}), 400
+
+        from models import TeacherReview
+        reviewed = {teacher_id for teacher_id, in db.session.query(TeacherReview.teacher_id).filter(
+            TeacherReview.student_id == student_id,
+            TeacherReview.teacher_id.in_(teacher_ids)
+        )}
+
+        return jsonify({
+            'code': 200,
+            'message': '获取成功',
+            'data': {'statuses': {str(teacher_id): teacher_id in reviewed for teacher_id in sorted(teacher_ids)}}
+        }), 200
+    except Exception as e:
+        logger.error(f'Check review status batch error: {str(e)}', exc_info=True)
+        return jsonify({'code': 500, 'message': f'获取失败: {str(e)}'}), 500
+
+
 @teacher_bp.route('/reviews/all-teachers', methods=['GET'])
 @jwt_required()
+@cached(tags=['reviews', 'teacher_students', 'users'])
 def get_all_teachers_ratings():
     """获取所有教师的评价统计（公开展示）"""
     try:
         student_id = int(get_jwt_identity())
-        
-        from models import TeacherReview
-        
-        # 获取所有有评价的教师
-        all_reviews = TeacherReview.query.all()
-        
-        # 按教师分组计算统计
-        teachers_stats = {}
-        
-        for review in all_reviews:
-            teacher_id = review.teacher_id
-            
-            if teacher_id not in teachers_stats:
-                teacher = User.query.get(teacher_id)
-                if teacher and teacher.user_type == 'teacher':
-                    teachers_stats[teacher_id] = {
-                        'id': teacher_id,
-                        'username': teacher.username,
-                        'real_name': teacher.real_name,
-                        'reviews': [],
-                        'total_count': 0,
-                        'avg_rating': 0,
-                        'rating_distribution': {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-                    }
-            
-            if teacher_id in teachers_stats:
-                teachers_stats[teacher_id]['reviews'].append(review.to_dict())
-                teachers_stats[teacher_id]['total_count'] += 1
-                teachers_stats[teacher_id]['rating_distribution'][review.rating] += 1
-        
-        # 计算平均分
-        for teacher_id, stats in teachers_stats.items():
-            if stats['total_count'] > 0:
-                avg = sum(r['rating'] for r in stats['reviews']) / stats['total_count']
-                stats['avg_rating'] = round(avg, 1)
-            # 限制显示的评价数量（只显示最新 3 条）
-            stats['reviews'] = stats['reviews'][:3]
-        
-        # 按平均评分排序，高分在前
-        teachers_list = sorted(
-            list(teachers_stats.values()),
-            key=lambda x: x['avg_rating'],
-            reverse=True
-        )
-        
-        # 检查学生的指导教师（用于标记哪些可以评价）
-        my_teacher_ids = []
-        if student_id:
-            my_teachers = TeacherStudent.query.filter_by(student_id=student_id).all()
-            my_teacher_ids = [ts.teacher_id for ts in my_teachers]
-        
-        # 为每个教师标记是否是学生的指导教师
-        for teacher_stats in teachers_list:
-            teacher_stats['is_my_teacher'] = teacher_stats['id'] in my_teacher_ids
+
+        # 读取有评价的教师的汇总统计，按平均评分排序，高分在前
+        rows = db.session.query(TeacherRatingStats, User.username, User.real_name)\
+            .join(User, User.id == TeacherRatingStats.teacher_id)\
+            .filter(User.user_type == 'teacher', TeacherRatingStats.review_count > 0)\
+            .order_by((TeacherRatingStats.rating_sum * 1.0 / TeacherRatingStats.review_count).desc(),
+                      TeacherRatingStats.teacher_id)\
+            .all()
+
+        # 每位教师只显示最新 3 条评价，一次查询取出
+        reviews = latest_reviews([stats.teacher_id for stats, _, _ in rows], limit=3)
+
+        # 学生的指导教师（用于标记哪些可以评价）
+        my_teacher_ids = {teacher_id for teacher_id, in db.session.query(TeacherStudent.teacher_id)
+                          .filter_by(student_id=student_id)}
+
+        teachers_list = []
+        for stats, username, real_name in rows:
+            teachers_list.append({
+                'id': stats.teacher_id,
+                'username': username,
+                'real_name': real_name,
+                'reviews': [review.to_dict() for review in reviews[stats.teacher_id]],
+                **stats.to_dict(),
+                'is_my_teacher': stats.teacher_id in my_teacher_ids
+            })
         
         return jsonify({
             'code': 200,
@@ -0,0 +1,112 @@
+"""
+当前用户解析 - JWT user_lookup_loader + 进程内用户缓存
+
+- 每个请求只解析一次当前用户：flask_jwt_extended 在 jwt_required 校验时调用 load_user，
+  结果保存在请求上下文中，视图通过 get_current_user() 取得，不再各自查询 users 表
+- 进程内 LRU 缓存用户行（容量 USER_CACHE_SIZE，过期时间 USER_CACHE_TTL 秒），
+  命中时以 merge(load=False) 挂到当前会话，不产生 SQL
+- 任何会话中修改或删除 User 后（更新资料、修改/重置密码、管理员修改/删除用户等），
+  在 flush 和提交时使对应缓存失效；多进程部署下其他进程的缓存最多滞后 USER_CACHE_TTL
+"""
+from collections import OrderedDict
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from models import db, User
+import threading
+import time
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 60  # 秒
+
+_cache = OrderedDict()  # user_id -> (过期时间, 列值)
+_lock = threading.Lock()
+_settings = {'size': DEFAULT_CACHE_SIZE, 'ttl': DEFAULT_CACHE_TTL}
+
+
+def _column_keys():
+    return [attr.key for attr in inspect(User).column_attrs]
+
+
+def _get_cached(user_id):
+    with _lock:
+        entry = _cache.get(user_id)
+        if entry is None:
+            return None
+        expires_at, values = entry
+        if expires_at < time.monotonic():
+            del _cache[user_id]
+            return None
+        _cache.move_to_end(user_id)
+
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def _put(user):
+    if _settings['size'] <= 0:
+        return
+    values = {key: getattr(user, key) for key in _column_keys()}
+    with _lock:
+        _cache[user.id] = (time.monotonic() + _settings['ttl'], values)
+        _cache.move_to_end(user.id)
+        while len(_cache) > _settings['size']:
+            _cache.popitem(last=False)
+
+
+def invalidate_user(user_id):
+    """使一个用户的缓存失效"""
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def clear():
+    """清空缓存"""
+    with _lock:
+        _cache.clear()
+
+
+def load_user(user_id):
+    """按 id 获取用户（优先读缓存），不存在时返回 None"""
+    user = _get_cached(user_id)
+    if user is None:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            _put(user)
+    return user
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_flushed_users(session, flush_context):
+    user_ids = {obj.id for obj in list(session.dirty) + list(session.deleted) if isinstance(obj, User)}
+    if user_ids:
+        for user_id in user_ids:
+            invalidate_user(user_id)
+        # 提交时再失效一次：flush 与 commit 之间其他请求可能读到并缓存了旧数据
+        session.info.setdefault('_invalidated_user_ids', set()).update(user_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_users(session):
+    for user_id in session.info.pop('_invalidated_user_ids', ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidated_users(session):
+    session.info.pop('_invalidated_user_ids', None)
+
+
+def init_app(app, jwt):
+    """注册 JWT 当前用户加载回调"""
+    _settings['size'] = app.config.get('USER_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+    _settings['ttl'] = app.config.get('USER_CACHE_TTL', DEFAULT_CACHE_TTL)
+    clear()
+
+    @jwt.user_lookup_loader
+    def _user_lookup(jwt_header, jwt_data):
+        return load_user(int(jwt_data[app.config.get('JWT_IDENTITY_CLAIM', 'sub')]))
+
+    @jwt.user_lookup_error_loader
+    def _user_lookup_error(jwt_header, jwt_data):
+        return {'code': 404, 'message': '用户不存在'}, 404
@@ -0,0 +1,12 @@
+"""
+生产环境 WSGI 入口
+
+    flask --app wsgi init-db                 # 部署时执行一次：建表、默认管理员、全文索引
+    gunicorn -c gunicorn.conf.py wsgi:app    # 多 worker 启动，配置见 gunicorn.conf.py
+
+默认使用 production 配置，可通过 FLASK_ENV 指定。
+"""
+import os
+from app import create_app
+
+app = create_app(os.environ.get('FLASK_ENV', 'production'))
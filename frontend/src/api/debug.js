@@ -0,0 +1,13 @@
+import api from './index'
+
+export const debugAPI = {
+  // SQL 统计（仅管理员）：各接口的查询数、耗时、N+1 语句和最慢的语句
+  getSqlStats() {
+    return api.get('/debug/sql-stats')
+  },
+
+  // 清空 SQL 统计
+  resetSqlStats() {
+    return api.delete('/debug/sql-stats')
+  }
+}
@@ -0,0 +1,109 @@
+import api, { API_BASE_URL } from './index'
+import { messagesAPI } from './messages'
+import { useAuthStore } from '@/stores/auth'
+
+// 推送不可用时获取未读数的间隔（毫秒）
+const POLL_INTERVAL = 30000
+// 连接正常结束或断开后重新连接的等待时间（毫秒）
+const RECONNECT_DELAY = 3000
+
+// 服务器推送事件：unread / message / broadcast / question_message
+// EventSource 不能设置请求头，令牌只能放在 URL 中：每次连接前先用访问令牌换取短时有效、
+// 只能用于事件流的令牌，访问令牌不出现在 URL 和日志中。事件流令牌只在建立连接时有效，
+// 因此不使用浏览器的自动重连，断开后换新令牌重新连接。
+// 浏览器不支持或服务端拒绝连接（多 worker 部署未启用 Redis、事件流连接已满时返回 503）时，
+// 改为定时获取未读数：未读数增加时按 message 事件通知，否则按 unread 事件通知；
+// 轮询期间每次同时重试建立连接，连接成功后停止轮询
+export const subscribeEvents = (handlers = {}) => {
+  const authStore = useAuthStore()
+  if (!authStore.accessToken) {
+    return () => {}
+  }
+
+  const supported = typeof EventSource !== 'undefined'
+  let source = null
+  let connecting = false
+  let closed = false
+  let pollTimer = null
+  let reconnectTimer = null
+  let lastUnread = null
+
+  const poll = async () => {
+    try {
+      const response = await messagesAPI.getUnreadCount()
+      if (response.data.code !== 200) return
+      const unread = response.data.data.unread
+      if (lastUnread !== null && unread > lastUnread) {
+        handlers.message?.({ unread })
+      } else {
+        handlers.unread?.({ unread })
+      }
+      lastUnread = unread
+    } catch (error) {
+      console.error('Poll unread count error:', error)
+    }
+  }
+
+  const stopPolling = () => {
+    clearInterval(pollTimer)
+    pollTimer = null
+  }
+
+  const connect = async () => {
+    if (connecting || closed) return
+    connecting = true
+    let token
+    try {
+      const response = await api.post('/events/token')
+      token = response.data.data.token
+    } catch (error) {
+      startPolling()
+      return
+    } finally {
+      connecting = false
+    }
+    if (closed) return
+
+    const current = new EventSource(`${API_BASE_URL}/events?token=${encodeURIComponent(token)}`)
+    let opened = false
+    Object.entries(handlers).forEach(([name, handler]) => {
+      current.addEventListener(name, event => handler(JSON.parse(event.data)))
+    })
+    current.addEventListener('open', () => {
+      opened = true
+      stopPolling()
+    })
+    current.addEventListener('error', () => {
+      current.close()
+      if (closed) return
+      if (opened) {
+        reconnectTimer = setTimeout(connect, RECONNECT_DELAY)
+      } else {
+        startPolling()
+      }
+    })
+    source = current
+  }
+
+  const startPolling = () => {
+    if (pollTimer || closed) return
+    poll()
+    pollTimer = setInterval(() => {
+      poll()
+      if (supported && (!source || source.readyState === EventSource.CLOSED)) connect()
+    }, POLL_INTERVAL)
+  }
+
+  if (supported) {
+    connect()
+  } else {
+    startPolling()
+  }
+
+  return () => {
+    closed = true
+    if (source) source.close()
+    clearTimeout(reconnectTimer)
+    stopPolling()
+  }
+}
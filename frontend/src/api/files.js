@@ -1,8 +1,16 @@
 import api from './index'
 
+// 超过该大小的文件使用分块上传，断线后只需重传当前分块
+const CHUNKED_UPLOAD_THRESHOLD = 5 * 1024 * 1024
+const CHUNK_MAX_RETRIES = 3
+
 export const filesAPI = {
   // 上传文件
   uploadFile(file, description = '', isPublic = false, documentType = '', submissionStage = '') {
+    if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+      return this.uploadFileChunked(file, description, isPublic, documentType, submissionStage)
+    }
+
     const formData = new FormData()
     formData.append('file', file)
     formData.append('description', description)
@@ -17,6 +25,42 @@ export const filesAPI = {
     return api.post('/files/upload', formData)
   },
 
+  // 分块上传文件：创建会话 -> 逐块 PUT -> 完成，返回与 uploadFile 相同的响应
+  async uploadFileChunked(file, description = '', isPublic = false, documentType = '', submissionStage = '') {
+    const initResponse = await api.post('/files/uploads', {
+      filename: file.name,
+      file_size: file.size,
+      description,
+      is_public: isPublic,
+      document_type: documentType,
+      submission_stage: submissionStage
+    })
+    const { upload_id: uploadId, chunk_size: chunkSize } = initResponse.data.data
+
+    let offset = 0
+    let retries = 0
+    while (offset < file.size) {
+      const chunk = file.slice(offset, offset + chunkSize)
+      try {
+        const response = await api.put(
+          `/files/uploads/${uploadId}/chunks/${Math.floor(offset / chunkSize)}`,
+          chunk,
+          { params: { offset }, headers: { 'Content-Type': 'application/octet-stream' } }
+        )
+        offset = response.data.data.received_size
+        retries = 0
+      } catch (error) {
+        if (retries >= CHUNK_MAX_RETRIES) throw error
+        retries += 1
+        // 以服务端记录的进度为准续传
+        const status = await api.get(`/files/uploads/${uploadId}`)
+        offset = status.data.data.received_size
+      }
+    }
+
+    return api.post(`/files/uploads/${uploadId}/complete`)
+  },
+
   // 获取文件列表
   getFiles(page = 1, perPage = 10) {
     return api.get('/files/list', {
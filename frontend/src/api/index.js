@@ -16,7 +16,7 @@ const getAPIBaseURL = () => {
   return `${protocol}//${hostname}:${port}/api`
 }
 
-const API_BASE_URL = getAPIBaseURL()
+export const API_BASE_URL = getAPIBaseURL()
 
 const api = axios.create({
   baseURL: API_BASE_URL,
@@ -5,6 +5,10 @@ export const messagesAPI = {
     return api.get('/teacher/messages', { params: { page, per_page: perPage }})
   },
 
+  getMessage(messageId) {
+    return api.get(`/teacher/messages/${messageId}`)
+  },
+
   getUnreadCount() {
     return api.get('/teacher/messages/unread-count')
   },
@@ -13,6 +17,11 @@ export const messagesAPI = {
     return api.put(`/teacher/messages/${messageId}/read`)
   },
 
+  // payload: { message_ids } 或 { up_to_id } / { before }
+  markReadBulk(payload) {
+    return api.put('/teacher/messages/read', payload)
+  },
+
   sendMessage(payload) {
     return api.post('/teacher/messages/send', payload)
   }
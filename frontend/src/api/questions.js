@@ -9,6 +9,16 @@ export const getQuestions = (params) => {
   return api.get('/questions', { params });
 };
 
+/**
+ * 在问题标题和对话消息中全文检索，结果按相关度排序并带有高亮片段
+ * @param {string} keyword - 搜索关键词
+ * @param {object} params - 分页参数，例如 { page, per_page }
+ * @returns {Promise}
+ */
+export const searchQuestions = (keyword, params = {}) => {
+  return api.get('/questions/search', { params: { ...params, keyword } });
+};
+
 /**
  * 获取单个问题（对话线程）的详细信息，包括所有消息
  * @param {number} questionId - 问题ID
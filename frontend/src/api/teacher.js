@@ -39,9 +39,20 @@ export const teacherAPI = {
     })
   },
 
-  // 管理员获取所有教师及其学生
-  adminGetTeacherStudents() {
-    return api.get('/teacher/admin/teacher-students')
+  // 管理员获取教师及其学生（按教师分页，可按学生的学院 / 专业筛选）
+  adminGetTeacherStudents(page = 1, perPage = 10, college = '', major = '') {
+    return api.get('/teacher/admin/teacher-students', {
+      params: { page, per_page: perPage, college, major }
+    })
+  },
+
+  // 管理员导出全部教师及其学生（JSON 文件）
+  adminExportTeacherStudents(college = '', major = '') {
+    return api.get('/teacher/admin/teacher-students/export', {
+      params: { college, major },
+      responseType: 'blob',
+      timeout: 0
+    })
   },
 
   // 管理员创建用户
@@ -68,6 +79,15 @@ export const teacherAPI = {
     })
   },
 
+  // 按相同筛选条件打包导出学生文档（ZIP）
+  exportStudentDocuments(studentId = null, documentType = '', submissionStage = '') {
+    return api.get('/teacher/student-documents/export', {
+      params: { student_id: studentId, document_type: documentType, submission_stage: submissionStage },
+      responseType: 'blob',
+      timeout: 0
+    })
+  },
+
   // 添加文档评价
   addDocumentFeedback(docId, feedback) {
     return api.put(`/teacher/student-documents/${docId}/feedback`, { feedback })
@@ -109,8 +129,8 @@ export const teacherAPI = {
   },
 
   // 教师查看自己收到的评价汇总
-  getMyReviews() {
-    return api.get('/teacher/reviews/for-me')
+  getMyReviews(page = 1, perPage = 10) {
+    return api.get('/teacher/reviews/for-me', { params: { page, per_page: perPage } })
   },
 
   // 学生检查对某教师的评价状态
@@ -120,6 +140,13 @@ export const teacherAPI = {
     })
   },
 
+  // 学生批量检查对多位教师的评价状态，返回 { statuses: { 教师ID: 是否已评价 } }
+  checkReviewStatusBatch(teacherIds) {
+    return api.get('/teacher/reviews/check-status/batch', {
+      params: { teacher_ids: teacherIds.join(',') }
+    })
+  },
+
   // 获取所有教师的评价统计（公开展示）
   getAllTeachersRatings() {
     return api.get('/teacher/reviews/all-teachers')